@@ -0,0 +1,153 @@
+import math
+from bisect import bisect_left
+import numpy as np
+
+# US EPA AQI breakpoints: (C_lo, C_hi, I_lo, I_hi) per band.
+# PM2.5 / PM10 in µg/m³ (24-hour), O3 in ppm (8-hour), CO in ppm (8-hour),
+# SO2 / NO2 in ppb (1-hour). Only pollutants present in a reading count.
+BREAKPOINTS = {
+    'pm2_5': [
+        (0.0, 12.0, 0, 50),
+        (12.1, 35.4, 51, 100),
+        (35.5, 55.4, 101, 150),
+        (55.5, 150.4, 151, 200),
+        (150.5, 250.4, 201, 300),
+        (250.5, 350.4, 301, 400),
+        (350.5, 500.4, 401, 500),
+    ],
+    'pm10': [
+        (0, 54, 0, 50),
+        (55, 154, 51, 100),
+        (155, 254, 101, 150),
+        (255, 354, 151, 200),
+        (355, 424, 201, 300),
+        (425, 504, 301, 400),
+        (505, 604, 401, 500),
+    ],
+    'o3': [
+        (0.000, 0.054, 0, 50),
+        (0.055, 0.070, 51, 100),
+        (0.071, 0.085, 101, 150),
+        (0.086, 0.105, 151, 200),
+        (0.106, 0.200, 201, 300),
+    ],
+    'co': [
+        (0.0, 4.4, 0, 50),
+        (4.5, 9.4, 51, 100),
+        (9.5, 12.4, 101, 150),
+        (12.5, 15.4, 151, 200),
+        (15.5, 30.4, 201, 300),
+        (30.5, 40.4, 301, 400),
+        (40.5, 50.4, 401, 500),
+    ],
+    'so2': [
+        (0, 35, 0, 50),
+        (36, 75, 51, 100),
+        (76, 185, 101, 150),
+        (186, 304, 151, 200),
+        (305, 604, 201, 300),
+        (605, 804, 301, 400),
+        (805, 1004, 401, 500),
+    ],
+    'no2': [
+        (0, 53, 0, 50),
+        (54, 100, 51, 100),
+        (101, 360, 101, 150),
+        (361, 649, 151, 200),
+        (650, 1249, 201, 300),
+        (1250, 1649, 301, 400),
+        (1650, 2049, 401, 500),
+    ],
+}
+
+# Decimal places concentrations are truncated to before lookup (per EPA)
+PRECISION = {'pm2_5': 1, 'pm10': 0, 'o3': 3, 'co': 1, 'so2': 0, 'no2': 0}
+
+CATEGORIES = [
+    (50, 'Good'),
+    (100, 'Moderate'),
+    (150, 'Unhealthy for Sensitive Groups'),
+    (200, 'Unhealthy'),
+    (300, 'Very Unhealthy'),
+    (500, 'Hazardous'),
+]
+
+
+class _Table:
+    """One pollutant's breakpoints as arrays for vectorized lookup."""
+
+    def __init__(self, bands, digits):
+        self.bands = bands
+        self.highs = [band[1] for band in bands]
+        c_lo, c_hi, i_lo, i_hi = (np.array(column, dtype=float) for column in zip(*bands))
+        self.c_lo, self.c_hi = c_lo, c_hi
+        self.i_lo = i_lo
+        self.slope = (i_hi - i_lo) / (c_hi - c_lo)
+        self.scale = 10.0 ** digits
+        self.i_max = i_hi[-1]
+
+    def sub_index(self, concentrations):
+        c = np.asarray(concentrations, dtype=float)
+        # Truncate to the reporting precision so values between bands (e.g. 12.05) fall in the lower one
+        c = np.floor(np.clip(c, 0.0, None) * self.scale + 1e-9) / self.scale
+        band = np.minimum(np.searchsorted(self.c_hi, c, side='left'), len(self.c_hi) - 1)
+        index = self.slope[band] * (c - self.c_lo[band]) + self.i_lo[band]
+        # Beyond the highest breakpoint the index is capped at the top of the scale
+        return np.where(c > self.c_hi[-1], self.i_max, index)
+
+    def sub_index_scalar(self, c):
+        """Same lookup for one value, without array overhead."""
+        c = math.floor(max(c, 0.0) * self.scale + 1e-9) / self.scale
+        if c > self.highs[-1]:
+            return self.i_max
+        c_lo, c_hi, i_lo, i_hi = self.bands[bisect_left(self.highs, c)]
+        return (i_hi - i_lo) / (c_hi - c_lo) * (c - c_lo) + i_lo
+
+
+_TABLES = {name: _Table(bands, PRECISION[name]) for name, bands in BREAKPOINTS.items()}
+
+
+def sub_index(pollutant, concentrations):
+    """AQI sub-index for one pollutant; accepts scalars or arrays, NaN stays NaN."""
+    return _TABLES[pollutant].sub_index(concentrations)
+
+
+def aqi_array(columns):
+    """
+    Overall AQI for many readings at once.
+
+    `columns` maps pollutant names to equal-length arrays (a DataFrame works
+    too); unknown names are ignored. Returns the rounded maximum sub-index per
+    row as floats, NaN where no pollutant has a value.
+    """
+    indexes = [sub_index(name, columns[name]) for name in _TABLES if name in columns]
+    if not indexes:
+        return np.array([])
+    stacked = np.vstack([np.atleast_1d(np.asarray(index, dtype=float)) for index in indexes])
+    with np.errstate(invalid='ignore'):
+        overall = np.fmax.reduce(stacked, axis=0)
+    return np.floor(overall + 0.5)
+
+
+def compute_aqi(reading):
+    """Overall AQI of one reading as an int; missing PM values count as 0."""
+    overall = 0.0
+    for name, table in _TABLES.items():
+        value = reading.get(name)
+        if value is None:
+            continue
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            continue
+        if math.isfinite(value):
+            overall = max(overall, table.sub_index_scalar(value))
+    return int(math.floor(overall + 0.5))
+
+
+def aqi_category(aqi):
+    """EPA category label for an AQI value."""
+    for upper, label in CATEGORIES:
+        if aqi <= upper:
+            return label
+    return CATEGORIES[-1][1]
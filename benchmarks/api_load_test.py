@@ -0,0 +1,141 @@
+"""
+API load test: requests/sec versus number of gunicorn workers.
+
+Publishes synthetic device state into a temporary STATE_DIR (as the ingest
+process would), starts `gunicorn wsgi:app` with 1, 2, 4... workers and
+hammers the read endpoints from several client processes over keep-alive
+connections. `--dev` adds the Flask development server as a baseline.
+
+Usage: python benchmarks/api_load_test.py [--workers 1,2,4] [--clients 8] [--seconds 10] [--dev]
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+import multiprocessing
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from devices import DeviceRegistry  # noqa: E402
+from shared_state import StatePublisher  # noqa: E402
+from startup_benchmark import synthetic_rows  # noqa: E402
+
+ENDPOINTS = ['/api/data', '/api/predict', '/api/forecast/24h', '/api/history?resolution=hour']
+
+
+def publish_state(state_dir, rows, devices):
+    registry = DeviceRegistry()
+    df = pd.DataFrame(synthetic_rows(rows, devices))
+    df['timestamp'] = pd.to_datetime(df['timestamp'])
+    registry.seed_frame(df)
+    publisher = StatePublisher(state_dir, registry, threading.Lock())
+    publisher.publish([device.device_id for device in registry.devices()])
+
+
+def wait_ready(port, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            conn.request('GET', '/api/devices')
+            if conn.getresponse().status == 200:
+                return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def client(args):
+    port, seconds, endpoints = args
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + seconds
+    i = 0
+    while time.perf_counter() < deadline:
+        path = endpoints[i % len(endpoints)]
+        i += 1
+        started = time.perf_counter()
+        try:
+            conn.request('GET', path)
+            response = conn.getresponse()
+            response.read()
+            if response.status != 200:
+                errors += 1
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            conn.close()
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+            continue
+        latencies.append(time.perf_counter() - started)
+    return latencies, errors
+
+
+def run_load(port, clients, seconds, endpoints):
+    with multiprocessing.Pool(clients) as pool:
+        results = pool.map(client, [(port, seconds, endpoints)] * clients)
+    latencies = np.concatenate([np.array(r[0]) for r in results]) if results else np.array([])
+    errors = sum(r[1] for r in results)
+    return {
+        'requests': len(latencies),
+        'rps': len(latencies) / seconds,
+        'p50_ms': np.percentile(latencies, 50) * 1000 if len(latencies) else float('nan'),
+        'p99_ms': np.percentile(latencies, 99) * 1000 if len(latencies) else float('nan'),
+        'errors': errors,
+    }
+
+
+def serve(command, env, port, args):
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not wait_ready(port):
+            raise RuntimeError(f"server did not start: {' '.join(command)}")
+        return run_load(port, args.clients, args.seconds, ENDPOINTS)
+    finally:
+        process.terminate()
+        process.wait(10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', default='1,2,4')
+    parser.add_argument('--threads', type=int, default=4, help='gthread threads per worker')
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--devices', type=int, default=10)
+    parser.add_argument('--port', type=int, default=5099)
+    parser.add_argument('--dev', action='store_true', help='also measure the Flask development server')
+    args = parser.parse_args()
+
+    state_dir = tempfile.mkdtemp(prefix='aq-state-')
+    try:
+        publish_state(state_dir, args.rows, args.devices)
+        env = dict(os.environ, PIPELINE_ROLE='api', STATE_DIR=state_dir, API_PORT=str(args.port),
+                   STORAGE_DIR=os.path.join(state_dir, 'store'))
+
+        results = []
+        if args.dev:
+            results.append(('flask dev server', serve([sys.executable, 'mqtt_pipeline.py'], env, args.port, args)))
+        for workers in [int(w) for w in args.workers.split(',')]:
+            command = [sys.executable, '-m', 'gunicorn', '-w', str(workers), '-k', 'gthread',
+                       '--threads', str(args.threads), '-b', f'127.0.0.1:{args.port}', 'wsgi:app']
+            results.append((f'gunicorn -w {workers}', serve(command, env, args.port, args)))
+
+        print(f"{args.clients} clients, {args.seconds:.0f}s per run, {os.cpu_count()} CPU(s), endpoints: {', '.join(ENDPOINTS)}")
+        print(f"{'server':<20} {'req/s':>10} {'p50 ms':>10} {'p99 ms':>10} {'errors':>8}")
+        for name, r in results:
+            print(f"{name:<20} {r['rps']:>10.0f} {r['p50_ms']:>10.2f} {r['p99_ms']:>10.2f} {r['errors']:>8}")
+    finally:
+        shutil.rmtree(state_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Cross-validation wall time: refitting per fold vs. prefix statistics.
+
+Times walk-forward CV of one target of train_model.py's feature matrix on
+a large synthetic sensor history, for an increasing number of folds:
+  - refit:  TimeSeriesSplit + a LinearRegression fit per fold (what
+            train_linear_regression.py did)
+  - prefix: cross_validation.walk_forward (block statistics once, every
+            fold solved from their prefix sums)
+and checks that both give the same fold RMSEs.
+
+Usage: python benchmarks/cv_benchmark.py [--rows 500000] [--folds 5 20 100]
+"""
+import os
+import sys
+import time
+import argparse
+import warnings
+import numpy as np
+from sklearn.model_selection import TimeSeriesSplit
+from sklearn.linear_model import LinearRegression
+from sklearn.metrics import mean_squared_error
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS, '..'))
+sys.path.insert(0, BENCHMARKS)
+
+import train_model  # noqa: E402
+from cross_validation import BlockMoments, fold_bounds, walk_forward  # noqa: E402
+from training_benchmark import synthetic_frame  # noqa: E402
+
+warnings.filterwarnings('ignore')
+
+
+def refit(X, y, n_splits):
+    scores = []
+    for train_idx, val_idx in TimeSeriesSplit(n_splits=n_splits).split(X):
+        model = LinearRegression(fit_intercept=True, n_jobs=-1)
+        model.fit(X[train_idx], y[train_idx])
+        scores.append(np.sqrt(mean_squared_error(y[val_idx], model.predict(X[val_idx]))))
+    return np.array(scores)
+
+
+def prefix(X, y, n_splits):
+    blocks = BlockMoments.of(np.column_stack([X, y]), fold_bounds(len(X), n_splits))
+    return walk_forward(blocks, list(range(X.shape[1])), X.shape[1])['rmse'].to_numpy()
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - started, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=500000)
+    parser.add_argument('--folds', type=int, nargs='+', default=[5, 20, 100])
+    args = parser.parse_args()
+
+    df = synthetic_frame(args.rows)
+    cols = list(df.columns)
+    matrix, names = train_model.build_feature_matrix(df, cols)
+    lookup = {name: i for i, name in enumerate(names)}
+    target = cols[0]
+    X = matrix[:, [lookup[name] for name in train_model.target_features(target, cols)]]
+    y = matrix[:, lookup[target]]
+
+    print(f"rows: {len(X):,} x {X.shape[1]} features ({target}), {os.cpu_count()} CPU(s)")
+    print(f"{'folds':>6} {'refit s':>9} {'prefix s':>9} {'speedup':>8} {'max rel diff':>13}")
+    for n_splits in args.folds:
+        refit_seconds, expected = timed(refit, X, y, n_splits)
+        prefix_seconds, actual = timed(prefix, X, y, n_splits)
+        diff = float(np.max(np.abs(actual - expected) / expected))
+        print(f"{n_splits:>6} {refit_seconds:>9.2f} {prefix_seconds:>9.3f} "
+              f"{refit_seconds / prefix_seconds:>7.0f}x {diff:>13.2e}")
+
+
+if __name__ == '__main__':
+    main()
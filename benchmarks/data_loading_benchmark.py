@@ -0,0 +1,119 @@
+"""
+Training data load time: pd.read_excel vs. the Parquet loader.
+
+Writes a synthetic sensor history shaped like sensor_data.xlsx (TTN
+envelope text columns plus the numeric sensor fields) as a workbook,
+converts it with training_data.convert_excel and times:
+  - excel:    pd.read_excel of the whole workbook (what train_model.py did)
+  - parquet:  load_training_data of the sensor columns (memory-mapped)
+  - window:   the same for the last --window-days days only (row groups
+              outside the range are skipped)
+then repeats the Parquet loads at --parquet-rows, beyond Excel's row limit.
+
+Usage: python benchmarks/data_loading_benchmark.py [--rows 50000] [--parquet-rows 5000000]
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS, '..'))
+sys.path.insert(0, BENCHMARKS)
+
+import training_data  # noqa: E402
+from training_benchmark import synthetic_frame  # noqa: E402
+from features import SENSOR_FIELDS  # noqa: E402
+
+ENVELOPE = "{'session_key_id': 'AZrtoDdhtCLdXJTotXARqw==', 'f_port': 85, 'f_cnt': %d, 'frm_payload': 'AXVkA2dYAQRoTQ==', 'rx_metadata': [{'gateway_ids': {'gateway_id': 'gw-1'}, 'rssi': -97, 'snr': 7.5}]}"
+
+
+def workbook_frame(n, seed=0):
+    """Stored uplinks as the pipeline exports them: envelope text plus sensor columns."""
+    sensors = synthetic_frame(n, seed)
+    df = pd.DataFrame({
+        'end_device_ids': "{'device_id': 'ambience-3', 'application_ids': {'application_id': 'aq'}}",
+        'correlation_ids': [f"['gs:uplink:{i:026d}']" for i in range(n)],
+        'received_at': sensors.index.strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+        'uplink_message': [ENVELOPE % i for i in range(n)],
+        'timestamp': sensors.index,
+        'battery': 90.0,
+        'light_level': 4.0,
+        'pir': 'idle',
+        'pressure': 946.8,
+    })
+    for col in SENSOR_FIELDS:
+        df[col] = sensors[col].to_numpy()
+    return df
+
+
+def timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - started, result
+
+
+def parquet_loads(path, window_days):
+    full_seconds, df = timed(training_data.load_training_data, path, columns=SENSOR_FIELDS)
+    start = df['timestamp'].max() - pd.Timedelta(days=window_days)
+    window_seconds, window = timed(training_data.load_training_data, path, columns=SENSOR_FIELDS, start=start)
+    return (full_seconds, df), (window_seconds, window)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=50000, help='rows in the workbook (Excel holds at most 1,048,575)')
+    parser.add_argument('--parquet-rows', type=int, default=5000000, help='rows for the Parquet-only run (0 = skip)')
+    parser.add_argument('--window-days', type=float, default=1.0)
+    parser.add_argument('--chunk-rows', type=int, default=training_data.CHUNK_ROWS)
+    args = parser.parse_args()
+
+    work = tempfile.mkdtemp(prefix='aq-load-')
+    try:
+        workbook = os.path.join(work, 'history.xlsx')
+        workbook_frame(args.rows).to_excel(workbook, index=False)
+        excel_seconds, excel_df = timed(pd.read_excel, workbook)
+        convert_seconds, parquet = timed(training_data.convert_excel, workbook, chunk_rows=args.chunk_rows)
+        (full_seconds, df), (window_seconds, window) = parquet_loads(parquet, args.window_days)
+
+        # Same sensor values either way
+        expected = excel_df[SENSOR_FIELDS].to_numpy(dtype=float)
+        assert np.allclose(df[SENSOR_FIELDS].to_numpy(dtype=float), expected, equal_nan=True)
+
+        print(f"{args.rows:,} rows, {excel_df.shape[1]} columns in the workbook, {os.cpu_count()} CPU(s)")
+        print(f"{'load':<28} {'seconds':>9} {'rows':>10} {'frame MB':>9}")
+        rows = [
+            ('pd.read_excel (all columns)', excel_seconds, excel_df),
+            ('parquet, sensor columns', full_seconds, df),
+            (f'parquet, last {args.window_days:g} day(s)', window_seconds, window),
+        ]
+        for name, seconds, frame in rows:
+            print(f"{name:<28} {seconds:>9.3f} {len(frame):>10,} {frame.memory_usage(deep=True).sum() / 2**20:>9.1f}")
+        print(f"speedup over read_excel: {excel_seconds / full_seconds:,.0f}x "
+              f"(one-off conversion: {convert_seconds:.2f} s, {os.path.getsize(parquet) / 2**20:.1f} MB "
+              f"vs {os.path.getsize(workbook) / 2**20:.1f} MB)")
+
+        if args.parquet_rows:
+            big = os.path.join(work, 'big.parquet')
+            frame = workbook_frame(args.parquet_rows)
+            frame['received_at'] = training_data.to_datetimes(frame['received_at'])
+            pq.write_table(pa.Table.from_pandas(frame, preserve_index=False), big, row_group_size=args.chunk_rows)
+            del frame
+            (full_seconds, df), (window_seconds, window) = parquet_loads(big, args.window_days)
+            print(f"\n{args.parquet_rows:,} rows (Parquet only, {os.path.getsize(big) / 2**20:.0f} MB on disk)")
+            print(f"{'parquet, sensor columns':<28} {full_seconds:>9.3f} {len(df):>10,} "
+                  f"{df.memory_usage(deep=True).sum() / 2**20:>9.1f}")
+            print(f"{f'parquet, last {args.window_days:g} day(s)':<28} {window_seconds:>9.3f} {len(window):>10,} "
+                  f"{window.memory_usage(deep=True).sum() / 2**20:>9.1f}")
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,284 @@
+"""
+Ingest throughput and API latency as history grows.
+
+Runs mqtt_pipeline.py in-process from a scratch directory (empty segment
+store, the repo's trained models) and measures:
+  - direct: on_message called for every payload, timed per call
+  - broker: start_mqtt() subscribed to a local broker (mqtt_stub_broker.py
+            in a child process, or --broker host:port for e.g. mosquitto),
+            timed from publish to the end of on_message.
+            Unpaced by default, so p99 includes queueing; --rate paces it.
+  - api:    at each history size in --steps, client processes hit the API
+            over HTTP for --seconds while uplinks keep arriving at
+            --live-rate; reports p50/p99 latency, req/s and process RSS
+
+Payloads are synthetic TTN uplinks 30 s apart, or recorded ones from
+--payloads (one uplink JSON per line, replayed in a loop).
+
+Usage: python benchmarks/ingest_benchmark.py [--messages 20000] [--steps 20000,100000,300000]
+       [--clients 4] [--seconds 5] [--broker host:port] [--payloads uplinks.jsonl]
+"""
+import os
+import sys
+import time
+import types
+import shutil
+import socket
+import logging
+import argparse
+import tempfile
+import threading
+import subprocess
+import numpy as np
+import pandas as pd
+import paho.mqtt.client as mqtt
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(BENCHMARKS, '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCHMARKS)
+
+from api_load_test import run_load  # noqa: E402
+from uplink_parser_benchmark import ttn_payload  # noqa: E402
+
+TOPIC = 'v3/bench@ttn/devices/+/up'
+ENDPOINTS = ['/api/data', '/api/predict', '/api/forecast/24h', '/api/history?resolution=hour',
+             '/api/history?resolution=raw']
+
+
+class Payloads:
+    """Endless stream of uplinks: synthetic, or replayed from a recording."""
+
+    def __init__(self, devices, recorded=None, seed=0):
+        self.devices = devices
+        self.recorded = recorded
+        self.rng = np.random.default_rng(seed)
+        self.start = pd.Timestamp('2025-01-01')
+        self.sent = 0
+
+    def take(self, n):
+        if self.recorded:
+            batch = [self.recorded[(self.sent + i) % len(self.recorded)] for i in range(n)]
+        else:
+            batch = [ttn_payload(self.sent + i, self.rng, self.devices,
+                                 timestamp=(self.start + pd.Timedelta(seconds=30 * (self.sent + i))).isoformat())
+                     for i in range(n)]
+        self.sent += n
+        return batch
+
+
+def rss_mb():
+    """Current resident set size of this process."""
+    try:
+        with open('/proc/self/status') as fh:
+            for line in fh:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def summarize(latencies, seconds):
+    latencies = np.asarray(latencies)
+    return {
+        'messages': len(latencies),
+        'per_second': len(latencies) / seconds if seconds else float('nan'),
+        'p50_ms': np.percentile(latencies, 50) * 1000 if len(latencies) else float('nan'),
+        'p99_ms': np.percentile(latencies, 99) * 1000 if len(latencies) else float('nan'),
+    }
+
+
+def message(payload, device_id='bench'):
+    return types.SimpleNamespace(payload=payload, topic=f'v3/bench@ttn/devices/{device_id}/up')
+
+
+def run_direct(pipeline, payloads):
+    latencies = []
+    started = time.perf_counter()
+    for payload in payloads:
+        t = time.perf_counter()
+        pipeline.on_message(None, None, message(payload))
+        latencies.append(time.perf_counter() - t)
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def run_broker(pipeline, payloads, host, port, rate):
+    """Publishes through a broker to the pipeline's own MQTT client (start_mqtt)."""
+    done = []
+    handle = pipeline.on_message
+
+    def timed(client, userdata, msg):
+        handle(client, userdata, msg)
+        done.append(time.perf_counter())
+
+    # start_mqtt() picks up the module-level callback when it connects
+    pipeline.on_message = timed
+    threading.Thread(target=pipeline.start_mqtt, name="pipeline-mqtt", daemon=True).start()
+
+    publisher = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+    publisher.connect(host, port)
+    publisher.loop_start()
+    topic = TOPIC.replace('+', 'bench')
+
+    # Wait until the pipeline's subscription is live
+    deadline = time.time() + 10
+    while not done and time.time() < deadline:
+        publisher.publish(topic, payloads[0])
+        time.sleep(0.05)
+    if not done:
+        raise RuntimeError(f"no messages came back through the broker at {host}:{port}")
+    time.sleep(0.2)
+    del done[:]
+
+    sent = []
+    started = time.perf_counter()
+    for i, payload in enumerate(payloads):
+        if rate:
+            # Paced: wait for this message's slot
+            delay = started + i / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        sent.append(time.perf_counter())
+        publisher.publish(topic, payload)
+    deadline = time.time() + 60
+    while len(done) < len(payloads) and time.time() < deadline:
+        time.sleep(0.01)
+    elapsed = (done[-1] if done else time.perf_counter()) - started
+    publisher.loop_stop()
+    publisher.disconnect()
+    pipeline.on_message = handle
+
+    # QoS 0 over one connection arrives in order, so the i-th done is the i-th sent
+    result = summarize([d - s for s, d in zip(sent, done)], elapsed)
+    result['lost'] = len(payloads) - len(done)
+    return result
+
+
+def live_ingest(pipeline, source, rate, stop):
+    """Keeps uplinks arriving at `rate` per second while the API is measured."""
+    while not stop.is_set():
+        for payload in source.take(max(1, int(rate // 10))):
+            pipeline.on_message(None, None, message(payload))
+        stop.wait(0.1)
+
+
+def run_api_steps(pipeline, source, steps, args):
+    from werkzeug.serving import make_server
+    server = make_server('127.0.0.1', args.port, pipeline.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="api-server", daemon=True).start()
+    rows = []
+    try:
+        for target in steps:
+            # Grow the history to the step size (untimed)
+            while source.sent < target:
+                for payload in source.take(min(5000, target - source.sent)):
+                    pipeline.on_message(None, None, message(payload))
+            stop = threading.Event()
+            feeder = threading.Thread(target=live_ingest, args=(pipeline, source, args.live_rate, stop), daemon=True)
+            feeder.start()
+            result = run_load(args.port, args.clients, args.seconds, ENDPOINTS)
+            stop.set()
+            feeder.join()
+            in_memory = sum(device.history.nbytes for device in pipeline.registry.devices())
+            rows.append((source.sent, in_memory, rss_mb(), result))
+    finally:
+        server.shutdown()
+    return rows
+
+
+def start_stub_broker(port, timeout=10):
+    """Runs mqtt_stub_broker.py in its own process so it does not share our GIL."""
+    process = subprocess.Popen([sys.executable, os.path.join(BENCHMARKS, 'mqtt_stub_broker.py'), '--port', str(port)],
+                               stdout=subprocess.DEVNULL)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError(f"stub broker did not start on port {port}")
+
+
+def load_recorded(path):
+    with open(path, 'rb') as fh:
+        return [line.strip() for line in fh if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--messages', type=int, default=20000, help='uplinks per ingest run')
+    parser.add_argument('--devices', type=int, default=10)
+    parser.add_argument('--rate', type=float, default=0, help='broker publish rate (msg/s, 0 = unpaced)')
+    parser.add_argument('--steps', default='20000,100000,300000', help='total uplinks ingested at each API measurement')
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--live-rate', type=float, default=50, help='uplinks/s arriving during API measurements')
+    parser.add_argument('--port', type=int, default=5098)
+    parser.add_argument('--broker', help='host:port of an external broker (default: stub broker)')
+    parser.add_argument('--broker-port', type=int, default=18830, help='port for the stub broker')
+    parser.add_argument('--payloads', help='recorded uplinks, one JSON document per line')
+    args = parser.parse_args()
+
+    broker = None
+    if args.broker:
+        host, port = args.broker.rsplit(':', 1)
+        port = int(port)
+    else:
+        host, port = '127.0.0.1', args.broker_port
+        broker = start_stub_broker(port)
+
+    work = tempfile.mkdtemp(prefix='aq-ingest-')
+    os.symlink(os.path.abspath(os.path.join(ROOT, 'models_lr')), os.path.join(work, 'models_lr'))
+    os.environ.update(
+        PIPELINE_ROLE='all', MQTT_BROKER=host, MQTT_PORT=str(port), MQTT_TOPIC=TOPIC,
+        MQTT_USERNAME='bench', MQTT_PASSWORD='bench', STORAGE_DIR=os.path.join(work, 'store'),
+        CHECKPOINT_INTERVAL='0',
+    )
+    # Wait on a full storage queue instead of dropping, so throughput includes storage
+    os.environ.setdefault('WRITER_BLOCK_TIMEOUT', '5')
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    os.chdir(work)
+    try:
+        rss_before = rss_mb()
+        import mqtt_pipeline as pipeline
+        rss_loaded = rss_mb()
+
+        source = Payloads(args.devices, load_recorded(args.payloads) if args.payloads else None)
+        direct = run_direct(pipeline, source.take(args.messages))
+        via_broker = run_broker(pipeline, source.take(args.messages), host, port, args.rate)
+        steps = sorted(int(s) for s in args.steps.split(',') if int(s) > source.sent)
+        api_rows = run_api_steps(pipeline, source, steps, args)
+        writer = pipeline.storage_writer.stats()
+        pipeline.storage_writer.close()
+
+        print(f"{args.devices} devices, {'recorded' if args.payloads else 'synthetic'} payloads, "
+              f"broker {'stub' if broker else args.broker}, {os.cpu_count()} CPU(s)")
+        print(f"RSS: {rss_before:,.0f} MB before import, {rss_loaded:,.0f} MB after startup")
+        print(f"\n{'ingest':<10} {'msgs':>8} {'msg/s':>10} {'p50 ms':>9} {'p99 ms':>9}")
+        for name, r in (('direct', direct), ('broker', via_broker)):
+            print(f"{name:<10} {r['messages']:>8,} {r['per_second']:>10,.0f} {r['p50_ms']:>9.3f} {r['p99_ms']:>9.3f}")
+        if via_broker['lost']:
+            print(f"  ({via_broker['lost']} messages did not arrive through the broker)")
+        print(f"storage writer: {writer['written']:,} written, {writer['dropped']:,} dropped, "
+              f"{writer['backpressure_waits']:,} backpressure waits")
+
+        print(f"\nAPI: {args.clients} client processes x {args.seconds:.0f}s, {args.live_rate:.0f} uplinks/s live, "
+              f"endpoints: {', '.join(ENDPOINTS)}")
+        print(f"{'ingested':>10} {'history MB':>11} {'RSS MB':>8} {'req/s':>8} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7}")
+        for ingested, in_memory, rss, r in api_rows:
+            print(f"{ingested:>10,} {in_memory / 2**20:>11.2f} {rss:>8.0f} {r['rps']:>8.0f} "
+                  f"{r['p50_ms']:>9.2f} {r['p99_ms']:>9.2f} {r['errors']:>7}")
+    finally:
+        if broker is not None:
+            broker.terminate()
+            broker.wait(10)
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
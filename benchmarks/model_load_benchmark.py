@@ -0,0 +1,101 @@
+"""
+Model load time: legacy pickles vs. the model artifact.
+
+Loads a models directory the way mqtt_pipeline.py does at startup
+(ModelRegistry.load_candidate), in a fresh interpreter per run so import
+costs are included:
+  - pickles:  {target}_{model,scaler,features}.pkl via joblib (sklearn
+              imported to unpickle them), bundle compiled and parity-checked
+  - artifact: models.npz (plain arrays + JSON manifest, no sklearn)
+and checks that both serve the same predictions.
+
+The pickles are written from models_lr/models.npz (or --artifact) first.
+
+Usage: python benchmarks/model_load_benchmark.py [--artifact models_lr/models.npz] [--runs 5]
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import subprocess
+import joblib
+import numpy as np
+from sklearn.preprocessing import StandardScaler
+from sklearn.linear_model import LinearRegression
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+import model_artifact  # noqa: E402
+
+# Runs in the child interpreter: time from the first import to a served model
+CHILD = """
+import sys, time, json, warnings
+warnings.filterwarnings('ignore')
+started = time.perf_counter()
+sys.path.insert(0, {root!r})
+from features import SENSOR_FIELDS
+from model_registry import ModelRegistry
+model = ModelRegistry({directory!r}, SENSOR_FIELDS).load_candidate()
+seconds = time.perf_counter() - started
+probes = __import__('numpy').random.default_rng(0).normal(0, 100, (16, len(model.bundle.base_names) + 1))
+probes[:, -1] = 0
+print(json.dumps({{'seconds': seconds, 'sklearn': 'sklearn' in sys.modules, 'targets': model.bundle.targets,
+                  'predictions': model.bundle.predict(probes).tolist()}}))
+"""
+
+
+def write_pickles(params, directory):
+    """The artifact's models as the legacy model + scaler + features pickles."""
+    for target, p in params.items():
+        scaler = StandardScaler()
+        scaler.n_features_in_ = len(p['features'])
+        scaler.mean_, scaler.scale_, scaler.var_ = p['mean'], p['scale'], p['scale'] ** 2
+        model = LinearRegression()
+        model.n_features_in_ = len(p['features'])
+        model.coef_, model.intercept_ = p['coef'], np.float64(p['intercept'])
+        for kind, value in (('model', model), ('scaler', scaler), ('features', list(p['features']))):
+            joblib.dump(value, os.path.join(directory, f'{target}_{kind}.pkl'))
+
+
+def load(directory):
+    out = subprocess.run([sys.executable, '-c', CHILD.format(root=ROOT, directory=directory)],
+                         check=True, capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--artifact', default=model_artifact.artifact_path(os.path.join(ROOT, 'models_lr')))
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    work = tempfile.mkdtemp(prefix='aq-models-')
+    try:
+        pickles, artifact = os.path.join(work, 'pickles'), os.path.join(work, 'artifact')
+        os.makedirs(pickles)
+        os.makedirs(artifact)
+        write_pickles(model_artifact.read_artifact(args.artifact)[1], pickles)
+        model_artifact.convert_pickles(pickles, model_artifact.artifact_path(artifact))
+
+        results = {}
+        for name, directory in (('pickles', pickles), ('artifact', artifact)):
+            runs = [load(directory) for _ in range(args.runs)]
+            size = sum(os.path.getsize(os.path.join(directory, f)) for f in os.listdir(directory))
+            results[name] = (sorted(run['seconds'] for run in runs)[len(runs) // 2], size, runs[0])
+
+        expected, actual = results['pickles'][2], results['artifact'][2]
+        assert expected['targets'] == actual['targets']
+        diff = np.max(np.abs(np.array(actual['predictions']) - np.array(expected['predictions'])))
+        print(f"{len(actual['targets'])} targets, median of {args.runs} fresh interpreters")
+        for name, (seconds, size, run) in results.items():
+            print(f"{name:<9} {seconds * 1000:>8.1f} ms  {size / 1024:>6.1f} KB  sklearn imported: {run['sklearn']}")
+        print(f"speedup: {results['pickles'][0] / results['artifact'][0]:.1f}x, max prediction diff {diff:.2e}")
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+"""
+Minimal in-process MQTT 3.1.1 broker for benchmarks.
+
+Supports what paho-mqtt needs to subscribe and publish: CONNECT,
+SUBSCRIBE / UNSUBSCRIBE with `+` and `#` wildcards, PUBLISH at QoS 0 and 1
+(always delivered at QoS 0), PINGREQ and DISCONNECT. No authentication,
+retained messages or sessions; use a real broker (e.g. mosquitto) for
+anything beyond local throughput measurements.
+
+Usage: python benchmarks/mqtt_stub_broker.py [--host 127.0.0.1] [--port 1883]
+"""
+import asyncio
+import struct
+import argparse
+import threading
+
+CONNECT, CONNACK, PUBLISH, PUBACK = 1, 2, 3, 4
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK = 8, 9, 10, 11
+PINGREQ, PINGRESP, DISCONNECT = 12, 13, 14
+
+
+def encode_length(n):
+    out = bytearray()
+    while True:
+        byte, n = n % 128, n // 128
+        out.append(byte | (0x80 if n else 0))
+        if not n:
+            return bytes(out)
+
+
+def topic_matches(pattern, topic):
+    pattern_parts, topic_parts = pattern.split('/'), topic.split('/')
+    for i, part in enumerate(pattern_parts):
+        if part == '#':
+            return True
+        if i >= len(topic_parts) or (part != '+' and part != topic_parts[i]):
+            return False
+    return len(pattern_parts) == len(topic_parts)
+
+
+def _string(buf, pos):
+    (n,) = struct.unpack_from('!H', buf, pos)
+    return buf[pos + 2:pos + 2 + n].decode('utf-8'), pos + 2 + n
+
+
+class StubBroker:
+    """Runs the broker on its own event loop thread; `port` is set once started."""
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.host = host
+        self.port = port
+        self.published = 0
+        self._subscriptions = {}  # writer -> set of topic filters
+        self._loop = None
+        self._server = None
+        self._ready = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="mqtt-stub-broker", daemon=True)
+        self._thread.start()
+        self._ready.wait(10)
+        return self
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(10)
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._server = self._loop.run_until_complete(asyncio.start_server(self._client, self.host, self.port))
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._server.close()
+            tasks = asyncio.all_tasks(self._loop)
+            for task in tasks:
+                task.cancel()
+            self._loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self._loop.close()
+
+    async def _read_packet(self, reader):
+        header = await reader.readexactly(1)
+        length, multiplier = 0, 1
+        while True:
+            (byte,) = await reader.readexactly(1)
+            length += (byte & 0x7F) * multiplier
+            if not byte & 0x80:
+                break
+            multiplier *= 128
+        return header[0], await reader.readexactly(length) if length else b''
+
+    async def _client(self, reader, writer):
+        self._subscriptions[writer] = set()
+        try:
+            while True:
+                first, body = await self._read_packet(reader)
+                kind = first >> 4
+                if kind == CONNECT:
+                    writer.write(bytes([CONNACK << 4, 2, 0, 0]))
+                elif kind == SUBSCRIBE:
+                    (packet_id,) = struct.unpack_from('!H', body, 0)
+                    pos, granted = 2, bytearray()
+                    while pos < len(body):
+                        topic, pos = _string(body, pos)
+                        pos += 1  # requested QoS; everything is delivered at QoS 0
+                        self._subscriptions[writer].add(topic)
+                        granted.append(0)
+                    writer.write(bytes([SUBACK << 4]) + encode_length(2 + len(granted))
+                                 + struct.pack('!H', packet_id) + bytes(granted))
+                elif kind == UNSUBSCRIBE:
+                    (packet_id,) = struct.unpack_from('!H', body, 0)
+                    pos = 2
+                    while pos < len(body):
+                        topic, pos = _string(body, pos)
+                        self._subscriptions[writer].discard(topic)
+                    writer.write(bytes([UNSUBACK << 4, 2]) + struct.pack('!H', packet_id))
+                elif kind == PUBLISH:
+                    qos = (first >> 1) & 0x03
+                    topic, pos = _string(body, 0)
+                    if qos:
+                        (packet_id,) = struct.unpack_from('!H', body, pos)
+                        pos += 2
+                        writer.write(bytes([PUBACK << 4, 2]) + struct.pack('!H', packet_id))
+                    self._forward(topic, body[pos:])
+                elif kind == PINGREQ:
+                    writer.write(bytes([PINGRESP << 4, 0]))
+                elif kind == DISCONNECT:
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.CancelledError, ConnectionError):
+            pass
+        finally:
+            self._subscriptions.pop(writer, None)
+            writer.close()
+
+    def _forward(self, topic, payload):
+        self.published += 1
+        encoded = topic.encode('utf-8')
+        variable = struct.pack('!H', len(encoded)) + encoded
+        packet = bytes([PUBLISH << 4]) + encode_length(len(variable) + len(payload)) + variable + payload
+        for writer, filters in list(self._subscriptions.items()):
+            if any(topic_matches(f, topic) for f in filters):
+                writer.write(packet)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=1883)
+    args = parser.parse_args()
+    broker = StubBroker(args.host, args.port).start()
+    print(f"MQTT stub broker listening on {broker.host}:{broker.port}", flush=True)
+    try:
+        broker._thread.join()
+    except KeyboardInterrupt:
+        broker.stop()
+
+
+if __name__ == '__main__':
+    main()
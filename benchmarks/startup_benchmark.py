@@ -0,0 +1,103 @@
+"""
+Startup time: full history load vs. checkpoint + tail replay.
+
+Writes a synthetic history into a temporary segment store, then times the
+two startup paths used by mqtt_pipeline.py:
+  - full:       read every segment, sort, seed every device
+  - checkpoint: read the checkpoint, apply it, replay records stored after it
+
+Usage: python benchmarks/startup_benchmark.py [--rows 200000] [--devices 10] [--tail 500]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from storage import SegmentStorage  # noqa: E402
+from devices import DeviceRegistry  # noqa: E402
+from checkpoint import apply_checkpoint, read_checkpoint, save_checkpoint  # noqa: E402
+
+
+def synthetic_rows(n, devices, start=None, seed=0):
+    rng = np.random.default_rng(seed)
+    start = start or pd.Timestamp('2025-01-01')
+    timestamps = start + pd.to_timedelta(np.arange(n) * 30, unit='s')
+    return [{
+        'timestamp': ts.isoformat(),
+        'end_device_ids': {'device_id': f'device-{i % devices}'},
+        'pm2_5': float(rng.uniform(5, 80)),
+        'pm10': float(rng.uniform(10, 120)),
+        'co2': float(rng.uniform(400, 1500)),
+        'tvoc': float(rng.uniform(50, 500)),
+        'temperature': float(rng.uniform(15, 35)),
+        'humidity': float(rng.uniform(30, 80)),
+    } for i, ts in enumerate(timestamps)]
+
+
+def full_load(storage):
+    registry = DeviceRegistry()
+    df = storage.read_all()
+    df['timestamp'] = pd.to_datetime(df['timestamp'], format='ISO8601')
+    registry.seed_frame(df.sort_values(by='timestamp'))
+    return registry
+
+
+def checkpoint_load(storage, path):
+    registry = DeviceRegistry()
+    rows = apply_checkpoint(registry, read_checkpoint(path))
+    tail = storage.read_since(rows)
+    if not tail.empty:
+        tail['timestamp'] = pd.to_datetime(tail['timestamp'], format='ISO8601')
+        registry.seed_frame(tail)
+    return registry
+
+
+def timed(fn, *args, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--devices', type=int, default=10)
+    parser.add_argument('--tail', type=int, default=500, help='records stored after the checkpoint')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        storage = SegmentStorage(os.path.join(directory, 'store'))
+        rows = synthetic_rows(args.rows + args.tail, args.devices)
+        storage.append(rows[:args.rows])
+
+        checkpoint_path = os.path.join(directory, 'checkpoint.npz')
+        save_checkpoint(checkpoint_path, full_load(storage), args.rows)
+        storage.append(rows[args.rows:])
+
+        full_seconds, full_registry = timed(full_load, storage)
+        checkpoint_seconds, checkpoint_registry = timed(checkpoint_load, storage, checkpoint_path)
+        storage.close()
+
+        # Both paths must end in the same state
+        for device in full_registry.devices():
+            restored = checkpoint_registry.get(device.device_id)
+            assert restored.history.total == device.history.total
+            assert np.allclose(restored.features.base_vector(), device.features.base_vector())
+
+        print(f"records:            {args.rows + args.tail:,} ({args.devices} devices, {args.tail} after checkpoint)")
+        print(f"checkpoint size:    {os.path.getsize(checkpoint_path) / 1024:,.1f} KiB")
+        print(f"full load:          {full_seconds * 1000:,.1f} ms")
+        print(f"checkpoint + tail:  {checkpoint_seconds * 1000:,.1f} ms")
+        print(f"speedup:            {full_seconds / checkpoint_seconds:,.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Training wall time: per-target loop vs. shared feature matrix.
+
+Times step 4 of train_model.py on a large synthetic sensor history:
+  - per-target: the original loop (frame copy, lags and rolling means
+                recomputed, StandardScaler + LinearRegression fit per target)
+  - shared:     build_feature_matrix once + fit_targets (one Gram matrix,
+                one small solve per target)
+and checks that both produce the same predictions.
+
+Usage: python benchmarks/training_benchmark.py [--rows 1000000]
+"""
+import os
+import sys
+import time
+import argparse
+import warnings
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import StandardScaler
+from sklearn.linear_model import LinearRegression
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import train_model  # noqa: E402
+
+warnings.filterwarnings('ignore')
+
+
+def synthetic_frame(n, seed=0):
+    """Smooth, cross-correlated sensor series (random walks plus noise), 30 s apart."""
+    rng = np.random.default_rng(seed)
+    walk = np.cumsum(rng.normal(0, 1, size=(n, 3)), axis=0) * 0.1
+    pm2_5 = 30 + 10 * np.sin(walk[:, 0]) + rng.normal(0, 2, n)
+    df = pd.DataFrame({
+        'pm2_5': pm2_5,
+        'pm10': 1.6 * pm2_5 + rng.normal(0, 4, n),
+        'co2': 700 + 200 * np.tanh(walk[:, 1]) + rng.normal(0, 20, n),
+        'tvoc': 150 + 50 * np.tanh(walk[:, 1]) + rng.normal(0, 10, n),
+        'temperature': 22 + 4 * np.sin(walk[:, 2]) + rng.normal(0, 0.3, n),
+        'humidity': 55 - 10 * np.sin(walk[:, 2]) + rng.normal(0, 1, n),
+    }, index=pd.date_range('2025-01-01', periods=n, freq='30s'))
+    return df
+
+
+def per_target(df, cols):
+    """The original train_model.py loop, without printing or saving."""
+    fitted = {}
+    for target_col in cols:
+        feature_cols = [col for col in cols if col != target_col]
+        df_temp = df.copy()
+        df_temp[f'{target_col}_lag1'] = df_temp[target_col].shift(1)
+        df_temp[f'{target_col}_lag2'] = df_temp[target_col].shift(2)
+        for col in feature_cols:
+            df_temp[f'{col}_rolling_mean_3'] = df_temp[col].rolling(window=3, min_periods=1).mean()
+        df_temp = df_temp.dropna()
+        all_features = [col for col in df_temp.columns if col != target_col]
+        X, y = df_temp[all_features], df_temp[target_col]
+        split_idx = max(int(len(df_temp) * 0.8), len(df_temp) - 2)
+        scaler = StandardScaler()
+        X_train_scaled = scaler.fit_transform(X.iloc[:split_idx])
+        scaler.transform(X.iloc[split_idx:])
+        model = LinearRegression(fit_intercept=True, n_jobs=-1)
+        model.fit(X_train_scaled, y.iloc[:split_idx])
+        model.predict(X_train_scaled)
+        fitted[target_col] = (model, scaler, all_features)
+    return fitted
+
+
+def shared(df, cols):
+    matrix, names = train_model.build_feature_matrix(df, cols)
+    return train_model.fit_targets(matrix, names, cols)
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - started, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000)
+    args = parser.parse_args()
+
+    df = synthetic_frame(args.rows)
+    cols = list(df.columns)
+    loop_seconds, loop_fitted = timed(per_target, df, cols)
+    shared_seconds, shared_fitted = timed(shared, df, cols)
+
+    # Same models: compare predictions on a sample of feature rows
+    matrix, names = train_model.build_feature_matrix(df, cols)
+    rows = np.random.default_rng(1).choice(len(matrix), 1000, replace=False)
+    lookup = {name: i for i, name in enumerate(names)}
+    worst = 0.0
+    for target in cols:
+        model, scaler, features = loop_fitted[target]
+        new_model, new_scaler, new_features, _ = shared_fitted[target]
+        assert features == new_features
+        X = matrix[np.ix_(rows, [lookup[name] for name in features])]
+        expected = model.predict(scaler.transform(X))
+        actual = new_model.predict(new_scaler.transform(X))
+        worst = max(worst, float(np.max(np.abs(actual - expected) / np.maximum(1.0, np.abs(expected)))))
+
+    print(f"rows:              {args.rows:,} x {len(cols)} sensors, {len(cols)} targets, {os.cpu_count()} CPU(s)")
+    print(f"per-target loop:   {loop_seconds:,.2f} s")
+    print(f"shared matrix:     {shared_seconds:,.2f} s")
+    print(f"speedup:           {loop_seconds / shared_seconds:,.1f}x")
+    print(f"max relative diff: {worst:.2e}")
+
+
+if __name__ == '__main__':
+    main()
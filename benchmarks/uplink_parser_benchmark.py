@@ -0,0 +1,145 @@
+"""
+Uplink parsing: messages/sec on one core, original path vs. parse_uplink.
+
+The original path is what on_message used to do per message: decode,
+json.loads, log the first 100 chars at INFO, merge decoded_payload into
+the full envelope and look up the device ID. parse_uplink is timed with
+orjson (when installed) and with the standard library.
+
+Usage: python benchmarks/uplink_parser_benchmark.py [--messages 20000]
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+from datetime import datetime
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import uplink  # noqa: E402
+from devices import device_id_of  # noqa: E402
+
+
+def ttn_payload(i, rng, devices=10, timestamp=None):
+    """A TTN v3 uplink as delivered over MQTT, with two gateways."""
+    payload = {
+        'end_device_ids': {
+            'device_id': f'device-{i % devices}',
+            'application_ids': {'application_id': 'air-quality'},
+            'dev_eui': '70B3D57ED0000000',
+            'join_eui': '0000000000000000',
+            'dev_addr': '260B0000',
+        },
+        'correlation_ids': [f'as:up:01H{i:020d}', f'rpc:/ttn.lorawan.v3.AppAs/SimulateUplink:{i}'],
+        'received_at': '2025-01-01T00:00:00.000000000Z',
+        'uplink_message': {
+            'session_key_id': 'AYp0lnVzGK2mS5TTn0lA7g==',
+            'f_port': 2,
+            'f_cnt': i,
+            'frm_payload': 'AQIDBAUGBwgJCgsM',
+            'decoded_payload': {
+                'pm2_5': round(float(rng.uniform(5, 80)), 1),
+                'pm10': round(float(rng.uniform(10, 120)), 1),
+                'co2': int(rng.uniform(400, 1500)),
+                'tvoc': int(rng.uniform(50, 500)),
+                'temperature': round(float(rng.uniform(15, 35)), 2),
+                'humidity': round(float(rng.uniform(30, 80)), 2),
+            },
+            'rx_metadata': [{
+                'gateway_ids': {'gateway_id': f'gw-{g}', 'eui': 'B827EBFFFE000000'},
+                'time': '2025-01-01T00:00:00.000000Z',
+                'timestamp': 1234567 + g,
+                'rssi': int(rng.integers(-120, -40)),
+                'channel_rssi': int(rng.integers(-120, -40)),
+                'snr': round(float(rng.uniform(-10, 12)), 1),
+                'location': {'latitude': 52.0, 'longitude': 4.0, 'altitude': 10, 'source': 'SOURCE_REGISTRY'},
+                'uplink_token': 'ChIKEAoOZ3ctMDAwMDAwMDAwMDAw',
+                'channel_index': 2,
+                'received_at': '2025-01-01T00:00:00.000000Z',
+            } for g in range(2)],
+            'settings': {
+                'data_rate': {'lora': {'bandwidth': 125000, 'spreading_factor': 7, 'coding_rate': '4/5'}},
+                'frequency': '868100000',
+                'timestamp': 1234567,
+            },
+            'received_at': '2025-01-01T00:00:00.000000000Z',
+            'consumed_airtime': '0.061696s',
+            'network_ids': {'net_id': '000013', 'tenant_id': 'ttn', 'cluster_id': 'eu1'},
+        },
+    }
+    if timestamp is not None:
+        payload['timestamp'] = timestamp
+    return json.dumps(payload).encode('utf-8')
+
+
+def original_path(payload, logger):
+    raw_payload = payload.decode("utf-8", errors="ignore")
+    logger.info(f"📩 Data received: {raw_payload[:100]}...")
+    data = json.loads(raw_payload)
+    if 'timestamp' not in data:
+        data['timestamp'] = datetime.now().isoformat()
+    if 'uplink_message' in data and 'decoded_payload' in data['uplink_message']:
+        data.update(data['uplink_message']['decoded_payload'])
+    return device_id_of(data), data
+
+
+def parse_json(payload):
+    record = uplink.parse_uplink(payload)
+    return record['device_id'], record
+
+
+def rate(fn, payloads, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for payload in payloads:
+            fn(payload)
+        best = min(best, time.perf_counter() - started)
+    return len(payloads) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--messages', type=int, default=20000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    payloads = [ttn_payload(i, rng) for i in range(args.messages)]
+
+    # INFO logging as configured in mqtt_pipeline.py, written to /dev/null
+    logger = logging.getLogger('uplink-benchmark')
+    logger.propagate = False
+    devnull = open(os.devnull, 'w')
+    handler = logging.StreamHandler(devnull)
+    handler.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(name)s: %(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+
+    # Both paths must agree on what the pipeline uses
+    for payload in payloads[:100]:
+        device_id, data = original_path(payload, logger)
+        record = uplink.parse_uplink(payload)
+        assert record['device_id'] == device_id
+        assert all(record[f] == float(data[f]) for f in uplink.SENSOR_FIELDS)
+
+    results = [('original (json + INFO log)', rate(lambda p: original_path(p, logger), payloads))]
+    if uplink.JSON_LIBRARY == 'orjson':
+        results.append(('parse_uplink (orjson)', rate(parse_json, payloads)))
+    uplink.loads = json.loads
+    results.append(('parse_uplink (json)', rate(parse_json, payloads)))
+
+    stored_before = len(json.dumps(original_path(payloads[0], logger)[1], default=str))
+    stored_after = len(json.dumps(uplink.parse_uplink(payloads[0])))
+    devnull.close()
+    print(f"messages:       {args.messages:,} ({len(payloads[0]):,} bytes each)")
+    print(f"stored record:  {stored_before:,} -> {stored_after:,} bytes as JSON")
+    baseline = results[0][1]
+    for name, per_second in results:
+        print(f"{name:<28} {per_second:>10,.0f} msg/s  {1e6 / per_second:>6.1f} µs/msg  {per_second / baseline:>5.1f}x")
+
+
+if __name__ == '__main__':
+    main()
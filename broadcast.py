@@ -0,0 +1,71 @@
+import queue
+import threading
+
+
+def format_sse(data, event=None, event_id=None):
+    """Encodes one Server-Sent Events message."""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event:
+        lines.append(f"event: {event}")
+    for line in data.splitlines() or ['']:
+        lines.append(f"data: {line}")
+    return ("\n".join(lines) + "\n\n").encode('utf-8')
+
+
+class Broadcaster:
+    """
+    Fans one published message out to many subscribers.
+
+    The publisher encodes a message once and drops the same bytes into every
+    subscriber's bounded queue, so publishing never blocks on a slow client:
+    when a queue is full its oldest message is discarded.
+    """
+
+    def __init__(self, max_pending=16):
+        self.max_pending = max_pending
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._stats = {'published': 0, 'delivered': 0, 'dropped': 0}
+
+    def subscribe(self):
+        q = queue.Queue(maxsize=self.max_pending)
+        with self._lock:
+            self._subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def publish(self, message):
+        with self._lock:
+            subscribers = list(self._subscribers)
+            self._stats['published'] += 1
+        delivered = dropped = 0
+        for q in subscribers:
+            try:
+                q.put_nowait(message)
+            except queue.Full:
+                try:
+                    q.get_nowait()
+                    dropped += 1
+                except queue.Empty:
+                    pass
+                try:
+                    q.put_nowait(message)
+                except queue.Full:
+                    dropped += 1
+                    continue
+            delivered += 1
+        with self._lock:
+            self._stats['delivered'] += delivered
+            self._stats['dropped'] += dropped
+        return delivered
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['subscribers'] = len(self._subscribers)
+        return stats
@@ -0,0 +1,76 @@
+import threading
+from collections import OrderedDict
+
+
+class VersionedCache:
+    """
+    Memoizes results per (key, data version).
+
+    Inputs only change when new data is ingested, so every entry is tagged
+    with the version it was computed for. A lookup with a newer version is a
+    miss, and storing a result for a newer version evicts everything computed
+    for older ones. `max_entries` bounds the cache within a single version.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                self._stats['hits'] += 1
+                return True, entry[1]
+            self._stats['misses'] += 1
+            return False, None
+
+    def put(self, key, version, value):
+        with self._lock:
+            if self._version is not None and version < self._version:
+                # Computed from data that has since been superseded
+                return
+            if version != self._version:
+                self._stats['evictions'] += len(self._entries)
+                self._entries.clear()
+                self._version = version
+            self._entries[key] = (version, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def get_or_compute(self, key, version, compute):
+        """Returns the cached value for this version, computing and storing it on a miss."""
+        found, value = self.get(key, version)
+        if found:
+            return value
+        value = compute()
+        self.put(key, version, value)
+        return value
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['version'] = self._version
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        return stats
+
+
+def merged_stats(caches):
+    """`stats()` of several caches (e.g. one per device) summed, with their overall hit rate."""
+    totals = {'caches': 0, 'hits': 0, 'misses': 0, 'evictions': 0, 'entries': 0}
+    for cache in caches:
+        stats = cache.stats()
+        totals['caches'] += 1
+        for name in ('hits', 'misses', 'evictions', 'entries'):
+            totals[name] += stats[name]
+    lookups = totals['hits'] + totals['misses']
+    totals['hit_rate'] = round(totals['hits'] / lookups, 4) if lookups else 0.0
+    return totals
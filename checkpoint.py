@@ -0,0 +1,167 @@
+import os
+import re
+import json
+import logging
+import numpy as np
+import pandas as pd
+from history import HISTORY_FIELDS
+from features import SENSOR_FIELDS, FeatureState
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_FORMAT = 1
+
+# Per-device arrays are stored as d<index>_<name>; online learner arrays as online_<name>
+_DEVICE_KEY = re.compile(r'd(\d+)_(.+)')
+_ONLINE_PREFIX = 'online_'
+
+
+def _encode(value):
+    """JSON fallback for values found in stored records."""
+    if hasattr(value, 'isoformat'):
+        return {'$datetime': value.isoformat()}
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+
+def _decode(obj):
+    if set(obj) == {'$datetime'}:
+        return pd.Timestamp(obj['$datetime'])
+    return obj
+
+
+def capture_device(device):
+    """(entry, arrays) for one device; the arrays are copies safe to write later."""
+    snapshot = device.snapshot
+    features = snapshot.features
+    entry = {
+        'device_id': device.device_id,
+        'generation': device.generation,
+        'latest': snapshot.latest,
+        'last_seen': snapshot.last_seen,
+        'version': snapshot.version,
+        'feature_count': features.count,
+    }
+    arrays = {'features': features.recent(features.capacity)}
+    arrays.update(device.history.state())
+    return entry, arrays
+
+
+def apply_device(state, entry, arrays):
+    """Loads one device's (entry, arrays) into a DeviceState."""
+    state.history.load_state(arrays)
+    features = FeatureState()
+    features.restore(arrays['features'], entry['feature_count'])
+    state.publish(features=features, latest=entry['latest'], last_seen=entry['last_seen'])
+
+
+def capture(registry, rows, learner=None):
+    """
+    Copies the in-memory state of every device (and of the online learner,
+    if given) into (meta, arrays).
+
+    `rows` is the number of stored records this state reflects; anything
+    stored after that is replayed on top of the checkpoint at startup.
+    """
+    meta = {
+        'format': CHECKPOINT_FORMAT,
+        'rows': int(rows),
+        'history_fields': HISTORY_FIELDS,
+        'feature_fields': SENSOR_FIELDS,
+        'latest_device_id': registry.latest_device_id,
+        'devices': [],
+    }
+    arrays = {}
+    for i, device in enumerate(registry.devices()):
+        entry, device_arrays = capture_device(device)
+        meta['devices'].append(entry)
+        for name, value in device_arrays.items():
+            arrays[f'd{i}_{name}'] = value
+    if learner is not None:
+        meta['online'], online_arrays = learner.state()
+        for name, value in online_arrays.items():
+            arrays[_ONLINE_PREFIX + name] = value
+    return meta, arrays
+
+
+def encode_meta(meta):
+    return np.array(json.dumps(meta, default=_encode))
+
+
+def decode_meta(value):
+    return json.loads(str(value), object_hook=_decode)
+
+
+def write_checkpoint(path, meta, arrays):
+    """Writes a checkpoint atomically (temporary file + rename)."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as fh:
+        np.savez(fh, meta=encode_meta(meta), **arrays)
+    os.replace(tmp_path, path)
+
+
+def save_checkpoint(path, registry, rows, lock=None, learner=None):
+    """
+    Captures the registry (under `lock`, if given) and writes it to `path`.
+
+    `rows` may be a function; it is called inside the same locked section as
+    the capture, so the stored row count and the state always agree.
+    Returns (devices, rows).
+    """
+    def locked_capture():
+        return capture(registry, rows() if callable(rows) else rows, learner)
+
+    if lock is not None:
+        with lock:
+            meta, arrays = locked_capture()
+    else:
+        meta, arrays = locked_capture()
+    write_checkpoint(path, meta, arrays)
+    return len(meta['devices']), meta['rows']
+
+
+def read_checkpoint(path):
+    """Loads a checkpoint, or returns None if it is missing, unreadable or incompatible."""
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            meta = decode_meta(data['meta'])
+            arrays = {key: data[key] for key in data.files if key != 'meta'}
+    except Exception as e:
+        logger.warning(f"⚠ Could not read checkpoint {path}: {e}")
+        return None
+    if (meta.get('format') != CHECKPOINT_FORMAT
+            or meta.get('history_fields') != HISTORY_FIELDS
+            or meta.get('feature_fields') != SENSOR_FIELDS):
+        logger.warning(f"⚠ Ignoring checkpoint {path} written with a different layout")
+        return None
+    return meta, arrays
+
+
+def apply_checkpoint(registry, checkpoint):
+    """Restores every device in a checkpoint into the registry; returns the stored row count."""
+    meta, arrays = checkpoint
+    per_device = {}
+    for key, value in arrays.items():
+        match = _DEVICE_KEY.fullmatch(key)
+        if match:
+            per_device.setdefault(int(match.group(1)), {})[match.group(2)] = value
+    for i, entry in enumerate(meta['devices']):
+        apply_device(registry._get_or_create(entry['device_id']), entry, per_device[i])
+    if meta['latest_device_id'] is not None and registry.get(meta['latest_device_id']) is not None:
+        registry.latest_device_id = meta['latest_device_id']
+    return meta['rows']
+
+
+def online_state(checkpoint):
+    """The online learner's (meta, arrays) saved in a checkpoint, or None."""
+    meta, arrays = checkpoint
+    if 'online' not in meta:
+        return None
+    prefix = len(_ONLINE_PREFIX)
+    return meta['online'], {key[prefix:]: value for key, value in arrays.items() if key.startswith(_ONLINE_PREFIX)}
@@ -0,0 +1,119 @@
+"""
+Walk-forward (TimeSeriesSplit) cross-validation from block statistics.
+
+The training rows are cut into the folds' validation blocks once, and each
+block is summarised by its count, mean and centered comoment matrix of
+[inputs | targets]. Fold k trains on blocks 0..k-1 and validates on block
+k, so every fold's statistics are a prefix sum of the blocks'. All folds
+are then solved together and scored on their block's statistics, which
+makes CV cost one pass over the rows however many folds there are.
+"""
+import numpy as np
+import pandas as pd
+
+# Matches np.linalg.lstsq(rcond=None): singular values below eps * n are dropped
+_RCOND = np.finfo(float).eps
+
+
+def fold_bounds(n_samples, n_splits):
+    """
+    Row boundaries [0, start_1, ..., start_k, n_samples] of TimeSeriesSplit's
+    folds: block 0 is the first fold's train rows, block k its k-th
+    validation rows.
+    """
+    test_size = n_samples // (n_splits + 1)
+    if n_splits < 2 or test_size < 1:
+        raise ValueError(f"cannot make {n_splits} folds from {n_samples} rows")
+    starts = [n_samples - (n_splits - k) * test_size for k in range(n_splits)]
+    return np.array([0] + starts + [n_samples])
+
+
+class BlockMoments:
+    """Count, mean and centered comoment of consecutive row blocks, stacked."""
+
+    def __init__(self, count, mean, comoment):
+        self.count = np.asarray(count, dtype=float)
+        self.mean = np.asarray(mean, dtype=float)
+        self.comoment = np.asarray(comoment, dtype=float)
+
+    @classmethod
+    def of(cls, matrix, bounds):
+        """Moments of matrix[bounds[b]:bounds[b + 1]] for every block b."""
+        blocks = [matrix[lo:hi] for lo, hi in zip(bounds[:-1], bounds[1:])]
+        mean = np.array([block.mean(axis=0) for block in blocks])
+        comoment = np.array([(block - m).T @ (block - m) for block, m in zip(blocks, mean)])
+        return cls([len(block) for block in blocks], mean, comoment)
+
+    @classmethod
+    def stack(cls, moments):
+        """From a list of online.RunningMoments (e.g. accumulated chunk by chunk)."""
+        return cls([m.count for m in moments], [m.mean for m in moments], [m.comoment for m in moments])
+
+    def __len__(self):
+        return len(self.count)
+
+    def __getitem__(self, blocks):
+        return BlockMoments(self.count[blocks], self.mean[blocks], self.comoment[blocks])
+
+    def prefixes(self):
+        """
+        Moments of blocks 0..k-1 for k = 1..len: cumulative sums of each
+        block's comoment plus its mean's spread, taken about block 0's mean
+        so the sums stay well conditioned.
+        """
+        shifted = self.mean - self.mean[0]
+        count = np.cumsum(self.count)
+        mean = np.cumsum(self.count[:, None] * shifted, axis=0) / count[:, None]
+        spread = self.count[:, None, None] * shifted[:, :, None] * shifted[:, None, :]
+        comoment = np.cumsum(self.comoment + spread, axis=0) - count[:, None, None] * mean[:, :, None] * mean[:, None, :]
+        return BlockMoments(count, mean + self.mean[0], comoment)
+
+
+def solve_folds(train, idx, j):
+    """
+    Least squares of column j on columns idx with an intercept, for every
+    entry of `train` at once. Inputs are standardized first, as
+    StandardScaler + LinearRegression do, and the minimum-norm solution is
+    used for collinear inputs. Returns (weights, bias) on the raw inputs.
+    """
+    var = np.diagonal(train.comoment, axis1=1, axis2=2)[:, idx] / train.count[:, None]
+    scale = np.where(var > 10 * np.finfo(float).eps, np.sqrt(var), 1.0)
+    gram = train.comoment[:, idx][:, :, idx] / (scale[:, :, None] * scale[:, None, :])
+    rhs = train.comoment[:, idx, j] / scale
+    coef = np.einsum('fij,fj->fi', np.linalg.pinv(gram, rcond=_RCOND * len(idx), hermitian=True), rhs)
+    weights = coef / scale
+    bias = train.mean[:, j] - np.einsum('fi,fi->f', weights, train.mean[:, idx])
+    return weights, bias
+
+
+def residuals(blocks, idx, j, weights, bias):
+    """(sse, mean residual) of column j minus (inputs @ weights + bias) over each block."""
+    w = np.zeros_like(blocks.mean)
+    w[:, idx] = -weights
+    w[:, j] = 1.0
+    mean_residual = np.einsum('fi,fi->f', blocks.mean, w) - bias
+    sse = blocks.count * mean_residual ** 2 + np.einsum('fi,fij,fj->f', w, blocks.comoment, w)
+    return np.maximum(sse, 0.0), mean_residual
+
+
+def walk_forward(blocks, idx, j):
+    """
+    Scores every fold of `blocks` (BlockMoments over fold_bounds) for target
+    column j on input columns idx. Returns one row per fold: rows trained
+    on and validated on, RMSE, R2 and bias (mean of actual minus
+    predicted) on the validation rows.
+    """
+    train, val = blocks.prefixes()[:-1], blocks[1:]
+    weights, bias = solve_folds(train, idx, j)
+    sse, mean_residual = residuals(val, idx, j, weights, bias)
+    total = val.comoment[:, j, j]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r2 = np.where(total > 0, 1.0 - sse / total, np.nan)
+    return pd.DataFrame({
+        'fold': np.arange(1, len(val) + 1),
+        'train_rows': train.count.astype(int),
+        'val_rows': val.count.astype(int),
+        'rmse': np.sqrt(sse / val.count),
+        'r2': r2,
+        'bias': mean_residual,
+    })
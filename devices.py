@@ -0,0 +1,204 @@
+import re
+import time
+import uuid
+import threading
+import pandas as pd
+from collections import OrderedDict, namedtuple
+from cache import VersionedCache
+from features import FeatureState
+from history import TieredHistory
+
+DEFAULT_DEVICE_ID = 'default'
+
+# Matches device_id inside end_device_ids stored as JSON or as a Python repr (Excel)
+_DEVICE_ID_PATTERN = re.compile(r"""["']device_id["']\s*:\s*["']([^"']+)["']""")
+
+
+def device_id_of(record, default=DEFAULT_DEVICE_ID):
+    """Device ID of a TTN uplink (`end_device_ids.device_id`), also when stored as text."""
+    ids = record.get('end_device_ids')
+    if isinstance(ids, dict):
+        return ids.get('device_id') or default
+    if isinstance(ids, str):
+        match = _DEVICE_ID_PATTERN.search(ids)
+        if match:
+            return match.group(1)
+    device_id = record.get('device_id')
+    return device_id if isinstance(device_id, str) and device_id else default
+
+
+def device_ids_of_frame(df, default=DEFAULT_DEVICE_ID):
+    """device_id_of for every row of a stored-history DataFrame."""
+    columns = [c for c in ('end_device_ids', 'device_id') if c in df.columns]
+    if not columns:
+        return [default] * len(df)
+    return [device_id_of(dict(zip(columns, values)), default) for values in df[columns].itertuples(index=False)]
+
+
+def latest_reading(df):
+    """Latest valid reading in stored history (sensor fields only, missing values as 0)."""
+    # Rows with at least one valid sensor value
+    checked = [c for c in ('pm2_5', 'pm10', 'co2') if c in df.columns]
+    valid = df[checked].notna().any(axis=1) if checked else pd.Series(False, index=df.index)
+    if valid.any():
+        row = df.loc[valid[valid].index[-1]].to_dict()
+        # Extract only the sensor-related fields
+        return {
+            'timestamp': row.get('timestamp'),
+            'pm2_5': row.get('pm2_5') if pd.notna(row.get('pm2_5')) else 0,
+            'pm10': row.get('pm10') if pd.notna(row.get('pm10')) else 0,
+            'co2': row.get('co2') if pd.notna(row.get('co2')) else 0,
+            'tvoc': row.get('tvoc') if pd.notna(row.get('tvoc')) else 0,
+            'humidity': row.get('humidity') if pd.notna(row.get('humidity')) else 0,
+            'temperature': row.get('temperature') if pd.notna(row.get('temperature')) else 0,
+        }
+    return {}
+
+
+# Everything a request needs about a device at one point in time. Never
+# mutated once published: ingest builds the next one and swaps it in.
+DeviceSnapshot = namedtuple('DeviceSnapshot', ['device_id', 'latest', 'features', 'version', 'last_seen'])
+
+
+class DeviceState:
+    """
+    Latest reading, compact history, feature state and result cache for one device.
+
+    The latest reading, feature state and version live in an immutable
+    DeviceSnapshot that ingest replaces with a single reference assignment
+    (copy-on-write), so API threads read `snapshot` once and never lock or
+    see a half-applied update. The history has its own lock-free read
+    protocol (see TieredHistory). Versions restart when an evicted device is
+    created again, so `generation` tells the two incarnations apart.
+    """
+
+    __slots__ = ('device_id', 'generation', 'history', 'cache', 'snapshot')
+
+    def __init__(self, device_id, history_config, cache_entries, generation=0):
+        self.device_id = device_id
+        self.generation = generation
+        self.history = TieredHistory(**history_config)
+        self.cache = VersionedCache(max_entries=cache_entries)
+        self.snapshot = DeviceSnapshot(device_id, {}, FeatureState(), 0, None)
+
+    @property
+    def latest(self):
+        return self.snapshot.latest
+
+    @property
+    def features(self):
+        return self.snapshot.features
+
+    @property
+    def version(self):
+        return self.snapshot.version
+
+    @property
+    def last_seen(self):
+        return self.snapshot.last_seen
+
+    def publish(self, **changes):
+        """Swaps in a new snapshot with some fields replaced."""
+        self.snapshot = self.snapshot._replace(**changes)
+
+    def ingest(self, record):
+        current = self.snapshot
+        features = current.features.copy()
+        features.push(record)
+        self.history.append(record)
+        self.snapshot = DeviceSnapshot(self.device_id, record, features, current.version + 1, time.time())
+
+    def summary(self):
+        snapshot = self.snapshot
+        return {
+            'device_id': self.device_id,
+            'records': self.history.total,
+            'memory_bytes': self.history.nbytes,
+            'cache': self.cache.stats(),
+            'generation': self.generation,
+            'version': snapshot.version,
+            'last_seen': snapshot.last_seen,
+            'timestamp': snapshot.latest.get('timestamp'),
+        }
+
+
+class DeviceRegistry:
+    """
+    Per-device state keyed by TTN device ID.
+
+    Every device's footprint is bounded (a TieredHistory sized by
+    history_config, a fixed-size feature ring and cache_entries cached
+    responses), and once more than max_devices are known the least recently
+    seen device is dropped.
+    """
+
+    def __init__(self, history_config=None, cache_entries=16, max_devices=10000):
+        self.history_config = dict(history_config or {})
+        self.cache_entries = cache_entries
+        self.max_devices = max_devices
+        self.latest_device_id = None
+        self.evicted = 0
+        self.created = 0
+        # Versions restart with the process; the boot id keeps their ETags apart
+        self.boot_id = uuid.uuid4().hex[:8]
+        self._devices = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._devices)
+
+    def get(self, device_id):
+        return self._devices.get(device_id)
+
+    def latest(self):
+        """The device that sent the most recent uplink."""
+        if self.latest_device_id is None:
+            return None
+        return self._devices.get(self.latest_device_id)
+
+    def devices(self):
+        with self._lock:
+            return list(self._devices.values())
+
+    def _get_or_create(self, device_id):
+        with self._lock:
+            state = self._devices.get(device_id)
+            if state is None:
+                self.created += 1
+                state = DeviceState(device_id, self.history_config, self.cache_entries, self.created)
+                self._devices[device_id] = state
+                while len(self._devices) > self.max_devices:
+                    self._devices.popitem(last=False)
+                    self.evicted += 1
+            else:
+                self._devices.move_to_end(device_id)
+            return state
+
+    def ingest(self, device_id, record):
+        state = self._get_or_create(device_id)
+        state.ingest(record)
+        self.latest_device_id = device_id
+        return state
+
+    def seed(self, device_id, df, latest):
+        """Restores a device from a sorted frame of stored records without counting as new ingests."""
+        state = self._get_or_create(device_id)
+        state.history.extend_frame(df)
+        features = state.features.copy()
+        for row in df.tail(features.capacity).to_dict('records'):
+            features.push(row)
+        state.publish(features=features, latest=latest or state.latest)
+        self.latest_device_id = device_id
+        return state
+
+    def seed_frame(self, df):
+        """Seeds every device found in a frame of stored records; returns the seeded states."""
+        df = df.reset_index(drop=True)
+        device_ids = pd.Series(device_ids_of_frame(df), index=df.index)
+        # Seed the device of the newest record last so it becomes the default device
+        last_device = device_ids.iloc[-1]
+        seeded = []
+        for device_id in sorted(device_ids.unique(), key=lambda d: d == last_device):
+            device_df = df[device_ids == device_id]
+            seeded.append(self.seed(device_id, device_df, latest_reading(device_df)))
+        return seeded
@@ -0,0 +1,185 @@
+import numpy as np
+
+SENSOR_FIELDS = ['pm2_5', 'pm10', 'co2', 'tvoc', 'temperature', 'humidity']
+ROLLING_WINDOW = 3
+N_LAGS = 2
+
+
+def row_values(row, fields=SENSOR_FIELDS):
+    """Extracts sensor readings from a record as floats (NaN when missing or invalid)."""
+    values = np.full(len(fields), np.nan)
+    for i, field in enumerate(fields):
+        try:
+            v = row.get(field)
+            if v is not None:
+                values[i] = float(v)
+        except (TypeError, ValueError):
+            pass
+    return values
+
+
+def target_feature_names(target, fields=SENSOR_FIELDS, window=ROLLING_WINDOW, n_lags=N_LAGS):
+    """Inputs of one target's model: the other sensors, the target's own lags and the others' rolling means."""
+    others = [field for field in fields if field != target]
+    return (others
+            + [f'{target}_lag{k}' for k in range(1, n_lags + 1)]
+            + [f'{field}_rolling_mean_{window}' for field in others])
+
+
+class FeatureState:
+    """
+    Streaming equivalent of the pandas lag/rolling feature pipeline.
+
+    Keeps a ring buffer of the last few sensor rows plus running sums for the
+    rolling means, so building a feature vector is a single gather from a
+    precomputed base vector instead of a DataFrame construction per target.
+
+    Features are computed exactly like the training frame built from the
+    last `min_history` history rows with the current reading appended:
+      - `<field>`                  current value
+      - `<field>_lag<k>`           value k rows back in history
+      - `<field>_rolling_mean_<w>` NaN-skipping mean of the current value
+                                   and the last w-1 history rows
+    Missing values become 0, as in the original pipeline.
+    """
+
+    def __init__(self, fields=SENSOR_FIELDS, window=ROLLING_WINDOW, n_lags=N_LAGS, min_history=3):
+        self.fields = list(fields)
+        self.window = window
+        self.n_lags = n_lags
+        self.min_history = min_history
+        self.capacity = max(window - 1, n_lags, min_history, 1)
+        self.count = 0
+
+        n = len(self.fields)
+        self._ring = np.full((self.capacity, n), np.nan)
+        self._pos = 0
+        # Running sum / non-NaN count over the last window-1 history rows
+        self._roll_sum = np.zeros(n)
+        self._roll_n = np.zeros(n)
+        self._latest = np.full(n, np.nan)
+        self._plans = {}
+        self.feature_names = self._base_names()
+
+    def _base_names(self):
+        names = list(self.fields)
+        for k in range(1, self.n_lags + 1):
+            names += [f'{f}_lag{k}' for f in self.fields]
+        names += [f'{f}_rolling_mean_{self.window}' for f in self.fields]
+        return names
+
+    @classmethod
+    def from_rows(cls, rows, **kwargs):
+        state = cls(**kwargs)
+        for row in rows[-state.capacity:]:
+            state.push(row)
+        return state
+
+    def copy(self):
+        """Independent copy (the plan cache is shared; plans never change)."""
+        clone = object.__new__(FeatureState)
+        clone.__dict__.update(self.__dict__)
+        clone._ring = self._ring.copy()
+        clone._roll_sum = self._roll_sum.copy()
+        clone._roll_n = self._roll_n.copy()
+        return clone
+
+    def _history(self, k):
+        """Row k steps back in history (1 = most recent push)."""
+        return self._ring[(self._pos - k) % self.capacity]
+
+    def recent(self, n):
+        """The last n history rows, most recent first (NaN where missing)."""
+        rows = np.full((n, len(self.fields)), np.nan)
+        for k in range(1, min(n, self.count, self.capacity) + 1):
+            rows[k - 1] = self._history(k)
+        return rows
+
+    def push(self, row):
+        """Adds one ingested record. O(number of sensor fields)."""
+        self.push_values(row_values(row, self.fields))
+
+    def push_values(self, values):
+        """Adds one row already extracted with row_values."""
+        span = self.window - 1
+        if span > 0:
+            if self.count >= span:
+                leaving = self._history(span)
+                mask = ~np.isnan(leaving)
+                self._roll_sum[mask] -= leaving[mask]
+                self._roll_n[mask] -= 1
+            mask = ~np.isnan(values)
+            self._roll_sum[mask] += values[mask]
+            self._roll_n[mask] += 1
+
+        self._ring[self._pos] = values
+        self._pos = (self._pos + 1) % self.capacity
+        self.count += 1
+        self._latest = values
+
+        if self._pos == 0 and span > 0:
+            # Re-sum exactly once per lap so float drift cannot accumulate
+            recent = np.array([self._history(k) for k in range(1, min(span, self.count) + 1)])
+            self._roll_sum = np.nansum(recent, axis=0)
+            self._roll_n = np.sum(~np.isnan(recent), axis=0).astype(float)
+
+    def restore(self, rows, count):
+        """Rebuilds the state from `recent(capacity)` output and the saved push count."""
+        rows = np.asarray(rows, dtype=float)[:min(count, self.capacity)]
+        for values in rows[::-1]:
+            self.push_values(values)
+        self.count = count
+
+    def ready(self):
+        return self.count >= self.min_history
+
+    def base_vector(self, current=None):
+        """
+        All features for every target in `feature_names` order, followed by a
+        trailing 0 used for unknown feature names. `current` defaults to the
+        most recently pushed row.
+        """
+        cur = self._latest if current is None else row_values(current, self.fields)
+        parts = [cur]
+        for k in range(1, self.n_lags + 1):
+            parts.append(self._history(k) if self.count >= k else np.full(len(self.fields), np.nan))
+        cur_mask = ~np.isnan(cur)
+        total = self._roll_sum + np.where(cur_mask, cur, 0.0)
+        n = self._roll_n + cur_mask
+        with np.errstate(invalid='ignore', divide='ignore'):
+            parts.append(np.where(n > 0, total / np.maximum(n, 1), np.nan))
+        parts.append(np.zeros(1))
+        base = np.concatenate(parts)
+        return np.nan_to_num(base, nan=0.0)
+
+    def training_row(self, current):
+        """
+        The base vector for `current` (without the trailing zero) as one
+        training example, or None while the reading or the history rows it
+        depends on have gaps. Training frames are gap-filled, so rows with
+        missing values are skipped rather than read as zeros.
+        """
+        depth = max(self.n_lags, self.window - 1)
+        if self.count < depth:
+            return None
+        values = row_values(current, self.fields)
+        if not np.isfinite(values).all() or not np.isfinite(self.recent(depth)).all():
+            return None
+        return self.base_vector(current)[:-1]
+
+    def plan(self, feature_names):
+        """Index array mapping a model's feature order onto the base vector."""
+        key = tuple(feature_names)
+        plan = self._plans.get(key)
+        if plan is None:
+            lookup = {name: i for i, name in enumerate(self.feature_names)}
+            zero = len(self.feature_names)
+            plan = np.array([lookup.get(name, zero) for name in feature_names], dtype=np.intp)
+            self._plans[key] = plan
+        return plan
+
+    def vector(self, feature_names, current=None):
+        """Feature row (shape 1 x n) for a model, or None until enough history exists."""
+        if not self.ready():
+            return None
+        return self.base_vector(current)[self.plan(feature_names)].reshape(1, -1)
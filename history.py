@@ -0,0 +1,407 @@
+import time
+import functools
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+from features import SENSOR_FIELDS, row_values
+
+# Numeric fields kept in memory (the raw TTN envelope stays in storage only)
+HISTORY_FIELDS = SENSOR_FIELDS + ['pressure', 'light_level', 'battery']
+
+EPOCH = datetime(1970, 1, 1)
+
+# Query resolutions, finest first ('day' is derived from the hour rollup on the fly)
+RESOLUTIONS = ['raw', 'minute', 'hour', 'day']
+
+
+def to_epoch(value):
+    """Seconds since the epoch for a timestamp; naive times are taken as-is (no local offset)."""
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return np.nan
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return np.nan
+    if not isinstance(value, datetime):
+        return np.nan
+    if value.tzinfo is not None:
+        value = pd.Timestamp(value).tz_convert('UTC').tz_localize(None).to_pydatetime()
+    return (value - EPOCH).total_seconds()
+
+
+def epochs_from_series(series):
+    """Vectorized to_epoch for a column of timestamps."""
+    ts = pd.to_datetime(series, format='ISO8601', errors='coerce')
+    if getattr(ts.dt, 'tz', None) is not None:
+        ts = ts.dt.tz_convert('UTC').dt.tz_localize(None)
+    return ((ts - pd.Timestamp(0)) / pd.Timedelta(seconds=1)).to_numpy(dtype=float)
+
+
+def from_epoch(seconds):
+    return (EPOCH + timedelta(seconds=float(seconds))).isoformat()
+
+
+def _writes(method):
+    """Marks a TieredHistory mutation for the sequence counter read by `_reads`."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        self._seq += 1
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self._seq += 1
+    return wrapper
+
+
+def _reads(method):
+    """
+    Lock-free read (seqlock): retries until no mutation overlapped it.
+
+    The single ingest thread makes the counter odd while it mutates; a read
+    that started on an odd value or saw the counter move is thrown away. Reads
+    only return copies, so a successful read can never change afterwards.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        while True:
+            seq = self._seq
+            if seq % 2 == 0:
+                try:
+                    result = method(self, *args, **kwargs)
+                except Exception:
+                    # A torn read may fail outright; only a clean one may raise
+                    if self._seq == seq:
+                        raise
+                    continue
+                if self._seq == seq:
+                    return result
+            time.sleep(0)
+    return wrapper
+
+
+class _GrowableRing:
+    """
+    Array-backed ring buffer that grows by doubling up to a hard capacity.
+
+    Timestamps must not decrease, as `range` binary searches them; a push
+    with a NaN or earlier timestamp is dropped and counted in `late`.
+    """
+
+    def __init__(self, capacity, width, initial=16, dtype=float):
+        self.capacity = capacity
+        self._size = min(initial, capacity)
+        self.ts = np.full(self._size, np.nan)
+        self.data = np.full((self._size, width), np.nan, dtype=dtype)
+        self.count = 0
+        self.start = 0
+        self.late = 0
+
+    def __len__(self):
+        return self.count
+
+    def _grow(self):
+        new_size = min(self._size * 2, self.capacity)
+        order = self._order()
+        ts = np.full(new_size, np.nan)
+        data = np.full((new_size, self.data.shape[1]), np.nan, dtype=self.data.dtype)
+        ts[:self.count] = self.ts[order]
+        data[:self.count] = self.data[order]
+        self.ts, self.data, self._size, self.start = ts, data, new_size, 0
+
+    def _order(self):
+        return (self.start + np.arange(self.count)) % self._size
+
+    def slot(self, k):
+        """Physical index of the k-th oldest entry."""
+        return (self.start + k) % self._size
+
+    def push(self, ts, row):
+        """Appends (ts, row); returns its slot, or None if `ts` is NaN or older than the newest entry."""
+        if np.isnan(ts) or (self.count and ts < self.ts[self.last_slot()]):
+            self.late += 1
+            return None
+        if self.count == self._size and self._size < self.capacity:
+            self._grow()
+        if self.count < self._size:
+            i = self.slot(self.count)
+            self.count += 1
+        else:
+            # Full: overwrite the oldest entry
+            i = self.start
+            self.start = (self.start + 1) % self._size
+        self.ts[i] = ts
+        self.data[i] = row
+        return i
+
+    def last_slot(self):
+        return self.slot(self.count - 1) if self.count else None
+
+    def first_ts(self):
+        return self.ts[self.start] if self.count else np.nan
+
+    def range(self, start, end):
+        """
+        (timestamps, data) with start <= ts < end, in chronological order.
+
+        The ring is at most two sorted runs in memory, so each is binary
+        searched and only the matching slices are copied.
+        """
+        tail = min(self.start + self.count, self._size)
+        runs = [(self.start, tail), (0, self.start + self.count - tail)]
+        ts_parts, data_parts = [], []
+        for lo, hi in runs:
+            if hi <= lo:
+                continue
+            ts = self.ts[lo:hi]
+            i, j = np.searchsorted(ts, [start, end], side='left')
+            ts_parts.append(ts[i:j])
+            data_parts.append(self.data[lo + i:lo + j])
+        if not ts_parts:
+            return np.empty(0), np.empty((0, self.data.shape[1]))
+        return np.concatenate(ts_parts), np.concatenate(data_parts)
+
+    def arrays(self):
+        """(timestamps, data) in chronological order, as copies."""
+        order = self._order()
+        return self.ts[order], self.data[order]
+
+    def load(self, ts, data):
+        """Replaces the contents with chronologically ordered arrays (as from `arrays`)."""
+        ts, data = ts[-self.capacity:], data[-self.capacity:]
+        self._size = max(min(self._size, self.capacity), len(ts))
+        self.ts = np.full(self._size, np.nan)
+        self.data = np.full((self._size, self.data.shape[1]), np.nan, dtype=self.data.dtype)
+        self.ts[:len(ts)] = ts
+        self.data[:len(ts)] = data
+        self.count, self.start = len(ts), 0
+
+    @property
+    def nbytes(self):
+        return self.ts.nbytes + self.data.nbytes
+
+
+class Rollup:
+    """
+    Fixed-resolution aggregates (count, sum, min, max per field).
+
+    Only buckets that received data are stored, in a bounded ring that
+    grows with them, so the footprint is capped at `max_buckets` regardless
+    of uptime. Aggregates are float32 (bucket starts stay float64), which
+    halves the largest part of a device's history.
+    """
+
+    def __init__(self, bucket_seconds, max_buckets, fields=HISTORY_FIELDS):
+        self.bucket_seconds = bucket_seconds
+        self.fields = list(fields)
+        n = len(self.fields)
+        # Columns: count | sum | min | max
+        self._ring = _GrowableRing(max_buckets, 4 * n, dtype=np.float32)
+        self.late = 0
+
+    def __len__(self):
+        return len(self._ring)
+
+    def _bucket(self, ts):
+        return np.floor(ts / self.bucket_seconds) * self.bucket_seconds
+
+    def add(self, ts, values):
+        if np.isnan(ts):
+            return
+        valid = ~np.isnan(values)
+        self._merge_one(self._bucket(ts), valid.astype(float), np.where(valid, values, 0.0), values, values)
+
+    def extend(self, ts, values):
+        """Adds many chronologically sorted rows at once."""
+        keep = ~np.isnan(ts)
+        ts, values = ts[keep], values[keep]
+        if len(ts) == 0:
+            return
+        buckets = self._bucket(ts)
+        starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        valid = ~np.isnan(values)
+        counts = np.add.reduceat(valid.astype(float), starts, axis=0)
+        sums = np.add.reduceat(np.where(valid, values, 0.0), starts, axis=0)
+        mins = np.fmin.reduceat(values, starts, axis=0)
+        maxs = np.fmax.reduceat(values, starts, axis=0)
+        self.merge(buckets[starts], counts, sums, mins, maxs)
+
+    def merge(self, buckets, counts, sums, mins, maxs):
+        for i, bucket in enumerate(buckets):
+            self._merge_one(bucket, counts[i], sums[i], mins[i], maxs[i])
+
+    def _merge_one(self, bucket, counts, sums, mins, maxs):
+        n = len(self.fields)
+        ring = self._ring
+        last = ring.last_slot()
+        if last is not None and ring.ts[last] == bucket:
+            row = ring.data[last]
+            row[:n] += counts
+            row[n:2 * n] += sums
+            np.fmin(row[2 * n:3 * n], mins, out=row[2 * n:3 * n])
+            np.fmax(row[3 * n:], maxs, out=row[3 * n:])
+        elif last is None or bucket > ring.ts[last]:
+            ring.push(bucket, np.concatenate([counts, sums, mins, maxs]))
+        else:
+            # Out-of-order data for a bucket already closed
+            self.late += 1
+
+    def arrays(self):
+        """(bucket starts, count, mean, min, max) in chronological order."""
+        ts, data = self._ring.arrays()
+        return (ts,) + self._split(data)
+
+    def _split(self, data):
+        n = len(self.fields)
+        data = data.astype(float)
+        count = data[:, :n]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(count > 0, data[:, n:2 * n] / np.maximum(count, 1), np.nan)
+        return count, mean, data[:, 2 * n:3 * n], data[:, 3 * n:]
+
+    def first_ts(self):
+        return self._ring.first_ts()
+
+    def range(self, start, end, bucket_seconds=None):
+        """
+        Buckets starting in [start, end) as (bucket starts, count, mean, min, max),
+        optionally re-aggregated into coarser `bucket_seconds` buckets.
+        """
+        ts, data = self._ring.range(start, end)
+        if bucket_seconds and bucket_seconds > self.bucket_seconds and len(ts):
+            n = len(self.fields)
+            buckets = np.floor(ts / bucket_seconds) * bucket_seconds
+            starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+            data = np.hstack([
+                np.add.reduceat(data[:, :2 * n], starts, axis=0),
+                np.fmin.reduceat(data[:, 2 * n:3 * n], starts, axis=0),
+                np.fmax.reduceat(data[:, 3 * n:], starts, axis=0),
+            ])
+            ts = buckets[starts]
+        return (ts,) + self._split(data)
+
+    @property
+    def nbytes(self):
+        return self._ring.nbytes
+
+
+class TieredHistory:
+    """
+    Compact in-memory history for one device.
+
+    The most recent `raw_capacity` readings are kept at full resolution in an
+    array-backed ring of numeric fields only; every reading is also folded
+    into minute and hour rollups so older data survives in downsampled form
+    while memory stays bounded. Every tier grows with the data it holds; at
+    full capacity a device takes about
+        raw_capacity * (fields + 1) * 8 + buckets * (fields * 16 + 8)
+    bytes (about 190 KB with the defaults and 9 fields).
+
+    One thread writes (ingest); any number of API threads read without
+    locking through the seqlock in `_reads`.
+    """
+
+    def __init__(self, raw_capacity=288, minute_buckets=360, hour_buckets=24 * 30, fields=HISTORY_FIELDS):
+        self.fields = list(fields)
+        self.raw = _GrowableRing(raw_capacity, len(self.fields))
+        self.rollups = {
+            'minute': Rollup(60, minute_buckets, self.fields),
+            'hour': Rollup(3600, hour_buckets, self.fields),
+        }
+        self.total = 0
+        self._seq = 0
+
+    def __len__(self):
+        return len(self.raw)
+
+    @_writes
+    def append(self, record):
+        ts = to_epoch(record.get('timestamp'))
+        values = row_values(record, self.fields)
+        self.raw.push(ts, values)
+        for rollup in self.rollups.values():
+            rollup.add(ts, values)
+        self.total += 1
+
+    @_writes
+    def extend_frame(self, df):
+        """Bulk-loads a chronologically sorted DataFrame of stored records."""
+        if df.empty:
+            return
+        ts = epochs_from_series(df['timestamp']) if 'timestamp' in df.columns else np.full(len(df), np.nan)
+        values = np.column_stack([
+            pd.to_numeric(df[f], errors='coerce').to_numpy(dtype=float) if f in df.columns else np.full(len(df), np.nan)
+            for f in self.fields
+        ])
+        for i in np.flatnonzero(~np.isnan(ts))[-self.raw.capacity:]:
+            self.raw.push(ts[i], values[i])
+        for rollup in self.rollups.values():
+            rollup.extend(ts, values)
+        self.total += len(df)
+
+    @_reads
+    def raw_arrays(self):
+        return self.raw.arrays()
+
+    def tier(self, resolution):
+        """The Rollup serving a resolution ('day' is built from hours)."""
+        return self.rollups['hour' if resolution == 'day' else resolution]
+
+    def covers(self, resolution, start):
+        """Whether a resolution still holds data back to `start`."""
+        ring = self.raw if resolution == 'raw' else self.tier(resolution)._ring
+        first, complete = ring.first_ts(), ring.count < ring.capacity
+        return complete or first <= start
+
+    @_reads
+    def query(self, start, end, resolution):
+        """
+        History in [start, end) at one resolution as a dict of timestamps and
+        per-field 'count', 'mean', 'min', 'max' arrays (raw readings report
+        themselves as mean, min and max).
+        """
+        if resolution == 'raw':
+            ts, data = self.raw.range(start, end)
+            count = (~np.isnan(data)).astype(float)
+            return {'timestamps': ts, 'count': count, 'mean': data, 'min': data, 'max': data}
+        bucket_seconds = 86400 if resolution == 'day' else None
+        ts, count, mean, low, high = self.tier(resolution).range(start, end, bucket_seconds)
+        return {'timestamps': ts, 'count': count, 'mean': mean, 'min': low, 'max': high}
+
+    @_reads
+    def resolve(self, start, end, max_points):
+        """
+        Picks the finest resolution that still covers `start` and returns at
+        most `max_points` points; falls back to daily buckets.
+        """
+        for resolution in RESOLUTIONS[:-1]:
+            if not self.covers(resolution, start):
+                continue
+            if resolution == 'raw':
+                points = len(self.raw.range(start, end)[0])
+            else:
+                points = len(self.tier(resolution)._ring.range(start, end)[0])
+            if points <= max_points:
+                return resolution
+        return 'day'
+
+    @_reads
+    def state(self):
+        """Flat dict of arrays capturing every tier, for checkpoints."""
+        arrays = {'total': np.array(self.total)}
+        arrays['raw_ts'], arrays['raw'] = self.raw.arrays()
+        for name, rollup in self.rollups.items():
+            arrays[f'{name}_ts'], arrays[name] = rollup._ring.arrays()
+        return arrays
+
+    @_writes
+    def load_state(self, arrays):
+        """Restores the tiers from `state()` output."""
+        self.raw.load(arrays['raw_ts'], arrays['raw'])
+        for name, rollup in self.rollups.items():
+            rollup._ring.load(arrays[f'{name}_ts'], arrays[name])
+        self.total = int(arrays['total'])
+
+    @property
+    def nbytes(self):
+        return self.raw.nbytes + sum(r.nbytes for r in self.rollups.values())
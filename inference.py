@@ -0,0 +1,181 @@
+import numpy as np
+from collections import namedtuple
+
+# What the API serves predictions from; replaced as a whole, never mutated.
+# `sklearn` is (models, scalers, features) for the per-model fallback, or None.
+ServingModel = namedtuple('ServingModel', ['version', 'bundle', 'forecaster', 'source', 'sklearn', 'loaded_at'])
+
+
+def _scaler_params(scaler, n_features):
+    """Mean and scale of a fitted StandardScaler, honouring with_mean/with_std."""
+    mean = getattr(scaler, 'mean_', None)
+    scale = getattr(scaler, 'scale_', None)
+    if not getattr(scaler, 'with_mean', True) or mean is None:
+        mean = np.zeros(n_features)
+    if not getattr(scaler, 'with_std', True) or scale is None:
+        scale = np.ones(n_features)
+    return np.asarray(mean, dtype=float), np.asarray(scale, dtype=float)
+
+
+def sklearn_params(model, scaler, features):
+    """A fitted scaler + LinearRegression pair as plain arrays: features, coef, intercept, mean, scale."""
+    coef = np.ravel(model.coef_).astype(float)
+    mean, scale = _scaler_params(scaler, len(coef))
+    return {
+        'features': list(features),
+        'coef': coef,
+        'intercept': float(np.ravel(model.intercept_)[0]),
+        'mean': mean,
+        'scale': scale,
+    }
+
+
+class CompiledLinearBundle:
+    """
+    Every target's StandardScaler + LinearRegression folded into one affine map.
+
+    For a model fitted on standardized inputs, coef·((x - mean) / scale) + b
+    equals (coef / scale)·x + (b - Σ coef·mean / scale), so each target
+    becomes one column of a weight matrix over the shared feature base vector
+    (see features.FeatureState.base_vector) and all targets are predicted
+    with a single matmul.
+    """
+
+    def __init__(self, targets, weights, bias, base_names):
+        self.targets = list(targets)
+        self.weights = weights
+        self.bias = bias
+        self.base_names = list(base_names)
+
+    @classmethod
+    def from_sklearn(cls, models, scalers, features, base_names):
+        """Builds the bundle from the per-target objects loaded from models_lr/."""
+        return cls.from_params({target: sklearn_params(models[target], scalers[target], features[target])
+                                for target in models}, base_names)
+
+    @classmethod
+    def from_params(cls, params, base_names):
+        """Builds the bundle from per-target plain arrays (see sklearn_params and model_artifact)."""
+        targets = list(params.keys())
+        lookup = {name: i for i, name in enumerate(base_names)}
+        zero = len(base_names)
+
+        weights = np.zeros((len(base_names) + 1, len(targets)))
+        bias = np.zeros(len(targets))
+        for j, target in enumerate(targets):
+            p = params[target]
+            coef, intercept, mean, scale = p['coef'], p['intercept'], p['mean'], p['scale']
+
+            folded = coef / scale
+            rows = [lookup.get(name, zero) for name in p['features']]
+            np.add.at(weights[:, j], rows, folded)
+            bias[j] = intercept - float(np.dot(folded, mean))
+
+        # Unknown features read the trailing constant-zero slot; keep it inert
+        weights[zero, :] = 0.0
+        return cls(targets, weights, bias, base_names)
+
+    def predict(self, base):
+        """Predictions for every target from one base vector (or a batch of them)."""
+        return base @ self.weights + self.bias
+
+    def predict_dict(self, base, digits=2):
+        values = self.predict(base)
+        return {target: round(float(v), digits) for target, v in zip(self.targets, values)}
+
+    def parity_error(self, models, scalers, features, n_probes=32, seed=0):
+        """
+        Largest relative difference between the fused bundle and the original
+        sklearn scaler + model pairs over random probe vectors.
+        """
+        rng = np.random.default_rng(seed)
+        probes = rng.normal(0.0, 100.0, size=(n_probes, len(self.base_names) + 1))
+        probes[:, -1] = 0.0
+
+        fused = self.predict(probes)
+        lookup = {name: i for i, name in enumerate(self.base_names)}
+        zero = len(self.base_names)
+        worst = 0.0
+        for j, target in enumerate(self.targets):
+            cols = [lookup.get(name, zero) for name in features[target]]
+            expected = models[target].predict(scalers[target].transform(probes[:, cols]))
+            diff = np.abs(fused[:, j] - np.ravel(expected))
+            worst = max(worst, float(np.max(diff / np.maximum(1.0, np.abs(expected)))))
+        return worst
+
+
+class LinearForecaster:
+    """
+    Multi-step forecaster that rolls the feature state forward in closed form.
+
+    With finite inputs every feature is a linear function of the last m
+    sensor rows, so one forecast step is an affine map s' = A s + c on the
+    stacked state s = [row_t, row_t-1, ..., row_t-m+1]. Each predicted row is
+    pushed back into the state, so lags and rolling means advance with the
+    forecast. A and c are built once from the bundle; a horizon of n steps
+    is then n small matrix-vector products.
+    """
+
+    def __init__(self, bundle, fields, window, n_lags):
+        self.bundle = bundle
+        self.fields = list(fields)
+        self.depth = max(n_lags, window - 1, 1)
+        n_fields = len(self.fields)
+        n_state = self.depth * n_fields
+
+        missing = [t for t in bundle.targets if t not in self.fields]
+        if missing:
+            raise ValueError(f"Targets without a sensor field: {missing}")
+        self.target_idx = np.array([self.fields.index(t) for t in bundle.targets], dtype=np.intp)
+
+        def slot(k, f):
+            return k * n_fields + f
+
+        # P maps the state onto the base vector (zero slot stays 0)
+        P = np.zeros((len(bundle.base_names) + 1, n_state))
+        for f in range(n_fields):
+            P[f, slot(0, f)] = 1.0
+            for k in range(1, n_lags + 1):
+                P[k * n_fields + f, slot(k - 1, f)] = 1.0
+            rolling = (n_lags + 1) * n_fields + f
+            # Current row plus the last window-1 history rows (current is row_t)
+            P[rolling, slot(0, f)] += 1.0 / window
+            for k in range(window - 1):
+                P[rolling, slot(k, f)] += 1.0 / window
+
+        M = bundle.weights.T @ P
+        A = np.zeros((n_state, n_state))
+        c = np.zeros(n_state)
+        # New row: predicted targets, other fields carried forward
+        for f in range(n_fields):
+            A[f, slot(0, f)] = 1.0
+        for j, f in enumerate(self.target_idx):
+            A[f, :] = M[j]
+            c[f] = bundle.bias[j]
+        # Older rows shift down one slot
+        for k in range(1, self.depth):
+            for f in range(n_fields):
+                A[slot(k, f), slot(k - 1, f)] = 1.0
+        self.A = A
+        self.c = c
+
+    def rollout(self, state, current, steps):
+        """
+        Forecast `steps` rows (steps x targets). The first step is computed
+        exactly like a single prediction; later steps use the transition map,
+        with any values still missing from history treated as 0.
+        """
+        out = np.empty((steps, len(self.target_idx)))
+        if steps <= 0:
+            return out
+        first = self.bundle.predict(state.base_vector(current))
+        out[0] = first
+
+        history = state.recent(self.depth)
+        row = history[0].copy()
+        row[self.target_idx] = first
+        s = np.nan_to_num(np.concatenate([row] + list(history[:self.depth - 1])), nan=0.0)
+        for k in range(1, steps):
+            s = self.A @ s + self.c
+            out[k] = s[self.target_idx]
+        return out
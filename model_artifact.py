@@ -0,0 +1,152 @@
+"""
+One file per training run holding every served linear model.
+
+An artifact is a NumPy .npz of plain float arrays (per target: coefficients,
+scaler mean and scale; one vector of intercepts) plus a JSON manifest stored
+alongside them: format, version, targets, each target's feature order, when
+and from what it was trained, and its metrics. It is read with
+allow_pickle=False, so loading it imports neither sklearn nor joblib and
+cannot execute code, and it is written atomically, so the model watcher
+never sees half of a run.
+
+Existing models_lr/ pickles (model + scaler + features per target) are
+converted with:
+    python model_artifact.py convert models_lr [--out models_lr/models.npz]
+"""
+import os
+import json
+import hashlib
+import argparse
+import numpy as np
+from datetime import datetime, timezone
+
+ARTIFACT_FORMAT = 1
+ARTIFACT_FILE = 'models.npz'
+# Per-target arrays are stored as t<index>_<name>
+ARRAYS = ('coef', 'mean', 'scale')
+
+
+def artifact_path(directory):
+    return os.path.join(directory, ARTIFACT_FILE)
+
+
+def _encode(value):
+    """JSON fallback for numpy scalars in metrics."""
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+
+def _version(manifest, arrays):
+    h = hashlib.sha1(json.dumps(manifest, sort_keys=True, default=_encode).encode())
+    for name in sorted(arrays):
+        h.update(name.encode())
+        h.update(np.ascontiguousarray(arrays[name]).tobytes())
+    return h.hexdigest()[:10]
+
+
+def write_artifact(path, params, **info):
+    """
+    Writes {target: sklearn_params-style dict} to `path` atomically and
+    returns the manifest. Keyword arguments (e.g. metrics, data) are stored
+    in the manifest as given.
+    """
+    targets = list(params)
+    manifest = {
+        'format': ARTIFACT_FORMAT,
+        'kind': 'standardized_linear',
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'targets': targets,
+        'features': {target: list(params[target]['features']) for target in targets},
+    }
+    manifest.update(info)
+    arrays = {'intercept': np.array([float(params[target]['intercept']) for target in targets])}
+    for j, target in enumerate(targets):
+        for name in ARRAYS:
+            arrays[f't{j}_{name}'] = np.asarray(params[target][name], dtype=float)
+    manifest['version'] = _version(manifest, arrays)
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as fh:
+        np.savez(fh, manifest=np.array(json.dumps(manifest, default=_encode)), **arrays)
+    os.replace(tmp_path, path)
+    return manifest
+
+
+def read_artifact(path):
+    """(manifest, {target: params}) from an artifact; raises ValueError if it is unusable."""
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            manifest = json.loads(str(data['manifest']))
+            arrays = {key: data[key] for key in data.files if key != 'manifest'}
+    except (OSError, ValueError, KeyError) as e:
+        raise ValueError(f"cannot read {path}: {e}")
+    if manifest.get('format') != ARTIFACT_FORMAT:
+        raise ValueError(f"{path}: unsupported artifact format {manifest.get('format')!r}")
+
+    targets = manifest.get('targets', [])
+    intercepts = arrays.get('intercept')
+    if intercepts is None or intercepts.shape != (len(targets),):
+        raise ValueError(f"{path}: expected one intercept per target")
+    params = {}
+    for j, target in enumerate(targets):
+        features = manifest.get('features', {}).get(target)
+        if features is None:
+            raise ValueError(f"{target}: no feature order in the manifest")
+        p = {'features': features, 'intercept': float(intercepts[j])}
+        for name in ARRAYS:
+            value = arrays.get(f't{j}_{name}')
+            if value is None or value.shape != (len(features),):
+                raise ValueError(f"{target}: {name} does not match its {len(features)} features")
+            p[name] = value
+        if not (np.isfinite(p['coef']).all() and np.isfinite(p['intercept'])):
+            raise ValueError(f"{target}: coefficients are not finite")
+        if not (np.isfinite(p['mean']).all() and np.isfinite(p['scale']).all() and (p['scale'] != 0).all()):
+            raise ValueError(f"{target}: scaler mean or scale is not usable")
+        params[target] = p
+    return manifest, params
+
+
+def convert_pickles(directory, out=None):
+    """Writes the artifact for the legacy {target}_{model,scaler,features}.pkl files in `directory`."""
+    import joblib
+    from inference import sklearn_params
+
+    params = {}
+    for path in sorted(os.listdir(directory)):
+        if not path.endswith('_features.pkl'):
+            continue
+        target = path[:-len('_features.pkl')]
+        files = [os.path.join(directory, f'{target}_{kind}.pkl') for kind in ('model', 'scaler', 'features')]
+        if all(os.path.exists(f) for f in files):
+            model, scaler, features = (joblib.load(f) for f in files)
+            params[target] = sklearn_params(model, scaler, features)
+    if not params:
+        raise ValueError(f"no model, scaler and features pickles in {directory}")
+    return write_artifact(out or artifact_path(directory), params, converted_from=directory)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Model artifacts for mqtt_pipeline.py")
+    sub = parser.add_subparsers(dest='command', required=True)
+    convert = sub.add_parser('convert', help='write an artifact from a directory of legacy pickles')
+    convert.add_argument('directory')
+    convert.add_argument('--out', help=f'artifact path (default <directory>/{ARTIFACT_FILE})')
+    show = sub.add_parser('show', help='print an artifact manifest')
+    show.add_argument('path')
+    args = parser.parse_args()
+
+    if args.command == 'convert':
+        out = args.out or artifact_path(args.directory)
+        manifest = convert_pickles(args.directory, out)
+        print(f"Converted {len(manifest['targets'])} models from {args.directory} -> {out} (version {manifest['version']})")
+    else:
+        manifest, _ = read_artifact(args.path)
+        print(json.dumps(manifest, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+import numpy as np
+from features import FeatureState
+from inference import CompiledLinearBundle, LinearForecaster, ServingModel
+from model_artifact import artifact_path, read_artifact
+
+logger = logging.getLogger(__name__)
+
+# A compiled bundle must reproduce the sklearn models this closely to be used
+PARITY_TOLERANCE = 1e-6
+
+
+def _digest(chunks):
+    h = hashlib.sha1()
+    for chunk in chunks:
+        h.update(chunk)
+    return h.hexdigest()[:10]
+
+
+class ModelRegistry:
+    """
+    The models the API serves, replaceable while the pipeline runs.
+
+    `current` is an immutable ServingModel (bundle, forecaster, the sklearn
+    objects for the per-model fallback, and a version) swapped in with one
+    reference assignment, so requests read it once and never see a mix of
+    old and new models. Candidates from `directory` are loaded and
+    validated on the caller's thread (the watcher or an admin request) and
+    only replace the current models if they pass. Versions are content
+    digests, so every worker process serving the same files reports the
+    same version.
+
+    `directory` is served from its model artifact (model_artifact.py) when
+    it has one, without sklearn; otherwise from the legacy per-target
+    pickles.
+
+    Bundles built in-process (the online learner) are only installed when
+    the registry was created with `allow_online`, and then serve until
+    `directory` holds a different version than the one last loaded from it:
+    newer files always win, while reloading unchanged files (the watcher
+    or a forced admin reload) keeps the installed bundle.
+    """
+
+    def __init__(self, directory, targets, layout=None, tolerance=PARITY_TOLERANCE, allow_online=False):
+        self.directory = directory
+        self.targets = list(targets)
+        self.layout = layout or FeatureState()
+        self.tolerance = tolerance
+        self.allow_online = allow_online
+        self.current = None
+        # Version last loaded from `directory`, whatever is serving now
+        self._file_version = None
+        self._stamp = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stats = {'loads': 0, 'rejected': 0, 'last_error': None}
+
+    def _files(self, target):
+        return [os.path.join(self.directory, f'{target}_{kind}.pkl') for kind in ('model', 'scaler', 'features')]
+
+    def stamp(self):
+        """Cheap change detector for the model files (names, sizes, mtimes)."""
+        entries = []
+        paths = [artifact_path(self.directory)] + [path for target in self.targets for path in self._files(target)]
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((path, st.st_size, st.st_mtime_ns))
+        return tuple(entries)
+
+    def load_candidate(self):
+        """Loads and validates the models in `directory`; raises ValueError if they are unusable."""
+        path = artifact_path(self.directory)
+        if os.path.exists(path):
+            return self.load_artifact(path)
+        return self.load_pickles()
+
+    def load_artifact(self, path):
+        manifest, params = read_artifact(path)
+        params = {target: params[target] for target in self.targets if target in params}
+        if not params:
+            raise ValueError(f"no served targets in {path}")
+        known = set(self.layout.feature_names)
+        for target, p in params.items():
+            unknown = [name for name in p['features'] if name not in known]
+            if unknown:
+                raise ValueError(f"{target}: features not in the serving layout: {unknown}")
+        bundle = CompiledLinearBundle.from_params(params, self.layout.feature_names)
+        return self._serving(manifest['version'], bundle, path)
+
+    def load_pickles(self):
+        import joblib
+
+        models, scalers, features, chunks = {}, {}, {}, []
+        for target in self.targets:
+            paths = self._files(target)
+            if not all(os.path.exists(path) for path in paths):
+                continue
+            for path in paths:
+                with open(path, 'rb') as fh:
+                    chunks.append(fh.read())
+            try:
+                model, scaler, names = (joblib.load(path) for path in paths)
+            except Exception as e:
+                raise ValueError(f"cannot load {target}: {e}")
+            names = list(names)
+            coef = np.ravel(getattr(model, 'coef_', []))
+            if len(coef) != len(names) or len(np.ravel(getattr(scaler, 'scale_', coef))) != len(names):
+                raise ValueError(f"{target}: model, scaler and feature list disagree on the number of features")
+            if not np.isfinite(coef).all():
+                raise ValueError(f"{target}: coefficients are not finite")
+            models[target], scalers[target], features[target] = model, scaler, names
+        if not models:
+            raise ValueError(f"no models found in {self.directory}")
+
+        version = _digest(chunks)
+        bundle = None
+        try:
+            candidate = CompiledLinearBundle.from_sklearn(models, scalers, features, self.layout.feature_names)
+            parity = candidate.parity_error(models, scalers, features)
+            if parity <= self.tolerance:
+                bundle = candidate
+                logger.info(f"⚡ Compiled {len(bundle.targets)} models into one inference bundle (parity error {parity:.2e})")
+            else:
+                logger.warning(f"⚠️  Inference bundle failed parity check ({parity:.2e}); using per-model predictions")
+        except Exception as e:
+            logger.error(f"❌ Error compiling inference bundle: {e}")
+        return self._serving(version, bundle, self.directory, (models, scalers, features))
+
+    def _serving(self, version, bundle, source, sklearn=None):
+        forecaster = None
+        if bundle is not None:
+            try:
+                forecaster = LinearForecaster(bundle, self.layout.fields, self.layout.window, self.layout.n_lags)
+            except Exception as e:
+                logger.error(f"❌ Error building forecaster: {e}")
+        return ServingModel(version, bundle, forecaster, source, sklearn, time.time())
+
+    def reload(self, force=False):
+        """
+        Loads `directory` if its files changed (or `force`) and swaps the
+        result in. Returns the new ServingModel, or None if the files hold
+        the version already loaded from them or the candidate was rejected
+        (the current models stay in place).
+        """
+        with self._lock:
+            stamp = self.stamp()
+            if not force and stamp == self._stamp:
+                return None
+            self._stamp = stamp
+            try:
+                candidate = self.load_candidate()
+            except Exception as e:
+                self._stats['rejected'] += 1
+                self._stats['last_error'] = str(e)
+                logger.error(f"❌ Rejected models from {self.directory}: {e}")
+                return None
+            if candidate.version == self._file_version:
+                return None
+            self._file_version = candidate.version
+            self.current = candidate
+            self._stats['loads'] += 1
+            self._stats['last_error'] = None
+        n = len(candidate.bundle.targets if candidate.bundle is not None else candidate.sklearn[0])
+        logger.info(f"🤖 Serving {n} ML models from {candidate.source} (version {candidate.version})")
+        return candidate
+
+    def install(self, bundle, source):
+        """
+        Serves a bundle built in-process (e.g. by the online learner) until
+        `directory` changes. Returns None without installing it unless the
+        registry allows online models.
+        """
+        if not self.allow_online:
+            return None
+        version = f"{source}-{_digest([bundle.weights.tobytes(), bundle.bias.tobytes()])}"
+        serving = self._serving(version, bundle, source)
+        with self._lock:
+            if self.current is not None and self.current.version == version:
+                return None
+            self.current = serving
+            self._stats['loads'] += 1
+        return serving
+
+    def watch(self, interval):
+        """Polls `directory` and reloads once a change has settled for one interval."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, args=(interval,), name="model-watcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self, interval):
+        seen = self.stamp()
+        while True:
+            time.sleep(interval)
+            try:
+                stamp = self.stamp()
+                # Only reload once the files stopped changing (training writes them one by one)
+                if stamp == seen and stamp != self._stamp:
+                    self.reload()
+                seen = stamp
+            except Exception as e:
+                logger.error(f"❌ Error watching {self.directory}: {e}")
+
+    def info(self):
+        model = self.current
+        info = dict(self._stats)
+        info.update({
+            'version': model.version if model is not None else None,
+            'source': model.source if model is not None else None,
+            'loaded_at': model.loaded_at if model is not None else None,
+            'targets': list(model.bundle.targets if model.bundle is not None else model.sklearn[0])
+            if model is not None else [],
+            'compiled': model is not None and model.bundle is not None,
+            'file_version': self._file_version,
+            'allow_online': self.allow_online,
+        })
+        return info
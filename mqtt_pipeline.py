@@ -1,21 +1,38 @@
 import os
-import json
+import sys
+import hmac
+import queue
+import atexit
+import signal
+import time
 import logging
 import threading
 import pandas as pd
 import numpy as np
-import joblib
 import paho.mqtt.client as mqtt
 from dotenv import load_dotenv
 from flask_cors import CORS
-from flask import Flask, jsonify
+from flask import Flask, Response, jsonify, request, send_file, stream_with_context
 from datetime import datetime, timedelta
+from io import BytesIO
+from storage import MONGO_BUCKET_SECONDS, ExcelStorage, WriteBehindWriter, create_storage
+from features import FeatureState, SENSOR_FIELDS, target_feature_names
+from model_registry import ModelRegistry
+from broadcast import Broadcaster, format_sse
+from cache import merged_stats
+from devices import DeviceRegistry
+from checkpoint import apply_checkpoint, online_state, read_checkpoint, save_checkpoint
+from aqi import aqi_array, compute_aqi
+from shared_state import SharedRegistry, StatePublisher, default_state_dir
+from history import HISTORY_FIELDS, RESOLUTIONS, from_epoch, to_epoch
+from uplink import parse_uplink
+from online import OnlineLinearLearner
 
 # -----------------------------
 # Logging setup
 # -----------------------------
 logging.basicConfig(
-    level=logging.INFO,
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
     format="%(asctime)s [%(levelname)s] %(name)s: %(message)s"
 )
 logger = logging.getLogger(__name__)
@@ -25,6 +42,17 @@ logger = logging.getLogger(__name__)
 # -----------------------------
 load_dotenv("am3.env")
 
+# Process role: "all" runs MQTT ingest and the API in one process (development);
+# "ingest" and "api" split them into separate processes that share device
+# state through STATE_DIR (see wsgi.py for serving the API with gunicorn)
+PIPELINE_ROLE = os.getenv("PIPELINE_ROLE", "all")
+if PIPELINE_ROLE not in ("all", "ingest", "api"):
+    logger.error(f"❌ Unknown PIPELINE_ROLE: {PIPELINE_ROLE}")
+    exit(1)
+STATE_DIR = os.getenv("STATE_DIR") or default_state_dir()
+STATE_PUBLISH_INTERVAL = float(os.getenv("STATE_PUBLISH_INTERVAL", "0.05"))
+STATE_POLL_INTERVAL = float(os.getenv("STATE_POLL_INTERVAL", "0.5"))
+
 # MQTT settings
 MQTT_BROKER = os.getenv("MQTT_BROKER")
 MQTT_PORT = int(os.getenv("MQTT_PORT", "1883"))
@@ -32,94 +60,191 @@ MQTT_TOPIC = os.getenv("MQTT_TOPIC")
 MQTT_USERNAME = os.getenv("MQTT_USERNAME")
 MQTT_PASSWORD = os.getenv("MQTT_PASSWORD")
 
-if not all([MQTT_BROKER, MQTT_TOPIC, MQTT_USERNAME, MQTT_PASSWORD]):
+if PIPELINE_ROLE != "api" and not all([MQTT_BROKER, MQTT_TOPIC, MQTT_USERNAME, MQTT_PASSWORD]):
     logger.error("❌ Missing MQTT configuration in am3.env")
     exit(1)
 
 # Global storage
 EXCEL_FILE = "sensor_data.xlsx"
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "segments")
+STORAGE_DIR = os.getenv("STORAGE_DIR", "sensor_store")
 
-# Load existing data if file exists
-if os.path.exists(EXCEL_FILE):
-    try:
-        existing_df = pd.read_excel(EXCEL_FILE)
-        
-        # Ensure timestamp column is datetime for sorting
-        if 'timestamp' in existing_df.columns:
-            existing_df['timestamp'] = pd.to_datetime(existing_df['timestamp'])
-            existing_df = existing_df.sort_values(by='timestamp', ascending=True)
-            
-            # Save the sorted data back to the file to "reorganize" it
-            existing_df.to_excel(EXCEL_FILE, index=False)
-            logger.info(f"✅ Reorganized (sorted) {len(existing_df)} records in {EXCEL_FILE}")
-            
-        sensor_data_history = existing_df.to_dict('records')
-        
-        if sensor_data_history:
-             # Find the last row that has valid sensor data (not all NaN)
-             latest_sensor_data = {}
-             for row in reversed(sensor_data_history):
-                 # Check if this row has at least one valid sensor value
-                 if (pd.notna(row.get('pm2_5')) or 
-                     pd.notna(row.get('pm10')) or 
-                     pd.notna(row.get('co2'))):
-                     # Extract only the sensor-related fields
-                     latest_sensor_data = {
-                         'timestamp': row.get('timestamp'),
-                         'pm2_5': row.get('pm2_5') if pd.notna(row.get('pm2_5')) else 0,
-                         'pm10': row.get('pm10') if pd.notna(row.get('pm10')) else 0,
-                         'co2': row.get('co2') if pd.notna(row.get('co2')) else 0,
-                         'tvoc': row.get('tvoc') if pd.notna(row.get('tvoc')) else 0,
-                         'humidity': row.get('humidity') if pd.notna(row.get('humidity')) else 0,
-                         'temperature': row.get('temperature') if pd.notna(row.get('temperature')) else 0,
-                     }
-                     logger.info(f"🔄 Initialized latest data from history: {latest_sensor_data.get('timestamp', 'Unknown Time')}")
-                     break
-             
-             if not latest_sensor_data:
-                 logger.warning("⚠ No valid sensor data found in Excel file")
+WRITER_QUEUE_SIZE = int(os.getenv("WRITER_QUEUE_SIZE", "10000"))
+WRITER_BATCH_ROWS = int(os.getenv("WRITER_BATCH_ROWS", "500"))
+WRITER_FLUSH_INTERVAL = float(os.getenv("WRITER_FLUSH_INTERVAL", "2.0"))
+WRITER_BLOCK_TIMEOUT = float(os.getenv("WRITER_BLOCK_TIMEOUT", "0"))
+
+# Startup snapshot of in-memory state; older history stays in storage until requested
+CHECKPOINT_FILE = os.getenv("CHECKPOINT_FILE", os.path.join(STORAGE_DIR, "checkpoint.npz"))
+CHECKPOINT_INTERVAL = float(os.getenv("CHECKPOINT_INTERVAL", "300"))
+# Ingest pauses while a checkpoint waits for queued records to be written
+CHECKPOINT_FLUSH_TIMEOUT = float(os.getenv("CHECKPOINT_FLUSH_TIMEOUT", "10"))
+
+# STORAGE_BACKEND=mongo: a time-series collection; API workers read older history from it too
+MONGO_OPTIONS = {
+    'uri': os.getenv("MONGO_URI"),
+    'database': os.getenv("MONGO_DB", "air_quality"),
+    'collection': os.getenv("MONGO_COLLECTION", "sensor_data"),
+    'maxPoolSize': int(os.getenv("MONGO_POOL_SIZE", "10")),
+}
+
+# API workers only read storage (exports, older history); the ingest process owns the writes
+storage = create_storage(STORAGE_BACKEND, STORAGE_DIR, EXCEL_FILE, mongo=MONGO_OPTIONS,
+                         read_only=PIPELINE_ROLE == "api")
+
+def import_legacy_history():
+    """Imports the legacy Excel file into an empty store once."""
+    if isinstance(storage, ExcelStorage) or not os.path.exists(EXCEL_FILE) or storage.count() > 0:
+        return
+    existing_df = pd.read_excel(EXCEL_FILE)
+    storage.append(existing_df.to_dict('records'))
+    logger.info(f"📥 Imported {len(existing_df)} records from {EXCEL_FILE} into {STORAGE_BACKEND} storage")
+
+# Raw readings kept per device, then minute / hour aggregates beyond that
+HISTORY_CONFIG = {
+    'raw_capacity': int(os.getenv("HISTORY_RAW_CAPACITY", "288")),
+    'minute_buckets': int(os.getenv("HISTORY_MINUTE_BUCKETS", "360")),
+    'hour_buckets': int(os.getenv("HISTORY_HOUR_BUCKETS", str(24 * 30))),
+}
+DEVICE_CACHE_ENTRIES = int(os.getenv("DEVICE_CACHE_ENTRIES", "16"))
+
+# Per-device state: uplinks from different LoRaWAN devices never share lags or caches.
+# API workers read the ingest process's published state instead of owning any.
+if PIPELINE_ROLE == "api":
+    registry = SharedRegistry(STATE_DIR, HISTORY_CONFIG, DEVICE_CACHE_ENTRIES)
+else:
+    registry = DeviceRegistry(
+        history_config=HISTORY_CONFIG,
+        cache_entries=DEVICE_CACHE_ENTRIES,
+        max_devices=int(os.getenv("MAX_DEVICES", "10000")),
+    )
+
+# Online learning (opt-in): every ingested reading updates running
+# least-squares statistics, and the served models are periodically re-solved
+# from them. Only role "all" serves what it solves; the ingest role keeps the
+# statistics in its checkpoints but has no API to serve them from
+ONLINE_LEARNING = os.getenv("ONLINE_LEARNING", "0").lower() not in ("0", "false", "no")
+ONLINE_MIN_SAMPLES = int(os.getenv("ONLINE_MIN_SAMPLES", "1000"))
+ONLINE_RESOLVE_INTERVAL = float(os.getenv("ONLINE_RESOLVE_INTERVAL", "600"))
+online_learner = None
+if PIPELINE_ROLE != "api" and ONLINE_LEARNING:
+    online_learner = OnlineLinearLearner(
+        SENSOR_FIELDS,
+        {target: target_feature_names(target) for target in SENSOR_FIELDS},
+        FeatureState().feature_names,
+        min_samples=ONLINE_MIN_SAMPLES,
+    )
+
+def seed_registry(df):
+    """Seeds device state from stored records, oldest first."""
+    if 'timestamp' in df.columns:
+        df = df.assign(timestamp=pd.to_datetime(df['timestamp'], format='ISO8601'))
+    for device in registry.seed_frame(df):
+        if device.latest:
+            logger.info(f"🔄 Initialized {device.device_id} from history: {device.latest.get('timestamp', 'Unknown Time')}")
         else:
-             latest_sensor_data = {}
-             
-        logger.info(f"📂 Loaded {len(sensor_data_history)} historical records from {EXCEL_FILE}")
+            logger.warning(f"⚠ No valid sensor data found for {device.device_id}")
+
+def restore_state():
+    """
+    Restores device state at startup and returns the number of stored records.
+
+    With a checkpoint only the records stored after it are read; without one
+    (or if storage no longer matches it) the full history is loaded once.
+    """
+    import_legacy_history()
+    stored_rows = storage.count()
+    checkpoint = read_checkpoint(CHECKPOINT_FILE)
+    if checkpoint is not None and checkpoint[0]['rows'] <= stored_rows:
+        checkpoint_rows = apply_checkpoint(registry, checkpoint)
+        saved = online_state(checkpoint)
+        if online_learner is not None and saved is not None and online_learner.load_state(*saved):
+            logger.info(f"🧠 Restored online learning statistics ({online_learner.count} samples)")
+        tail_df = storage.read_since(checkpoint_rows)
+        if not tail_df.empty:
+            seed_registry(tail_df)
+        logger.info(f"📂 Restored {len(registry)} device(s) from {CHECKPOINT_FILE} and {len(tail_df)} newer record(s)")
+        return stored_rows
+
+    existing_df = storage.read_all()
+    if existing_df.empty:
+        logger.info("ℹ No existing data found. Starting fresh.")
+        return stored_rows
+    if 'timestamp' in existing_df.columns:
+        existing_df['timestamp'] = pd.to_datetime(existing_df['timestamp'], format='ISO8601')
+        existing_df = existing_df.sort_values(by='timestamp', ascending=True)
+    seed_registry(existing_df)
+    logger.info(f"📂 Loaded {len(existing_df)} historical records for {len(registry)} device(s) from {STORAGE_BACKEND} storage")
+    return stored_rows
+
+stored_rows_at_boot = 0
+if PIPELINE_ROLE != "api":
+    try:
+        stored_rows_at_boot = restore_state()
     except Exception as e:
-        logger.warning(f"⚠ Found existing Excel file but failed to load it: {e}")
-        sensor_data_history = []
-        latest_sensor_data = {}
-else:
-    logger.info("ℹ No existing data file found. Starting fresh.")
-    sensor_data_history = []
+        logger.warning(f"⚠ Found existing data but failed to load it: {e}")
+        stored_rows_at_boot = storage.count()
+
+# Held while a record is applied to memory and queued for storage, so a
+# checkpoint always matches a known number of stored rows
+ingest_lock = threading.Lock()
+
+# Counts every ingest. Each device also has its own version, which keys its
+# cached responses and ETags; the registry's boot id keeps ETags from one
+# ingest process run from matching the next, and the device's generation
+# those of an evicted device from matching its re-created successor.
+data_version = 0
+
+# Live updates are pushed to /api/stream subscribers from on_message
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+live_updates = Broadcaster(max_pending=int(os.getenv("SSE_MAX_PENDING", "16")))
+
+# Persistence runs on its own thread so on_message never waits on the disk
+storage_writer = None
+if PIPELINE_ROLE != "api":
+    storage_writer = WriteBehindWriter(
+        storage,
+        max_queue=WRITER_QUEUE_SIZE,
+        batch_rows=WRITER_BATCH_ROWS,
+        flush_interval=WRITER_FLUSH_INTERVAL,
+        block_timeout=WRITER_BLOCK_TIMEOUT,
+    ).start()
+    atexit.register(storage_writer.close)
+
+# The ingest process hands device state to API workers through STATE_DIR
+state_publisher = None
+if PIPELINE_ROLE == "ingest":
+    state_publisher = StatePublisher(STATE_DIR, registry, ingest_lock, interval=STATE_PUBLISH_INTERVAL).start()
+    logger.info(f"📡 Publishing device state to {STATE_DIR}")
 
 # -----------------------------
 # Load ML Models
 # -----------------------------
-ml_models = {}
-ml_scalers = {}
-ml_features = {}
+# The registry owns the served models; new files in MODELS_DIR (or a call to
+# /api/models/reload) are loaded and validated off the request path and
+# swapped in whole, so retraining never needs a restart
+MODELS_DIR = os.getenv("MODELS_DIR", "models_lr")
+MODEL_WATCH_INTERVAL = float(os.getenv("MODEL_WATCH_INTERVAL", "5"))
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+models = ModelRegistry(MODELS_DIR, SENSOR_FIELDS, allow_online=online_learner is not None and PIPELINE_ROLE == "all")
 
-MODELS_DIR = 'models_lr'
 if os.path.exists(MODELS_DIR):
-    try:
-        sensor_targets = ['pm2_5', 'pm10', 'co2', 'tvoc', 'temperature', 'humidity']
-        for target in sensor_targets:
-            model_path = os.path.join(MODELS_DIR, f'{target}_model.pkl')
-            scaler_path = os.path.join(MODELS_DIR, f'{target}_scaler.pkl')
-            features_path = os.path.join(MODELS_DIR, f'{target}_features.pkl')
-            
-            if os.path.exists(model_path) and os.path.exists(scaler_path) and os.path.exists(features_path):
-                ml_models[target] = joblib.load(model_path)
-                ml_scalers[target] = joblib.load(scaler_path)
-                ml_features[target] = joblib.load(features_path)
-                logger.info(f"✅ Loaded ML model for {target}")
-        
-        if ml_models:
-            logger.info(f"🤖 Loaded {len(ml_models)} ML models for predictions")
-        else:
-            logger.warning("⚠️  No ML models found. Run train_model.py first.")
-    except Exception as e:
-        logger.error(f"❌ Error loading ML models: {e}")
+    if models.reload() is None:
+        logger.warning("⚠️  No ML models found. Run train_model.py first.")
 else:
     logger.warning(f"⚠️  Models directory '{MODELS_DIR}' not found. Predictions will be unavailable.")
+if MODEL_WATCH_INTERVAL > 0:
+    models.watch(MODEL_WATCH_INTERVAL)
+
+# Multi-step forecasts roll the fused models forward with a transition matrix
+MAX_FORECAST_HOURS = int(os.getenv("MAX_FORECAST_HOURS", str(24 * 30)))
+
+def models_available():
+    return models.current is not None
+
+def model_version(model):
+    """Part of every prediction's cache key and ETag, so a new model is never masked by a cached response."""
+    return model.version if model is not None else None
 
 
 # -----------------------------
@@ -128,36 +253,14 @@ else:
 app = Flask(__name__)
 CORS(app) # Enable CORS for all routes
 
-@app.route('/api/data', methods=['GET'])
-def get_latest_data():
-    """Returns the latest sensor data."""
-    # Create a copy to avoid modifying the global directly in a way that might affect other threads if we were deeper
-    # But for simple replacement it's fine.
-    response_data = latest_sensor_data.copy() if isinstance(latest_sensor_data, dict) else {}
+def build_latest_payload(data):
+    """Latest sensor data with AQI filled in and NaNs replaced, ready to serialize."""
+    # Work on a copy so the shared record is never modified
+    response_data = data.copy() if isinstance(data, dict) else {}
     
     # Calculate AQI if not present
     if 'aqi' not in response_data or response_data['aqi'] is None or response_data['aqi'] == 0:
-        pm25 = float(response_data.get('pm2_5', 0) or 0)
-        pm10 = float(response_data.get('pm10', 0) or 0)
-        
-        # Simple AQI calc (US EPA style approximation)
-        def calc_aqi(pm25, pm10):
-            aqi_pm25 = 0
-            if pm25 <= 12.0: aqi_pm25 = ((50 - 0) / (12.0 - 0)) * (pm25 - 0) + 0
-            elif pm25 <= 35.4: aqi_pm25 = ((100 - 51) / (35.4 - 12.1)) * (pm25 - 12.1) + 51
-            elif pm25 <= 55.4: aqi_pm25 = ((150 - 101) / (55.4 - 35.5)) * (pm25 - 35.5) + 101
-            elif pm25 <= 150.4: aqi_pm25 = ((200 - 151) / (150.4 - 55.5)) * (pm25 - 55.5) + 151
-            else: aqi_pm25 = 300 # Rough cap for simplification
-            
-            aqi_pm10 = 0
-            if pm10 <= 54: aqi_pm10 = ((50 - 0) / (54 - 0)) * (pm10 - 0) + 0
-            elif pm10 <= 154: aqi_pm10 = ((100 - 51) / (154 - 55)) * (pm10 - 55) + 51
-            elif pm10 <= 254: aqi_pm10 = ((150 - 101) / (254 - 155)) * (pm10 - 155) + 101
-            else: aqi_pm10 = 300
-            
-            return max(aqi_pm25, aqi_pm10)
-
-        response_data['aqi'] = int(calc_aqi(pm25, pm10))
+        response_data['aqi'] = compute_aqi(response_data)
 
     # helper to clean NaN
     def clean_nans(d):
@@ -171,70 +274,125 @@ def get_latest_data():
                 cleaned[k] = v
         return cleaned
 
-    cleaned_data = clean_nans(response_data)
-    return jsonify(cleaned_data)
+    return clean_nans(response_data)
+
+def versioned_json_response(device, snapshot, key, build):
+    """
+    Serves a JSON document that only changes when the device sends new data.
+
+    The strong ETag is derived from the snapshot's data version, so a matching
+    If-None-Match gets a 304 without building anything, and the serialized
+    bytes are cached per version for every other poll. `snapshot` is read once
+    by the caller and `build` works from it, so the body matches the ETag even
+    while ingest publishes newer state.
+    """
+    version = snapshot.version
+    etag = f"{registry.boot_id}-{device.device_id}-g{device.generation}-v{version}-" + "-".join(str(part) for part in key)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        body = device.cache.get_or_compute(key, version, lambda: app.json.response(build()).get_data())
+        response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def lookup_device(device_id):
+    """Returns (device, error_response) for a device ID from the URL."""
+    device = registry.get(device_id)
+    if device is None:
+        return None, (jsonify({'error': f'Unknown device: {device_id}'}), 404)
+    return device, None
+
+def respond_latest_data(device):
+    if device is None:
+        return jsonify(build_latest_payload({}))
+    snapshot = device.snapshot
+    return versioned_json_response(device, snapshot, ('data',), lambda: build_latest_payload(snapshot.latest))
+
+@app.route('/api/data', methods=['GET'])
+def get_latest_data():
+    """Returns the latest sensor data."""
+    return respond_latest_data(registry.latest())
+
+def latest_event(snapshot):
+    """A device's latest reading encoded once as a Server-Sent Event."""
+    event_id = registry.data_version if PIPELINE_ROLE == "api" else data_version
+    return format_sse(app.json.dumps(build_latest_payload(snapshot.latest)), event='reading', event_id=event_id)
+
+def watch_shared_state():
+    """API workers: turns newly published device versions into live update events."""
+    versions, _ = registry.changed({})
+    while True:
+        time.sleep(STATE_POLL_INTERVAL)
+        try:
+            versions, changed = registry.changed(versions)
+            for device_id in changed:
+                device = registry.get(device_id)
+                if device is not None and device.latest:
+                    live_updates.publish(latest_event(device.snapshot))
+        except Exception as e:
+            logger.error(f"❌ Error watching shared state: {e}")
+
+if PIPELINE_ROLE == "api":
+    threading.Thread(target=watch_shared_state, name="state-watcher", daemon=True).start()
+
+@app.route('/api/stream', methods=['GET'])
+def stream_latest_data():
+    """Pushes every new reading (with AQI) to the client as Server-Sent Events"""
+    def events():
+        subscription = live_updates.subscribe()
+        try:
+            # Start with the current state so clients don't wait for the next uplink
+            device = registry.latest()
+            if device is not None and device.latest:
+                yield latest_event(device.snapshot)
+            while True:
+                try:
+                    yield subscription.get(timeout=SSE_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    # Comment line keeps proxies from closing an idle connection
+                    yield b": keep-alive\n\n"
+        finally:
+            live_updates.unsubscribe(subscription)
+
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
 
 # Helper function to prepare features for prediction
-def prepare_features_for_prediction(current_data, target_col, feature_names):
+def prepare_features_for_prediction(snapshot, current_data, target_col, feature_names):
     """Prepare feature vector for ML prediction"""
     try:
-        # Get historical data for lag features
-        if len(sensor_data_history) < 3:
-            return None
-        
-        recent_data = sensor_data_history[-3:]
-        
-        # Create a temporary dataframe with recent data
-        df_temp = pd.DataFrame(recent_data)
-        
-        # Add current data as the latest row
-        current_row = {k: v for k, v in current_data.items() if k in ['pm2_5', 'pm10', 'co2', 'tvoc', 'temperature', 'humidity']}
-        df_temp = pd.concat([df_temp, pd.DataFrame([current_row])], ignore_index=True)
-        
-        # Create lag features
-        df_temp[f'{target_col}_lag1'] = df_temp[target_col].shift(1)
-        df_temp[f'{target_col}_lag2'] = df_temp[target_col].shift(2)
-        
-        # Create rolling mean features
-        rolling_window = 3
-        for col in ['pm2_5', 'pm10', 'co2', 'tvoc', 'temperature', 'humidity']:
-            if col != target_col and col in df_temp.columns:
-                rolling_col = f'{col}_rolling_mean_{rolling_window}'
-                df_temp[rolling_col] = df_temp[col].rolling(window=rolling_window, min_periods=1).mean()
-        
-        # Get the last row (current data with features)
-        feature_row = df_temp.iloc[-1]
-        
-        # Extract features in the correct order
-        feature_values = []
-        for feat in feature_names:
-            if feat in feature_row:
-                val = feature_row[feat]
-                feature_values.append(val if pd.notna(val) else 0)
-            else:
-                feature_values.append(0)
-        
-        return np.array(feature_values).reshape(1, -1)
-    
+        # Lags and rolling means come from the device's streaming state, no DataFrame needed
+        return snapshot.features.vector(feature_names, current=current_data)
     except Exception as e:
         logger.error(f"Error preparing features: {e}")
         return None
 
-@app.route('/api/predict', methods=['GET'])
-def predict_next():
-    """Predict next values for all pollutants"""
-    if not ml_models:
-        return jsonify({'error': 'ML models not loaded. Run train_model.py first.'}), 503
-    
-    if not latest_sensor_data:
-        return jsonify({'error': 'No sensor data available'}), 404
+def compute_predictions(snapshot, model):
+    """Next-step predictions for every target from a device's latest reading."""
+    if model.bundle is not None:
+        # All targets in one matmul over the shared feature vector
+        if snapshot.features.ready():
+            predictions = model.bundle.predict_dict(snapshot.features.base_vector(snapshot.latest))
+        else:
+            predictions = {target: None for target in model.bundle.targets}
+        return {
+            'predictions': predictions,
+            'model_version': model.version,
+            'timestamp': datetime.now().isoformat()
+        }
     
     predictions = {}
+    ml_models, ml_scalers, ml_features = model.sklearn
     
-    for target, model in ml_models.items():
+    for target, regressor in ml_models.items():
         try:
             # Prepare features
-            features = prepare_features_for_prediction(latest_sensor_data, target, ml_features[target])
+            features = prepare_features_for_prediction(snapshot, snapshot.latest, target, ml_features[target])
             if features is None:
                 predictions[target] = None
                 continue
@@ -243,116 +401,386 @@ def predict_next():
             features_scaled = ml_scalers[target].transform(features)
             
             # Predict
-            pred_value = model.predict(features_scaled)[0]
+            pred_value = regressor.predict(features_scaled)[0]
             predictions[target] = round(float(pred_value), 2)
             
         except Exception as e:
             logger.error(f"Error predicting {target}: {e}")
             predictions[target] = None
     
-    return jsonify({
+    return {
         'predictions': predictions,
+        'model_version': model.version,
         'timestamp': datetime.now().isoformat()
-    })
+    }
 
-@app.route('/api/forecast/24h', methods=['GET'])
-def forecast_24h():
-    """Generate 24-hour hourly forecast"""
-    if not ml_models:
-        return jsonify({'error': 'ML models not loaded'}), 503
-    
-    if not latest_sensor_data or len(sensor_data_history) < 3:
-        return jsonify({'error': 'Insufficient data for forecasting'}), 404
+def respond_prediction(device):
+    if not models_available():
+        return jsonify({'error': 'ML models not loaded. Run train_model.py first.'}), 503
     
-    forecast_hours = []
-    current_values = latest_sensor_data.copy()
+    snapshot = device.snapshot if device is not None else None
+    if snapshot is None or not snapshot.latest:
+        return jsonify({'error': 'No sensor data available'}), 404
     
-    # Generate hourly predictions
-    for hour in range(1, 25):
-        hour_predictions = {}
-        timestamp = datetime.now() + timedelta(hours=hour)
-        
-        for target in ml_models.keys():
+    model = models.current
+    return versioned_json_response(device, snapshot, ('predict', model_version(model)),
+                                   lambda: compute_predictions(snapshot, model))
+
+@app.route('/api/predict', methods=['GET'])
+def predict_next():
+    """Predict next values for all pollutants"""
+    return respond_prediction(registry.latest())
+
+def forecast_values(snapshot, model, steps):
+    """Forecasts `steps` hourly rows as a (steps x targets) array, plus the target names."""
+    if model.forecaster is not None:
+        return model.forecaster.rollout(snapshot.features, snapshot.latest, steps), model.bundle.targets
+
+    # Per-model fallback: the original recursive loop
+    ml_models, ml_scalers, ml_features = model.sklearn
+    targets = list(ml_models.keys())
+    values = np.zeros((steps, len(targets)))
+    current_values = snapshot.latest.copy()
+    for step in range(steps):
+        for j, target in enumerate(targets):
             try:
-                features = prepare_features_for_prediction(current_values, target, ml_features[target])
+                features = prepare_features_for_prediction(snapshot, current_values, target, ml_features[target])
                 if features is not None:
                     features_scaled = ml_scalers[target].transform(features)
                     pred_value = ml_models[target].predict(features_scaled)[0]
-                    hour_predictions[target] = round(float(pred_value), 2)
+                    values[step, j] = pred_value
                     current_values[target] = pred_value  # Update for next iteration
                 else:
-                    hour_predictions[target] = current_values.get(target, 0)
-            except:
-                hour_predictions[target] = current_values.get(target, 0)
-        
-        forecast_hours.append({
+                    values[step, j] = float(current_values.get(target, 0) or 0)
+            except Exception:
+                values[step, j] = float(current_values.get(target, 0) or 0)
+    return values, targets
+
+def forecast_aqi(targets, values):
+    """AQI for every forecast row at once (None where the pollutants diverged)."""
+    aqi = aqi_array({target: values[:, j] for j, target in enumerate(targets)})
+    if len(aqi) == 0:
+        return [None] * len(values)
+    return [int(v) if np.isfinite(v) else None for v in aqi]
+
+def rounded_values(targets, row):
+    """Maps targets to rounded forecast values (None once a forecast diverges)."""
+    return {target: round(float(v), 2) if np.isfinite(v) else None for target, v in zip(targets, row)}
+
+def parse_horizon(name, default, maximum):
+    """Reads an optional positive integer query parameter. Returns (value, error_response)."""
+    raw = request.args.get(name)
+    if raw is None:
+        return default, None
+    try:
+        value = int(raw)
+    except ValueError:
+        value = 0
+    if not 1 <= value <= maximum:
+        return None, (jsonify({'error': f"'{name}' must be an integer between 1 and {maximum}"}), 400)
+    return value, None
+
+def build_hourly_forecast(snapshot, model, hours):
+    values, targets = forecast_values(snapshot, model, hours)
+    aqi = forecast_aqi(targets, values)
+    now = datetime.now()
+    forecast_hours = [
+        {
             'hour': hour,
-            'timestamp': timestamp.isoformat(),
-            'values': hour_predictions
-        })
+            'timestamp': (now + timedelta(hours=hour)).isoformat(),
+            'values': rounded_values(targets, values[hour - 1]),
+            'aqi': aqi[hour - 1]
+        }
+        for hour in range(1, hours + 1)
+    ]
+    return {'forecast': forecast_hours, 'model_version': model.version}
+
+def build_daily_forecast(snapshot, model, days):
+    # Predict 24 hours per day and average them
+    values, targets = forecast_values(snapshot, model, days * 24)
+    with np.errstate(over='ignore', invalid='ignore'):
+        day_avg = values.reshape(days, 24, len(targets)).mean(axis=1)
+    # PM AQI is defined on 24-hour averages, so the daily means are the right input
+    aqi = forecast_aqi(targets, day_avg)
     
-    return jsonify({'forecast': forecast_hours})
+    now = datetime.now()
+    forecast_days = [
+        {
+            'day': day,
+            'date': (now + timedelta(days=day)).strftime('%Y-%m-%d'),
+            'values': rounded_values(targets, day_avg[day - 1]),
+            'aqi': aqi[day - 1]
+        }
+        for day in range(1, days + 1)
+    ]
+    return {'forecast': forecast_days, 'model_version': model.version}
 
-@app.route('/api/forecast/week', methods=['GET'])
-def forecast_week():
-    """Generate 7-day daily forecast"""
-    if not ml_models:
+def respond_hourly_forecast(device):
+    if not models_available():
         return jsonify({'error': 'ML models not loaded'}), 503
     
-    if not latest_sensor_data or len(sensor_data_history) < 3:
+    snapshot = device.snapshot if device is not None else None
+    if snapshot is None or not snapshot.latest or not snapshot.features.ready():
         return jsonify({'error': 'Insufficient data for forecasting'}), 404
     
-    forecast_days = []
-    current_values = latest_sensor_data.copy()
+    hours, error = parse_horizon('hours', 24, MAX_FORECAST_HOURS)
+    if error:
+        return error
     
-    # Generate daily predictions (24 hours per day, averaged)
-    for day in range(1, 8):
-        day_predictions_sum = {target: 0 for target in ml_models.keys()}
-        
-        # Predict 24 hours and average
-        for hour in range(24):
-            for target in ml_models.keys():
-                try:
-                    features = prepare_features_for_prediction(current_values, target, ml_features[target])
-                    if features is not None:
-                        features_scaled = ml_scalers[target].transform(features)
-                        pred_value = ml_models[target].predict(features_scaled)[0]
-                        day_predictions_sum[target] += pred_value
-                        current_values[target] = pred_value
-                    else:
-                        day_predictions_sum[target] += current_values.get(target, 0)
-                except:
-                    day_predictions_sum[target] += current_values.get(target, 0)
-        
-        # Average the 24 hourly predictions
-        day_avg = {target: round(day_predictions_sum[target] / 24, 2) for target in ml_models.keys()}
-        
-        timestamp = datetime.now() + timedelta(days=day)
-        forecast_days.append({
-            'day': day,
-            'date': timestamp.strftime('%Y-%m-%d'),
-            'values': day_avg
-        })
+    model = models.current
+    return versioned_json_response(device, snapshot, ('forecast_24h', hours, model_version(model)),
+                                   lambda: build_hourly_forecast(snapshot, model, hours))
+
+def respond_daily_forecast(device):
+    if not models_available():
+        return jsonify({'error': 'ML models not loaded'}), 503
+    
+    snapshot = device.snapshot if device is not None else None
+    if snapshot is None or not snapshot.latest or not snapshot.features.ready():
+        return jsonify({'error': 'Insufficient data for forecasting'}), 404
+    
+    days, error = parse_horizon('days', 7, MAX_FORECAST_HOURS // 24)
+    if error:
+        return error
     
-    return jsonify({'forecast': forecast_days})
+    model = models.current
+    return versioned_json_response(device, snapshot, ('forecast_week', days, model_version(model)),
+                                   lambda: build_daily_forecast(snapshot, model, days))
 
+@app.route('/api/forecast/24h', methods=['GET'])
+def forecast_24h():
+    """Generate hourly forecast (24 hours unless ?hours= is given)"""
+    return respond_hourly_forecast(registry.latest())
 
-def run_flask():
-    app.run(host='0.0.0.0', port=5000)
+@app.route('/api/forecast/week', methods=['GET'])
+def forecast_week():
+    """Generate daily forecast (7 days unless ?days= is given)"""
+    return respond_daily_forecast(registry.latest())
+
+# -----------------------------
+# History API
+# -----------------------------
+MAX_HISTORY_POINTS = int(os.getenv("MAX_HISTORY_POINTS", "2000"))
+HISTORY_AGGREGATES = ['mean', 'min', 'max', 'count']
+
+def parse_time(name):
+    """Reads an optional ISO 8601 or epoch-seconds query parameter. Returns (epoch, error_response)."""
+    raw = request.args.get(name)
+    if raw is None:
+        return None, None
+    try:
+        return float(raw), None
+    except ValueError:
+        pass
+    value = to_epoch(raw)
+    if np.isnan(value):
+        return None, (jsonify({'error': f"'{name}' must be an ISO 8601 timestamp or epoch seconds"}), 400)
+    return value, None
+
+def parse_history_query(device):
+    """Validates /api/history parameters. Returns (query, error_response)."""
+    start, error = parse_time('from')
+    if error:
+        return None, error
+    end, error = parse_time('to')
+    if error:
+        return None, error
+    if end is None:
+        end = np.inf
+    if start is None:
+        # Default to the last 24 hours of data for the device
+        raw_ts, _ = device.history.raw_arrays()
+        latest = np.nanmax(raw_ts) if np.isfinite(raw_ts).any() else 0.0
+        start = min(latest, end) - 24 * 3600
+    if start >= end:
+        return None, (jsonify({'error': "'from' must be before 'to'"}), 400)
+    
+    fields = request.args.get('fields')
+    fields = [f.strip() for f in fields.split(',') if f.strip()] if fields else list(SENSOR_FIELDS)
+    unknown = [f for f in fields if f not in HISTORY_FIELDS and f != 'aqi']
+    if unknown:
+        return None, (jsonify({'error': f"Unknown fields: {', '.join(unknown)}"}), 400)
+    
+    resolution = request.args.get('resolution', 'auto')
+    if resolution not in RESOLUTIONS and resolution != 'auto':
+        return None, (jsonify({'error': f"'resolution' must be one of: auto, {', '.join(RESOLUTIONS)}"}), 400)
+    agg = request.args.get('agg', 'mean')
+    if agg not in HISTORY_AGGREGATES:
+        return None, (jsonify({'error': f"'agg' must be one of: {', '.join(HISTORY_AGGREGATES)}"}), 400)
+    return (start, end, resolution, ','.join(fields), agg), None
+
+def json_column(values, digits=2):
+    """Rounded list for JSON, with None for missing values (ints when digits is 0)."""
+    cast = int if digits == 0 else float
+    return [None if v != v else cast(v) for v in np.round(values, digits).tolist()]
+
+def history_window(device, start, end, resolution):
+    """
+    The in-memory tiers when they reach back to `start`, otherwise the
+    storage backend if it can serve history reads (MongoDB).
+    """
+    history = device.history
+    if not history.covers(resolution, start):
+        try:
+            window = storage.query_history(device.device_id, start, end, resolution, history.fields)
+            if window is not None:
+                return window
+        except Exception as e:
+            logger.error(f"❌ Error reading history from storage: {e}")
+    return history.query(start, end, resolution)
+
+def resolve_resolution(device, start, end):
+    """Finest resolution within MAX_HISTORY_POINTS, from memory or, beyond it, from storage."""
+    history = device.history
+    resolution = history.resolve(start, end, MAX_HISTORY_POINTS)
+    if storage.serves_history and not history.covers(resolution, start):
+        raw_ts, _ = history.raw_arrays()
+        latest = np.nanmax(raw_ts) if np.isfinite(raw_ts).any() else start
+        span = min(end, latest) - start
+        for candidate in ('minute', 'hour'):
+            if span / MONGO_BUCKET_SECONDS[candidate] <= MAX_HISTORY_POINTS:
+                return candidate
+    return resolution
+
+def build_history(device, start, end, resolution, fields, agg):
+    history = device.history
+    if resolution == 'auto':
+        resolution = resolve_resolution(device, start, end)
+    window = history_window(device, start, end, resolution)
+    column = {name: i for i, name in enumerate(history.fields)}
+    selected = window[agg]
+    
+    values = {}
+    for field in fields.split(','):
+        if field == 'aqi':
+            # AQI of the aggregated concentrations (of the means when counting)
+            source = window['mean'] if agg == 'count' else selected
+            values['aqi'] = json_column(aqi_array({f: source[:, column[f]] for f in ('pm2_5', 'pm10')}), 0)
+        else:
+            values[field] = json_column(selected[:, column[field]], 0 if agg == 'count' else 2)
+    return {
+        'device_id': device.device_id,
+        'resolution': resolution,
+        'agg': agg,
+        'from': from_epoch(start) if np.isfinite(start) else None,
+        'to': from_epoch(end) if np.isfinite(end) else None,
+        'timestamps': [from_epoch(t) for t in window['timestamps']],
+        'values': values,
+    }
+
+def respond_history(device):
+    if device is None:
+        return jsonify({'error': 'No data available'}), 404
+    # Taken before the history is read, so the body is never older than its ETag
+    snapshot = device.snapshot
+    query, error = parse_history_query(device)
+    if error:
+        return error
+    return versioned_json_response(device, snapshot, ('history',) + query, lambda: build_history(device, *query))
+
+@app.route('/api/history', methods=['GET'])
+def get_history():
+    """Historical readings (?from=&to=&resolution=&fields=&agg=) served from in-memory rollups or storage"""
+    return respond_history(registry.latest())
 
 # -----------------------------
-# Excel Helper
+# Per-device API
 # -----------------------------
-def save_to_excel():
-    """Saves the in-memory list to an Excel file."""
+@app.route('/api/devices', methods=['GET'])
+def list_devices():
+    """Lists known devices, most recently seen last"""
+    return jsonify({
+        'devices': [device.summary() for device in registry.devices()],
+        'latest_device_id': registry.latest_device_id,
+    })
+
+@app.route('/api/devices/<device_id>/data', methods=['GET'])
+def get_device_data(device_id):
+    """Returns the latest sensor data for one device"""
+    device, error = lookup_device(device_id)
+    return error or respond_latest_data(device)
+
+@app.route('/api/devices/<device_id>/predict', methods=['GET'])
+def predict_device(device_id):
+    """Predict next values for one device"""
+    device, error = lookup_device(device_id)
+    return error or respond_prediction(device)
+
+@app.route('/api/devices/<device_id>/forecast/24h', methods=['GET'])
+def forecast_device_24h(device_id):
+    """Hourly forecast for one device"""
+    device, error = lookup_device(device_id)
+    return error or respond_hourly_forecast(device)
+
+@app.route('/api/devices/<device_id>/forecast/week', methods=['GET'])
+def forecast_device_week(device_id):
+    """Daily forecast for one device"""
+    device, error = lookup_device(device_id)
+    return error or respond_daily_forecast(device)
+
+@app.route('/api/devices/<device_id>/history', methods=['GET'])
+def history_device(device_id):
+    """Historical readings for one device"""
+    device, error = lookup_device(device_id)
+    return error or respond_history(device)
+
+
+@app.route('/api/export/excel', methods=['GET'])
+def export_excel():
+    """Exports the full stored history as an Excel workbook on demand"""
     try:
-        df = pd.DataFrame(sensor_data_history)
-        # Reorder columns if possible to make timestamp first, etc.
-        # For now, just dump whatever we have.
-        df.to_excel(EXCEL_FILE, index=False)
-        logger.info(f"💾 Data saved to {EXCEL_FILE}. Total records: {len(sensor_data_history)}")
+        buffer = BytesIO()
+        rows = storage.export_excel(buffer)
+        buffer.seek(0)
+        logger.info(f"📤 Exported {rows} records to Excel")
+        return send_file(
+            buffer,
+            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            as_attachment=True,
+            download_name=EXCEL_FILE,
+        )
     except Exception as e:
-        logger.error(f"❌ Failed to save Excel file: {e}")
+        logger.error(f"❌ Failed to export Excel file: {e}")
+        return jsonify({'error': 'Export failed'}), 500
+
+
+def run_flask():
+    app.run(host='0.0.0.0', port=int(os.getenv("API_PORT", "5000")))
+
+@app.route('/api/stats', methods=['GET'])
+def get_stats():
+    """Returns pipeline counters for monitoring"""
+    return jsonify({
+        'role': PIPELINE_ROLE,
+        'data_version': registry.data_version if PIPELINE_ROLE == "api" else data_version,
+        'devices': {'count': len(registry), 'evicted': registry.evicted},
+        # Summed over the devices currently held; an evicted device takes its counters along
+        'result_cache': merged_stats(device.cache for device in registry.devices()),
+        'storage': storage_writer.stats() if storage_writer is not None else None,
+        'shared_state': state_publisher.stats() if state_publisher is not None else None,
+        'live_updates': live_updates.stats(),
+        'model': dict(models.info(), online_learning=online_learner.stats() if online_learner is not None else None),
+    })
+
+@app.route('/api/models', methods=['GET'])
+def get_models():
+    """Returns the served model version and the registry's reload counters"""
+    return jsonify(models.info())
+
+@app.route('/api/models/reload', methods=['POST'])
+def reload_models():
+    """Loads MODELS_DIR now instead of waiting for the watcher (requires ADMIN_TOKEN)"""
+    if not ADMIN_TOKEN:
+        return jsonify({'error': 'Model reloads over the API are disabled (ADMIN_TOKEN is not set)'}), 403
+    supplied = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+    if not hmac.compare_digest(supplied.encode(), ADMIN_TOKEN.encode()):
+        return jsonify({'error': 'Invalid admin token'}), 401
+    
+    model = models.reload(force=True)
+    info = models.info()
+    if model is None and info['last_error']:
+        return jsonify(dict(info, error=info['last_error'])), 422
+    return jsonify(dict(info, reloaded=model is not None))
 
 # -----------------------------
 # MQTT Callbacks
@@ -366,36 +794,89 @@ def on_connect(client, userdata, flags, reason_code, properties=None):
         logger.error(f"❌ Failed to connect to MQTT broker, reason_code={reason_code}")
 
 def on_message(client, userdata, msg):
-    global latest_sensor_data
+    global data_version
     try:
-        raw_payload = msg.payload.decode("utf-8", errors="ignore")
-        logger.info(f"📩 Data received: {raw_payload[:100]}...")  # Log first 100 chars
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"📩 Data received: {msg.payload[:100]!r}...")
         
-        data = json.loads(raw_payload)
+        # Keeps only what the pipeline uses; the TTN envelope is not stored
+        data = parse_uplink(msg.payload)
         
-        # Flatten structure if needed or just store raw dict
-        # Adding timestamp if not present
-        if 'timestamp' not in data:
-            data['timestamp'] = datetime.now().isoformat()
+        with ingest_lock:
+            # Snapshots are immutable, so this is the feature state before this reading
+            previous = registry.get(data['device_id'])
+            previous_features = previous.snapshot.features if previous is not None else None
+            
+            # Route to the sending device so lags and caches never mix devices
+            device = registry.ingest(data['device_id'], data)
+            data_version += 1
             
-        # Also extracting specific fields for easier Excel reading if standard LoraWAN payload
-        # Usually 'uplink_message' -> 'decoded_payload'
-        # But we'll store the whole thing flattened or as is. 
-        # Flattening 'uplink_message.decoded_payload' into top level if it exists
-        if 'uplink_message' in data and 'decoded_payload' in data['uplink_message']:
-            data.update(data['uplink_message']['decoded_payload'])
-
-        sensor_data_history.append(data)
-        latest_sensor_data = data
+            # Hand off to the background writer; never blocks on storage
+            storage_writer.submit(data)
         
-        # Save to Excel immediately
-        save_to_excel()
+        if state_publisher is not None:
+            state_publisher.mark(device.device_id, data_version)
         
-    except json.JSONDecodeError:
-        logger.warning("⚠ Received non-JSON payload.")
+        if online_learner is not None and previous_features is not None:
+            online_learner.observe(previous_features, data)
+        
+        # One encode, fanned out to every /api/stream subscriber
+        live_updates.publish(latest_event(device.snapshot))
+        
+    except ValueError:
+        logger.warning("⚠ Received a payload that is not a JSON uplink.")
     except Exception as e:
         logger.error(f"❌ Error processing message: {e}")
 
+# -----------------------------
+# Checkpoints
+# -----------------------------
+def stored_rows():
+    """
+    Rows in storage once everything queued is written. Called under
+    ingest_lock, so nothing is submitted meanwhile; rows the backend failed
+    to write are not counted, so a restart replays from the right offset.
+    """
+    if not storage_writer.flush(CHECKPOINT_FLUSH_TIMEOUT):
+        raise TimeoutError("storage writer did not drain its queue")
+    return stored_rows_at_boot + storage_writer.stats()['written']
+
+def write_checkpoint(rows=None):
+    """Snapshots device state; `rows` defaults to the stored rows it corresponds to."""
+    try:
+        count, rows = save_checkpoint(CHECKPOINT_FILE, registry, stored_rows if rows is None else rows,
+                                      lock=ingest_lock, learner=online_learner)
+        logger.info(f"📸 Checkpointed {count} device(s) at {rows} stored records")
+    except Exception as e:
+        logger.error(f"❌ Failed to write checkpoint: {e}")
+
+def run_checkpoints():
+    while True:
+        time.sleep(CHECKPOINT_INTERVAL)
+        write_checkpoint()
+
+# -----------------------------
+# Online Learning
+# -----------------------------
+def refresh_online_model():
+    """Re-solves the online statistics and swaps the result in as the served model."""
+    if not online_learner.ready():
+        return None
+    try:
+        bundle = online_learner.solve()
+    except Exception as e:
+        logger.error(f"❌ Online model update failed: {e}")
+        return None
+    model = models.install(bundle, 'online')
+    if model is not None:
+        logger.info(f"🧠 Serving online model {model.version} ({online_learner.count} samples)")
+    return model
+
+def run_online_learning():
+    while True:
+        time.sleep(ONLINE_RESOLVE_INTERVAL)
+        refresh_online_model()
+
 # -----------------------------
 # Main System
 # -----------------------------
@@ -413,9 +894,30 @@ def start_mqtt():
         logger.error(f"❌ MQTT Connection failed: {e}")
 
 if __name__ == "__main__":
-    # Start Flask in a separate thread
-    flask_thread = threading.Thread(target=run_flask, daemon=True)
-    flask_thread.start()
+    if PIPELINE_ROLE == "api":
+        # Development only; serve with `gunicorn wsgi:app` in production
+        run_flask()
+        sys.exit(0)
     
+    if PIPELINE_ROLE == "all":
+        # Start Flask in a separate thread
+        flask_thread = threading.Thread(target=run_flask, daemon=True)
+        flask_thread.start()
+    
+    if CHECKPOINT_INTERVAL > 0:
+        threading.Thread(target=run_checkpoints, name="checkpoints", daemon=True).start()
+    
+    if models.allow_online and ONLINE_RESOLVE_INTERVAL > 0:
+        threading.Thread(target=run_online_learning, name="online-learning", daemon=True).start()
+    
+    # Turn SIGTERM into a normal exit so queued records are flushed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
     # Start MQTT in main thread
-    start_mqtt()
+    try:
+        start_mqtt()
+    finally:
+        # Checkpoint while the backend is still open (it waits for the queued
+        # records, so the stored row count is exact), then close it
+        write_checkpoint()
+        storage_writer.close()
@@ -0,0 +1,143 @@
+import threading
+import numpy as np
+from inference import CompiledLinearBundle
+
+ONLINE_FORMAT = 1
+
+
+class RunningMoments:
+    """
+    Count, mean and centered comoment matrix of a stream of row blocks.
+
+    Blocks are folded in with the pairwise update of Chan et al., so the
+    result matches a two-pass computation over all rows without holding
+    them, and without the cancellation of accumulating raw X'X.
+    """
+
+    def __init__(self, d):
+        self.count = 0
+        self.mean = np.zeros(d)
+        self.comoment = np.zeros((d, d))
+
+    @classmethod
+    def of(cls, block):
+        moments = cls(block.shape[1])
+        moments.count = len(block)
+        if len(block):
+            moments.mean = block.mean(axis=0)
+            centered = block - moments.mean
+            moments.comoment = centered.T @ centered
+        return moments
+
+    def update(self, block):
+        self.merge(RunningMoments.of(block))
+        return self
+
+    def merge(self, other):
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.count, self.mean, self.comoment = other.count, other.mean.copy(), other.comoment.copy()
+            return self
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.comoment = self.comoment + other.comoment + np.outer(delta, delta) * (self.count * other.count / count)
+        self.mean = self.mean + delta * (other.count / count)
+        self.count = count
+        return self
+
+    def copy(self):
+        return RunningMoments(len(self.mean)).merge(self)
+
+
+class OnlineLinearLearner:
+    """
+    Sufficient statistics for refitting every target from the live stream.
+
+    Each ingested reading, with its device's feature state from just before
+    it, is one training row exactly as train_model.py builds them. Its base
+    vector (features.FeatureState.training_row) holds every target's inputs
+    and every target itself, so one running mean plus one centered comoment
+    matrix of that vector (Welford's update, O(d²) per message) carries
+    X'X, X'y and the scaler's means and variances for all targets at once,
+    in constant memory. `solve` turns them into a CompiledLinearBundle the
+    same way train_model.fit_targets turns its Gram matrix into models.
+    """
+
+    def __init__(self, targets, features, base_names, min_samples=1000):
+        self.targets = list(targets)
+        self.features = {target: list(features[target]) for target in self.targets}
+        self.base_names = list(base_names)
+        self.min_samples = min_samples
+        d = len(self.base_names)
+        self.count = 0
+        self.mean = np.zeros(d)
+        self.comoment = np.zeros((d, d))
+        self.solved_at = 0
+        self._lock = threading.Lock()
+
+    def observe(self, features, record):
+        """Adds one reading given the feature state before it; False if it was skipped."""
+        x = features.training_row(record)
+        if x is None:
+            return False
+        with self._lock:
+            self.count += 1
+            delta = x - self.mean
+            self.mean += delta / self.count
+            self.comoment += np.outer(delta, x - self.mean)
+        return True
+
+    def ready(self):
+        return self.count >= self.min_samples and self.count > self.solved_at
+
+    def solve(self):
+        """
+        Least-squares weights for every target from the statistics so far,
+        as a CompiledLinearBundle over the base vector. Inputs are
+        standardized with the running variances before solving, as the
+        offline StandardScaler does, and the minimum-norm solution is used
+        when inputs are collinear.
+        """
+        with self._lock:
+            count, mean, comoment = self.count, self.mean.copy(), self.comoment.copy()
+        if count < 2:
+            raise ValueError("not enough samples to solve")
+        var = np.diag(comoment) / count
+        scale = np.where(var > 10 * np.finfo(float).eps, np.sqrt(var), 1.0)
+        gram = comoment / np.outer(scale, scale)
+
+        lookup = {name: i for i, name in enumerate(self.base_names)}
+        weights = np.zeros((len(self.base_names) + 1, len(self.targets)))
+        bias = np.zeros(len(self.targets))
+        for j, target in enumerate(self.targets):
+            idx = [lookup[name] for name in self.features[target]]
+            t = lookup[target]
+            coef = np.linalg.lstsq(gram[np.ix_(idx, idx)], gram[idx, t] * scale[t], rcond=None)[0]
+            folded = coef / scale[idx]
+            weights[idx, j] = folded
+            bias[j] = mean[t] - float(np.dot(folded, mean[idx]))
+        if not (np.isfinite(weights).all() and np.isfinite(bias).all()):
+            raise ValueError("solution is not finite")
+        self.solved_at = count
+        return CompiledLinearBundle(self.targets, weights, bias, self.base_names)
+
+    def stats(self):
+        return {'samples': self.count, 'solved_at': self.solved_at, 'min_samples': self.min_samples}
+
+    def state(self):
+        """(meta, arrays) for a checkpoint."""
+        with self._lock:
+            arrays = {'mean': self.mean.copy(), 'comoment': self.comoment.copy()}
+            meta = {'format': ONLINE_FORMAT, 'count': self.count, 'base_names': self.base_names}
+        return meta, arrays
+
+    def load_state(self, meta, arrays):
+        """Restores statistics from `state()`; False if they were built on another layout."""
+        if meta.get('format') != ONLINE_FORMAT or meta.get('base_names') != self.base_names:
+            return False
+        with self._lock:
+            self.count = int(meta['count'])
+            self.mean = np.asarray(arrays['mean'], dtype=float).copy()
+            self.comoment = np.asarray(arrays['comoment'], dtype=float).copy()
+        return True
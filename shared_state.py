@@ -0,0 +1,227 @@
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+import numpy as np
+from checkpoint import apply_device, capture_device, decode_meta, encode_meta
+from devices import DeviceState
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = 'index.json'
+DEVICES_DIR = 'devices'
+
+
+def default_state_dir():
+    """Shared-memory backed directory when available (tmpfs), else the temp dir."""
+    base = '/dev/shm' if os.path.isdir('/dev/shm') else os.getenv('TMPDIR', '/tmp')
+    return os.path.join(base, 'air-quality-state')
+
+
+def _device_file(device_id):
+    """File name for a device; IDs are never trusted as path components."""
+    safe = re.sub(r'[^A-Za-z0-9_.-]', '_', device_id)[:64]
+    digest = hashlib.sha1(device_id.encode('utf-8')).hexdigest()[:10]
+    return f"{safe}-{digest}.npz"
+
+
+def _write_atomic(path, write):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as fh:
+        write(fh)
+    os.replace(tmp_path, path)
+
+
+class StatePublisher:
+    """
+    Publishes device state from the ingest process to API worker processes.
+
+    `mark` is called from on_message and only records which devices changed;
+    a background thread snapshots those devices (under the ingest lock) and
+    writes one file per device plus a small JSON index into `directory`,
+    each via an atomic rename. Bursts for the same device are coalesced into
+    a single write.
+    """
+
+    def __init__(self, directory, registry, lock, interval=0.05):
+        self.directory = directory
+        self.registry = registry
+        self.lock = lock
+        self.interval = interval
+        self.data_version = 0
+        self._dirty = set()
+        self._published = {}
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stats = {'publishes': 0, 'device_writes': 0, 'failed': 0}
+        os.makedirs(os.path.join(directory, DEVICES_DIR), exist_ok=True)
+
+    def start(self):
+        if self._thread is None:
+            # Everything restored at startup is published once
+            self._dirty.update(device.device_id for device in self.registry.devices())
+            self._thread = threading.Thread(target=self._run, name="state-publisher", daemon=True)
+            self._thread.start()
+        return self
+
+    def mark(self, device_id, data_version):
+        with self._cond:
+            self._dirty.add(device_id)
+            self.data_version = data_version
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._dirty:
+                    self._cond.wait()
+                dirty, self._dirty = self._dirty, set()
+            try:
+                self.publish(dirty)
+            except Exception as e:
+                self._stats['failed'] += 1
+                logger.error(f"❌ Failed to publish shared state: {e}")
+            # Lets a burst of uplinks collapse into one write per device
+            time.sleep(self.interval)
+
+    def publish(self, device_ids):
+        with self.lock:
+            captured = [capture_device(d) for d in map(self.registry.get, device_ids) if d is not None]
+            order = [device.device_id for device in self.registry.devices()]
+            index = {
+                'boot_id': self.registry.boot_id,
+                'data_version': self.data_version,
+                'latest_device_id': self.registry.latest_device_id,
+                'evicted': self.registry.evicted,
+            }
+
+        devices_dir = os.path.join(self.directory, DEVICES_DIR)
+        for entry, arrays in captured:
+            name = _device_file(entry['device_id'])
+            _write_atomic(os.path.join(devices_dir, name), lambda fh: np.savez(fh, meta=encode_meta(entry), **arrays))
+            self._published[entry['device_id']] = {'file': name, 'generation': entry['generation'], 'version': entry['version']}
+            self._stats['device_writes'] += 1
+
+        # Devices evicted from the registry disappear from the index and disk
+        known = set(order)
+        for device_id in [d for d in self._published if d not in known]:
+            info = self._published.pop(device_id)
+            try:
+                os.remove(os.path.join(devices_dir, info['file']))
+            except OSError:
+                pass
+        index['devices'] = {d: self._published[d] for d in order if d in self._published}
+        _write_atomic(os.path.join(self.directory, INDEX_FILE), lambda fh: fh.write(json.dumps(index).encode('utf-8')))
+        self._stats['publishes'] += 1
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats['pending'] = len(self._dirty)
+        return stats
+
+
+class SharedRegistry:
+    """
+    Read-only DeviceRegistry stand-in for API worker processes.
+
+    The index is re-read whenever its file changes (one stat per lookup);
+    a device's snapshot file is loaded only when its published generation or
+    version differs from the copy this worker holds, so steady-state requests
+    touch no files beyond that stat.
+    """
+
+    def __init__(self, directory, history_config=None, cache_entries=16):
+        self.directory = directory
+        self.history_config = dict(history_config or {})
+        self.cache_entries = cache_entries
+        self.boot_id = None
+        self.data_version = 0
+        self.latest_device_id = None
+        self.evicted = 0
+        self._index = {}
+        self._index_stamp = None
+        self._devices = {}
+        self._lock = threading.Lock()
+
+    def _refresh_index(self):
+        path = os.path.join(self.directory, INDEX_FILE)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if stamp == self._index_stamp:
+            return
+        with self._lock:
+            if stamp == self._index_stamp:
+                return
+            try:
+                with open(path, 'rb') as fh:
+                    index = json.loads(fh.read())
+            except (OSError, ValueError):
+                return
+            if index['boot_id'] != self.boot_id:
+                # The ingest process restarted: versions start over
+                self._devices = {}
+            else:
+                self._devices = {d: s for d, s in self._devices.items() if d in index['devices']}
+            self.boot_id = index['boot_id']
+            self.data_version = index['data_version']
+            self.latest_device_id = index['latest_device_id']
+            self.evicted = index['evicted']
+            self._index = index['devices']
+            self._index_stamp = stamp
+
+    def _load(self, device_id, info):
+        path = os.path.join(self.directory, DEVICES_DIR, info['file'])
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                entry = decode_meta(data['meta'])
+                arrays = {key: data[key] for key in data.files if key != 'meta'}
+        except Exception as e:
+            logger.warning(f"⚠ Could not load shared state for {device_id}: {e}")
+            return None
+        previous = self._devices.get(device_id)
+        state = DeviceState(device_id, self.history_config, self.cache_entries, entry['generation'])
+        if previous is not None and previous.generation == state.generation:
+            # Keep the response cache; it is keyed by version anyway
+            state.cache = previous.cache
+        apply_device(state, entry, arrays)
+        state.publish(version=entry['version'])
+        return state
+
+    def get(self, device_id):
+        self._refresh_index()
+        info = self._index.get(device_id)
+        if info is None:
+            return None
+        state = self._devices.get(device_id)
+        if state is None or (state.generation, state.version) != (info['generation'], info['version']):
+            loaded = self._load(device_id, info)
+            if loaded is not None:
+                with self._lock:
+                    self._devices[device_id] = state = loaded
+        return state
+
+    def latest(self):
+        self._refresh_index()
+        if self.latest_device_id is None:
+            return None
+        return self.get(self.latest_device_id)
+
+    def devices(self):
+        self._refresh_index()
+        return [device for device in map(self.get, list(self._index)) if device is not None]
+
+    def __len__(self):
+        self._refresh_index()
+        return len(self._index)
+
+    def changed(self, since):
+        """(versions, changed device IDs) relative to a previous {device_id: version} map."""
+        self._refresh_index()
+        versions = {device_id: info['version'] for device_id, info in self._index.items()}
+        return versions, [d for d, v in versions.items() if since.get(d) != v]
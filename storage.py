@@ -0,0 +1,628 @@
+import os
+import re
+import json
+import time
+import queue
+import logging
+import threading
+import numpy as np
+import pandas as pd
+from datetime import timedelta
+from devices import device_id_of
+from history import EPOCH, to_epoch
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_PREFIX = "segment-"
+SEGMENT_PATTERN = re.compile(r"^segment-(\d{6})\.(jsonl|parquet)$")
+
+
+def _flatten_row(row):
+    """Make a record safe for columnar storage (nested values become JSON strings)."""
+    flat = {}
+    for k, v in row.items():
+        if isinstance(v, (dict, list)):
+            flat[k] = json.dumps(v, default=str)
+        elif hasattr(v, 'isoformat'):
+            flat[k] = v.isoformat()
+        else:
+            flat[k] = v
+    return flat
+
+
+# -----------------------------
+# Backend interface
+# -----------------------------
+class PartialWriteError(Exception):
+    """A batch append that stored only `written` of its rows before failing."""
+
+    def __init__(self, written, cause):
+        super().__init__(f"stored {written} record(s) before failing: {cause}")
+        self.written = written
+
+
+class StorageBackend:
+    """Persists sensor records. Subclasses only ever write the rows they are given."""
+
+    # Whether query_history can answer history reads
+    serves_history = False
+
+    def append(self, rows):
+        raise NotImplementedError
+
+    def read_all(self):
+        """Returns every stored record as a DataFrame (oldest first)."""
+        raise NotImplementedError
+
+    def count(self):
+        """Number of stored records."""
+        return len(self.read_all())
+
+    def read_since(self, offset):
+        """Returns the records stored after the first `offset` ones."""
+        return self.read_all().iloc[offset:].reset_index(drop=True)
+
+    def query_history(self, device_id, start, end, resolution, fields):
+        """
+        One device's history in [start, end) (epoch seconds) in the format of
+        history.TieredHistory.query, for backends that can answer it without
+        a full scan; None if this backend cannot.
+        """
+        return None
+
+    def export_excel(self, target):
+        """Writes all stored records to an Excel file path or file-like object."""
+        df = self.read_all()
+        df.to_excel(target, index=False)
+        return len(df)
+
+    def close(self):
+        pass
+
+
+# -----------------------------
+# Legacy Excel backend
+# -----------------------------
+class ExcelStorage(StorageBackend):
+    """Original behaviour: rewrites the whole workbook on every append."""
+
+    def __init__(self, path):
+        self.path = path
+        self._rows = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._rows is None:
+            if os.path.exists(self.path):
+                self._rows = pd.read_excel(self.path).to_dict('records')
+            else:
+                self._rows = []
+        return self._rows
+
+    def append(self, rows):
+        with self._lock:
+            self._load().extend(rows)
+            pd.DataFrame(self._rows).to_excel(self.path, index=False)
+            logger.info(f"💾 Data saved to {self.path}. Total records: {len(self._rows)}")
+
+    def read_all(self):
+        with self._lock:
+            return pd.DataFrame(list(self._load()))
+
+
+# -----------------------------
+# Append-only segment backend
+# -----------------------------
+class SegmentStorage(StorageBackend):
+    """
+    Append-only store made of numbered segments in a directory.
+
+    New rows are appended as JSON lines to the open segment, so each write
+    costs O(rows written). Once a segment holds `segment_rows` records it is
+    sealed into a Parquet file and a new segment is opened.
+
+    With `read_only` the directory is only read (e.g. by API workers while
+    the ingest process writes it): no segment is opened or created, and
+    `append` raises.
+    """
+
+    def __init__(self, directory, segment_rows=5000, fsync=False, read_only=False):
+        self.directory = directory
+        self.segment_rows = segment_rows
+        self.fsync = fsync
+        self.read_only = read_only
+        self._lock = threading.Lock()
+        self._fh = None
+        if read_only:
+            return
+        os.makedirs(directory, exist_ok=True)
+
+        self._index, self._open_rows = self._recover()
+        self._fh = open(self._open_path(), 'a', encoding='utf-8')
+
+    def _segments(self):
+        """Returns sorted (index, path) pairs for every segment on disk."""
+        found = []
+        if not os.path.isdir(self.directory):
+            return found
+        for name in os.listdir(self.directory):
+            match = SEGMENT_PATTERN.match(name)
+            if match:
+                found.append((int(match.group(1)), os.path.join(self.directory, name)))
+        return sorted(found)
+
+    def _recover(self):
+        """Finds the segment to continue appending to after a restart."""
+        segments = self._segments()
+        if not segments:
+            return 1, 0
+        last_index, last_path = segments[-1]
+        if last_path.endswith('.parquet'):
+            return last_index + 1, 0
+        with open(last_path, 'r', encoding='utf-8') as fh:
+            return last_index, sum(1 for line in fh if line.strip())
+
+    def _open_path(self):
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{self._index:06d}.jsonl")
+
+    def append(self, rows):
+        if self.read_only:
+            raise PermissionError(f"{self.directory} is opened read-only")
+        if not rows:
+            return
+        with self._lock:
+            for row in rows:
+                self._fh.write(json.dumps(_flatten_row(row), default=str) + "\n")
+                self._open_rows += 1
+                if self._open_rows >= self.segment_rows:
+                    self._roll()
+            self._fh.flush()
+            if self.fsync:
+                os.fsync(self._fh.fileno())
+
+    def _roll(self):
+        """Seals the open segment and starts the next one."""
+        self._fh.close()
+        self._seal(self._open_path())
+        self._index += 1
+        self._open_rows = 0
+        self._fh = open(self._open_path(), 'a', encoding='utf-8')
+
+    def _seal(self, jsonl_path):
+        parquet_path = jsonl_path[:-len('.jsonl')] + '.parquet'
+        tmp_path = parquet_path + '.tmp'
+        try:
+            df = pd.DataFrame(self._read_jsonl(jsonl_path))
+            df.to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, parquet_path)
+            os.remove(jsonl_path)
+            logger.info(f"📦 Sealed {len(df)} records into {parquet_path}")
+        except Exception as e:
+            # Keep the JSON lines segment; it is still readable as-is
+            logger.warning(f"⚠ Could not seal {jsonl_path} to Parquet: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    @staticmethod
+    def _read_jsonl(path):
+        rows = []
+        with open(path, 'r', encoding='utf-8') as fh:
+            for line in fh:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    rows.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # A torn final line from a crash; everything before it is intact
+                    logger.warning(f"⚠ Skipping corrupt line in {path}")
+        return rows
+
+    @staticmethod
+    def _current(path):
+        """`path`, or its Parquet copy if another process sealed it after it was listed."""
+        if path.endswith('.jsonl') and not os.path.exists(path):
+            return path[:-len('.jsonl')] + '.parquet'
+        return path
+
+    def _flush_open(self):
+        if self._fh is not None and not self._fh.closed:
+            self._fh.flush()
+
+    def _read_segment(self, path):
+        path = self._current(path)
+        if path.endswith('.parquet'):
+            return pd.read_parquet(path)
+        rows = self._read_jsonl(path)
+        return pd.DataFrame(rows) if rows else None
+
+    def _segment_rows(self, path):
+        """Row count of one segment (read from the Parquet footer when sealed)."""
+        path = self._current(path)
+        if path.endswith('.parquet'):
+            import pyarrow.parquet as pq
+            return pq.ParquetFile(path).metadata.num_rows
+        # Only the open segment is JSON lines; parse it so torn lines are not counted
+        return len(self._read_jsonl(path))
+
+    def read_all(self):
+        return self.read_since(0)
+
+    def count(self):
+        with self._lock:
+            self._flush_open()
+            return sum(self._segment_rows(path) for _, path in self._segments())
+
+    def read_since(self, offset):
+        """Reads only the segments that hold records past `offset`."""
+        with self._lock:
+            self._flush_open()
+            frames = []
+            for _, path in self._segments():
+                if offset > 0:
+                    rows = self._segment_rows(path)
+                    if rows <= offset:
+                        offset -= rows
+                        continue
+                frame = self._read_segment(path)
+                if frame is None:
+                    continue
+                if offset > 0:
+                    frame = frame.iloc[offset:]
+                    offset = 0
+                frames.append(frame)
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames, ignore_index=True)
+
+    def close(self):
+        with self._lock:
+            if self._fh is not None and not self._fh.closed:
+                self._fh.close()
+
+
+# -----------------------------
+# MongoDB backend
+# -----------------------------
+# Bucket widths for history aggregated on the server ('raw' is not bucketed)
+MONGO_BUCKET_SECONDS = {'minute': 60, 'hour': 3600, 'day': 86400}
+
+
+def _mongo_value(v):
+    """BSON-safe value, or None for a missing one (NaN, NaT, None)."""
+    if isinstance(v, np.generic):
+        v = v.item()
+    if v is None or (isinstance(v, float) and v != v) or v is pd.NaT:
+        return None
+    return v
+
+
+def _number(v):
+    """Float for an aggregate, NaN where there was nothing to aggregate."""
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class MongoStorage(StorageBackend):
+    """
+    Records in a MongoDB time-series collection.
+
+    Each batch from the WriteBehindWriter is one `insert_many` over the
+    client's connection pool. `timestamp` is stored as a UTC date (the
+    collection's time field) and `device_id` as its meta field, indexed
+    together so history reads for one device and time range are index
+    scans that the server aggregates into buckets. Every record also gets
+    a `seq` number, so `count` / `read_since` keep the insertion order the
+    checkpoint offsets rely on. A batch's seq numbers are never reused,
+    even if only part of it was inserted; gaps are harmless, as reads skip
+    by position.
+
+    `client` may be any pymongo-compatible client (e.g. mongomock's); when
+    the server cannot create time-series collections a regular collection
+    with the same indexes is used. With `read_only` (API workers) the
+    collection is only queried: it is neither created nor indexed, and
+    `append` raises.
+    """
+
+    serves_history = True
+
+    def __init__(self, uri=None, database='air_quality', collection='sensor_data', client=None,
+                 time_series=True, read_only=False, **client_options):
+        self._owns_client = client is None
+        if client is None:
+            from pymongo import MongoClient
+            client = MongoClient(uri, **client_options)
+        self.client = client
+        self.read_only = read_only
+        self._lock = threading.Lock()
+        self._next_seq = None
+        if read_only:
+            self.collection = client[database][collection]
+            return
+        self.collection = self._open(client[database], collection, time_series)
+        last = self.collection.find_one({}, projection={'seq': 1}, sort=[('seq', -1)])
+        self._next_seq = int(last['seq']) + 1 if last else 0
+
+    @staticmethod
+    def _open(db, name, time_series):
+        if name not in db.list_collection_names():
+            options = {'timeField': 'timestamp', 'metaField': 'device_id', 'granularity': 'seconds'}
+            if time_series:
+                try:
+                    db.create_collection(name, timeseries=options)
+                except Exception as e:
+                    logger.warning(f"⚠ Using a regular collection for {name} ({e})")
+            if name not in db.list_collection_names():
+                db.create_collection(name)
+        collection = db[name]
+        collection.create_index([('device_id', 1), ('timestamp', 1)])
+        collection.create_index([('seq', 1)])
+        return collection
+
+    def _document(self, row, seq):
+        doc = {}
+        for k, v in row.items():
+            v = _mongo_value(v)
+            if v is not None:
+                doc[k] = v
+        ts = to_epoch(row.get('timestamp'))
+        # Naive UTC, like every other stored date; records without a time get the arrival time
+        doc['timestamp'] = EPOCH + timedelta(seconds=ts if np.isfinite(ts) else time.time())
+        doc['device_id'] = device_id_of(row)
+        doc['seq'] = seq
+        return doc
+
+    def append(self, rows):
+        if self.read_only:
+            raise PermissionError(f"{self.collection.full_name} is opened read-only")
+        if not rows:
+            return
+        with self._lock:
+            first = self._next_seq
+            docs = [self._document(row, first + i) for i, row in enumerate(rows)]
+            self._next_seq += len(docs)
+            try:
+                self.collection.insert_many(docs, ordered=False)
+            except Exception as e:
+                written = self._stored(first, self._next_seq)
+                if written:
+                    raise PartialWriteError(written, e) from e
+                raise
+
+    def _stored(self, first, end):
+        """How many records with seq in [first, end) were inserted (0 if that cannot be read either)."""
+        try:
+            return self.collection.count_documents({'seq': {'$gte': first, '$lt': end}})
+        except Exception:
+            return 0
+
+    def _frame(self, cursor):
+        df = pd.DataFrame(list(cursor))
+        return df.drop(columns=[c for c in ('_id', 'seq') if c in df.columns])
+
+    def read_all(self):
+        return self.read_since(0)
+
+    def count(self):
+        return self.collection.count_documents({})
+
+    def read_since(self, offset):
+        return self._frame(self.collection.find({}).sort('seq', 1).skip(int(offset)))
+
+    def query_history(self, device_id, start, end, resolution, fields):
+        if resolution != 'raw':
+            # Whole buckets starting in [start, end), as the in-memory rollups return them
+            # (days are summed from the hours in range)
+            aligned = MONGO_BUCKET_SECONDS['hour' if resolution == 'day' else resolution]
+            start, end = np.ceil(start / aligned) * aligned, np.ceil(end / aligned) * aligned
+        match = {'device_id': device_id}
+        window = {}
+        if np.isfinite(start):
+            window['$gte'] = EPOCH + timedelta(seconds=float(start))
+        if np.isfinite(end):
+            window['$lt'] = EPOCH + timedelta(seconds=float(end))
+        if window:
+            match['timestamp'] = window
+
+        if resolution == 'raw':
+            projection = dict({'_id': 0, 'timestamp': 1}, **{f: 1 for f in fields})
+            docs = list(self.collection.find(match, projection=projection).sort('timestamp', 1))
+            ts = np.array([to_epoch(d['timestamp']) for d in docs], dtype=float)
+            data = np.array([[_number(d.get(f)) for f in fields] for d in docs], dtype=float).reshape(len(docs), len(fields))
+            count = (~np.isnan(data)).astype(float)
+            return {'timestamps': ts, 'count': count, 'mean': data, 'min': data, 'max': data}
+
+        # Bucket start = timestamp - (milliseconds since the epoch mod the bucket width)
+        width = MONGO_BUCKET_SECONDS[resolution] * 1000
+        bucket = {'$subtract': ['$timestamp', {'$mod': [{'$subtract': ['$timestamp', EPOCH]}, width]}]}
+        group = {'_id': bucket}
+        for i, f in enumerate(fields):
+            group[f'n{i}'] = {'$sum': {'$cond': [{'$isNumber': f'${f}'}, 1, 0]}}
+            group[f'mean{i}'] = {'$avg': f'${f}'}
+            group[f'min{i}'] = {'$min': f'${f}'}
+            group[f'max{i}'] = {'$max': f'${f}'}
+        rows = list(self.collection.aggregate([{'$match': match}, {'$group': group}, {'$sort': {'_id': 1}}]))
+        window = {'timestamps': np.array([to_epoch(r['_id']) for r in rows], dtype=float)}
+        for name, key in (('count', 'n'), ('mean', 'mean'), ('min', 'min'), ('max', 'max')):
+            window[name] = np.array([[_number(r.get(f'{key}{i}')) for i in range(len(fields))] for r in rows],
+                                    dtype=float).reshape(len(rows), len(fields))
+        return window
+
+    def close(self):
+        # An injected client belongs to the caller
+        if self._owns_client:
+            self.client.close()
+
+
+# -----------------------------
+# Write-behind persistence
+# -----------------------------
+class WriteBehindWriter:
+    """
+    Feeds a storage backend from a dedicated thread.
+
+    `submit` never touches the disk: rows go into a bounded queue and the
+    writer thread appends them in batches once `batch_rows` rows are pending
+    or `flush_interval` seconds have passed. When the queue is full, `submit`
+    waits up to `block_timeout` seconds (backpressure) and then drops the row.
+    `flush` waits until everything submitted so far has been appended (or has
+    failed), so `stats()['written']` then counts exactly the stored rows.
+    """
+
+    _STOP = object()
+
+    def __init__(self, backend, max_queue=10000, batch_rows=500, flush_interval=2.0, block_timeout=0.0):
+        self.backend = backend
+        self.batch_rows = batch_rows
+        self.flush_interval = flush_interval
+        self.block_timeout = block_timeout
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._closed = False
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'submitted': 0,
+            'written': 0,
+            'dropped': 0,
+            'failed': 0,
+            'backpressure_waits': 0,
+            'flushes': 0,
+            'last_flush_rows': 0,
+            'last_flush_seconds': 0.0,
+        }
+
+    def _count(self, key, amount=1):
+        with self._stats_lock:
+            self._stats[key] += amount
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="storage-writer", daemon=True)
+            self._thread.start()
+        return self
+
+    def submit(self, row):
+        """Queues a row for persistence. Returns False if it had to be dropped."""
+        if self._closed:
+            self._count('dropped')
+            return False
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            if self.block_timeout <= 0:
+                self._count('dropped')
+                return False
+            self._count('backpressure_waits')
+            try:
+                self._queue.put(row, timeout=self.block_timeout)
+            except queue.Full:
+                self._count('dropped')
+                logger.warning("⚠ Storage queue full, dropping record")
+                return False
+        self._count('submitted')
+        return True
+
+    def _run(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            timeout = max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            stopping = item is self._STOP
+            waiters = [item] if isinstance(item, threading.Event) else []
+            if item is not None and not stopping and not waiters:
+                batch.append(item)
+
+            if stopping or waiters or len(batch) >= self.batch_rows or time.monotonic() >= deadline:
+                if stopping:
+                    # Drain whatever was queued before close()
+                    while True:
+                        try:
+                            extra = self._queue.get_nowait()
+                        except queue.Empty:
+                            break
+                        if isinstance(extra, threading.Event):
+                            waiters.append(extra)
+                        elif extra is not self._STOP:
+                            batch.append(extra)
+                self._flush(batch)
+                for waiter in waiters:
+                    waiter.set()
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+            if stopping:
+                return
+
+    def _flush(self, batch):
+        if not batch:
+            return
+        started = time.monotonic()
+        try:
+            self.backend.append(batch)
+            self._count('written', len(batch))
+        except PartialWriteError as e:
+            self._count('written', e.written)
+            self._count('failed', len(batch) - e.written)
+            logger.error(f"❌ Failed to persist {len(batch) - e.written} of {len(batch)} records: {e}")
+        except Exception as e:
+            self._count('failed', len(batch))
+            logger.error(f"❌ Failed to persist {len(batch)} records: {e}")
+        with self._stats_lock:
+            self._stats['flushes'] += 1
+            self._stats['last_flush_rows'] = len(batch)
+            self._stats['last_flush_seconds'] = round(time.monotonic() - started, 6)
+
+    def flush(self, timeout=30.0):
+        """Returns once every row submitted before the call is written or failed; False on timeout."""
+        if self._closed or self._thread is None:
+            return self._queue.empty()
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['queue_depth'] = self._queue.qsize()
+        stats['queue_capacity'] = self._queue.maxsize
+        return stats
+
+    def close(self, timeout=30.0):
+        """Flushes everything still queued and closes the backend."""
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread is not None:
+            try:
+                self._queue.put(self._STOP, timeout=timeout)
+                self._thread.join(timeout)
+            except queue.Full:
+                logger.error("❌ Storage writer did not drain its queue before shutdown")
+        self.backend.close()
+        logger.info(f"💾 Storage writer stopped ({self._stats['written']} records written)")
+
+
+def create_storage(kind, directory, excel_file, mongo=None, read_only=False):
+    """
+    Builds the storage backend selected by STORAGE_BACKEND (`mongo` holds
+    MongoStorage options). With `read_only`, segment and MongoDB storage
+    are only read: nothing is created, opened for writing or indexed. The
+    Excel backend writes nothing until it is appended to.
+    """
+    kind = (kind or 'segments').lower()
+    if kind == 'excel':
+        return ExcelStorage(excel_file)
+    if kind == 'segments':
+        return SegmentStorage(directory, read_only=read_only)
+    if kind == 'mongo':
+        return MongoStorage(read_only=read_only, **(mongo or {}))
+    raise ValueError(f"Unknown storage backend: {kind}")
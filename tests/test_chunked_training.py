@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('sklearn')
+pytest.importorskip('matplotlib')
+pytest.importorskip('pyarrow')
+
+import train_linear_regression as trainer  # noqa: E402
+
+
+@pytest.fixture
+def sources(tmp_path):
+    """Two sensors' Parquet files with interleaved times and some gaps."""
+    rng = np.random.default_rng(7)
+    paths = []
+    for sensor, n in enumerate((260, 240)):
+        times = pd.Timestamp('2024-03-11') + pd.to_timedelta(np.arange(n) * 120 + sensor * 60 + 30, unit='s')
+        base = rng.normal(size=(n, 3)).cumsum(axis=0)
+        df = pd.DataFrame({
+            trainer.TIME_COLUMN: times,
+            'pm2_5': 20 + base[:, 0] + rng.normal(0, 0.5, n),
+            'pm10': 35 + 1.5 * base[:, 0] + base[:, 1],
+            'co2': 600 + 10 * base[:, 2],
+            'temperature': 22 + 0.1 * base[:, 1] + rng.normal(0, 0.1, n),
+            'humidity': 45 - 0.3 * base[:, 2] + rng.normal(0, 0.2, n),
+            'battery': rng.integers(80, 100, n).astype(float),
+        })
+        for col in ('pm2_5', 'co2', 'humidity'):
+            df.loc[rng.choice(n, 12, replace=False), col] = np.nan
+        path = tmp_path / f'sensor{sensor + 1}.parquet'
+        df.to_parquet(path, row_group_size=50)
+        paths.append(str(path))
+    return paths
+
+
+def test_chunked_training_matches_in_memory(sources):
+    in_memory = trainer.train_in_memory(sources, cv_folds=4)
+    chunked = trainer.train_chunked(sources, chunk_rows=37, cv_folds=4)
+    assert set(chunked) == set(in_memory) and len(in_memory) >= 5
+
+    for target, (model, scaler, results) in in_memory.items():
+        chunked_model, chunked_scaler, chunked_results = chunked[target]
+        assert list(chunked_scaler.feature_names_in_) == list(scaler.feature_names_in_)
+        assert np.allclose(chunked_model.coef_, model.coef_)
+        assert np.allclose(chunked_model.intercept_, model.intercept_)
+        assert np.allclose(chunked_scaler.mean_, scaler.mean_)
+        assert np.allclose(chunked_scaler.scale_, scaler.scale_)
+        assert np.allclose(chunked_results['walk_forward']['rmse'], results['walk_forward']['rmse'])
+        for metric in ('cv_rmse_mean', 'cv_rmse_std', 'train_rmse', 'test_rmse', 'train_mae', 'test_mae',
+                       'train_r2', 'test_r2'):
+            assert np.allclose(chunked_results[metric], results[metric]), metric
@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+
+from history import HISTORY_FIELDS, TieredHistory, from_epoch
+
+START = 1714564800.0  # 2024-05-01T12:00:00
+
+
+def record(seconds, temperature):
+    return {'timestamp': from_epoch(START + seconds), 'temperature': temperature}
+
+
+def test_raw_tier_drops_late_and_untimed_readings():
+    history = TieredHistory()
+    for seconds, value in [(0, 1.0), (60, 2.0), (30, 9.0), (120, 3.0)]:
+        history.append(record(seconds, value))
+    history.append({'temperature': 9.0})
+
+    window = history.query(START, START + 3600, 'raw')
+    np.testing.assert_allclose(window['timestamps'], START + np.array([0, 60, 120]))
+    np.testing.assert_allclose(window['mean'][:, HISTORY_FIELDS.index('temperature')], [1.0, 2.0, 3.0])
+    assert history.raw.late == 2 and history.total == 5
+
+    # The range search still finds every reading after the rejected ones
+    assert len(history.query(START + 60, START + 121, 'raw')['timestamps']) == 2
+
+
+def test_rollups_aggregate_in_float32_and_report_float64():
+    history = TieredHistory()
+    for i in range(180):
+        history.append(record(i * 20, 20.0 + (i % 3)))
+
+    window = history.query(START, START + 3600, 'minute')
+    temperature = HISTORY_FIELDS.index('temperature')
+    assert window['mean'].dtype == np.float64
+    assert len(window['timestamps']) == 60
+    np.testing.assert_allclose(window['mean'][:, temperature], 21.0)
+    np.testing.assert_allclose(window['count'][:, temperature], 3.0)
+    np.testing.assert_allclose(window['min'][:, temperature], 20.0)
+    np.testing.assert_allclose(window['max'][:, temperature], 22.0)
+
+
+def test_footprint_grows_with_the_data_up_to_the_documented_bound():
+    history = TieredHistory()
+    empty = history.nbytes
+    n = len(HISTORY_FIELDS)
+    bound = 288 * (n + 1) * 8 + (360 + 24 * 30) * (n * 16 + 8)
+
+    # One reading a minute for 60 days fills every tier
+    seconds = np.arange(60 * 24 * 60) * 60.0
+    history.extend_frame(pd.DataFrame({'timestamp': [from_epoch(START + s) for s in seconds], 'temperature': 20.0}))
+    assert empty < 10_000
+    assert history.nbytes <= bound < 200_000
+    assert history.covers('hour', START + 31 * 86400) and not history.covers('hour', START)
@@ -0,0 +1,122 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+mongomock = pytest.importorskip('mongomock')
+
+from history import EPOCH, to_epoch  # noqa: E402
+from storage import MongoStorage, PartialWriteError, WriteBehindWriter  # noqa: E402
+
+START = datetime(2024, 5, 1, 12, 0)
+
+
+def rows(device, n, start=START, step=timedelta(minutes=10)):
+    return [{'device_id': device, 'timestamp': (start + i * step).isoformat(),
+             'temperature': 20.0 + i, 'humidity': 50.0} for i in range(n)]
+
+
+@pytest.fixture
+def client():
+    return mongomock.MongoClient()
+
+
+def test_append_count_and_read_since_keep_insertion_order(client):
+    storage = MongoStorage(client=client)
+    storage.append(rows('a', 3))
+    storage.append(rows('b', 2))
+    assert storage.count() == 5
+
+    tail = storage.read_since(3)
+    assert list(tail['device_id']) == ['b', 'b']
+    assert list(tail['temperature']) == [20.0, 21.0]
+    assert '_id' not in tail.columns and 'seq' not in tail.columns
+    assert len(storage.read_all()) == 5
+
+
+def test_sequence_continues_after_reopening(client):
+    MongoStorage(client=client).append(rows('a', 2))
+    storage = MongoStorage(client=client)
+    storage.append(rows('b', 1))
+    assert list(storage.read_since(2)['device_id']) == ['b']
+
+
+def test_regular_collection_when_time_series_is_disabled(client):
+    storage = MongoStorage(client=client, collection='plain', time_series=False)
+    assert 'plain' in client['air_quality'].list_collection_names()
+    storage.append(rows('a', 1))
+    assert storage.count() == 1
+
+
+def test_timestamps_are_stored_as_naive_utc(client):
+    storage = MongoStorage(client=client)
+    storage.append([{'device_id': 'a', 'timestamp': '2024-05-01T14:00:00+02:00', 'temperature': 1.0},
+                    {'device_id': 'a', 'temperature': 2.0}])
+    docs = list(storage.collection.find({}).sort('seq', 1))
+    assert docs[0]['timestamp'] == START
+    arrival = to_epoch(docs[1]['timestamp'])
+    assert abs(arrival - (datetime.utcnow() - EPOCH).total_seconds()) < 60
+
+
+def test_raw_history_for_one_device_and_range(client):
+    storage = MongoStorage(client=client)
+    storage.append(rows('a', 6) + rows('b', 6))
+    start = to_epoch(START + timedelta(minutes=10))
+    end = to_epoch(START + timedelta(minutes=40))
+
+    window = storage.query_history('a', start, end, 'raw', ['temperature', 'humidity'])
+    np.testing.assert_allclose(window['timestamps'], [start, start + 600, start + 1200])
+    np.testing.assert_allclose(window['mean'][:, 0], [21.0, 22.0, 23.0])
+    np.testing.assert_allclose(window['count'], np.ones((3, 2)))
+
+
+def test_hourly_history_is_aggregated_per_bucket(client):
+    storage = MongoStorage(client=client)
+    storage.append(rows('a', 12) + rows('b', 12))
+    start = to_epoch(START)
+
+    window = storage.query_history('a', start, start + 7200, 'hour', ['temperature'])
+    np.testing.assert_allclose(window['timestamps'], [start, start + 3600])
+    np.testing.assert_allclose(window['count'][:, 0], [6, 6])
+    np.testing.assert_allclose(window['mean'][:, 0], [22.5, 28.5])
+    np.testing.assert_allclose(window['min'][:, 0], [20.0, 26.0])
+    np.testing.assert_allclose(window['max'][:, 0], [25.0, 31.0])
+
+
+def test_partial_batch_never_reuses_seq_numbers(client):
+    storage = MongoStorage(client=client)
+    storage.collection.create_index('marker', unique=True, sparse=True)
+    storage.append([{'device_id': 'a', 'marker': 1}])
+    batch = rows('a', 2) + [{'device_id': 'a', 'marker': 1}] + rows('b', 2)
+
+    with pytest.raises(PartialWriteError) as failure:
+        storage.append(batch)
+    assert failure.value.written == 4
+    storage.append(rows('c', 1))
+
+    seqs = [doc['seq'] for doc in storage.collection.find({})]
+    assert len(seqs) == len(set(seqs)) == 6
+    assert list(storage.read_since(5)['device_id']) == ['c']
+
+
+def test_writer_counts_only_the_stored_part_of_a_batch(client):
+    storage = MongoStorage(client=client)
+    storage.collection.create_index('marker', unique=True, sparse=True)
+    writer = WriteBehindWriter(storage, batch_rows=10, flush_interval=60).start()
+    for row in rows('a', 3) + [{'device_id': 'a', 'marker': 1}, {'device_id': 'a', 'marker': 1}]:
+        writer.submit(row)
+    assert writer.flush(5)
+    stats = writer.stats()
+    writer.close()
+    assert (stats['written'], stats['failed']) == (storage.count(), 1) == (4, 1)
+
+
+def test_read_only_storage_creates_and_indexes_nothing(client):
+    reader = MongoStorage(client=client, read_only=True)
+    assert 'sensor_data' not in client['air_quality'].list_collection_names()
+    assert reader.count() == 0
+
+    MongoStorage(client=client).append(rows('a', 2))
+    assert reader.count() == 2 and len(reader.read_since(1)) == 1
+    with pytest.raises(PermissionError):
+        reader.append(rows('a', 1))
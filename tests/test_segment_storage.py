@@ -0,0 +1,37 @@
+import os
+
+import pytest
+
+from storage import SegmentStorage, create_storage
+
+
+def rows(n, start=0):
+    return [{'device_id': 'a', 'timestamp': f'2024-05-01T12:{i:02d}:00', 'temperature': float(i)}
+            for i in range(start, start + n)]
+
+
+def test_read_only_storage_creates_nothing(tmp_path):
+    directory = tmp_path / 'store'
+    storage = create_storage('segments', str(directory), 'unused.xlsx', read_only=True)
+    assert storage.count() == 0 and storage.read_all().empty
+    storage.close()
+    assert not directory.exists()
+
+
+def test_read_only_storage_reads_what_the_writer_stores(tmp_path):
+    writer = SegmentStorage(str(tmp_path), segment_rows=4)
+    reader = SegmentStorage(str(tmp_path), read_only=True)
+    writer.append(rows(3))
+    assert reader.count() == 3
+
+    # The writer seals the open segment and starts the next one
+    writer.append(rows(3, start=3))
+    files = sorted(os.listdir(tmp_path))
+    assert reader.count() == 6
+    assert list(reader.read_since(2)['temperature']) == [2.0, 3.0, 4.0, 5.0]
+    assert sorted(os.listdir(tmp_path)) == files
+
+    with pytest.raises(PermissionError):
+        reader.append(rows(1))
+    reader.close()
+    writer.close()
@@ -0,0 +1,51 @@
+import threading
+
+from devices import DeviceRegistry
+from history import from_epoch
+from shared_state import SharedRegistry, StatePublisher
+
+START = 1714564800.0  # 2024-05-01T12:00:00
+
+
+def record(seconds, temperature):
+    return {'timestamp': from_epoch(START + seconds), 'temperature': temperature}
+
+
+def test_worker_reloads_a_device_recreated_at_the_same_version(tmp_path):
+    registry = DeviceRegistry(max_devices=1)
+    publisher = StatePublisher(str(tmp_path), registry, threading.Lock())
+    shared = SharedRegistry(str(tmp_path))
+
+    for seconds, value in [(0, 1.0), (60, 2.0)]:
+        registry.ingest('a', record(seconds, value))
+    publisher.publish(['a'])
+    assert shared.get('a').latest['temperature'] == 2.0
+
+    # 'a' is evicted and created again before the worker looks at the index;
+    # its version restarts and catches up with the copy the worker holds
+    registry.ingest('b', record(120, 5.0))
+    publisher.publish(['b'])
+    for seconds, value in [(180, 7.0), (240, 8.0)]:
+        registry.ingest('a', record(seconds, value))
+    publisher.publish(['a'])
+
+    device = shared.get('a')
+    assert device.version == 2 and device.generation == registry.get('a').generation
+    assert device.latest['temperature'] == 8.0
+
+
+def test_worker_follows_a_device_whose_version_went_down(tmp_path):
+    registry = DeviceRegistry(max_devices=1)
+    publisher = StatePublisher(str(tmp_path), registry, threading.Lock())
+    shared = SharedRegistry(str(tmp_path))
+
+    for i in range(3):
+        registry.ingest('a', record(i * 60, float(i)))
+    publisher.publish(['a'])
+    assert shared.get('a').version == 3
+
+    registry.ingest('b', record(300, 5.0))
+    registry.ingest('a', record(360, 9.0))
+    publisher.publish(['a'])
+    device = shared.get('a')
+    assert device.version == 1 and device.latest['temperature'] == 9.0
@@ -0,0 +1,53 @@
+import json
+from datetime import datetime, timezone
+
+from history import HISTORY_FIELDS, to_epoch
+from uplink import UPLINK_FIELDS, parse_uplink
+
+
+def ttn_uplink(decoded, received_at='2024-05-01T12:00:00.123456789Z'):
+    return json.dumps({
+        'end_device_ids': {'device_id': 'am3-1', 'application_ids': {'application_id': 'air-quality'}},
+        'received_at': received_at,
+        'uplink_message': {
+            'f_port': 85,
+            'f_cnt': 3489,
+            'decoded_payload': decoded,
+            'rx_metadata': [{'gateway_ids': {'gateway_id': 'gw-1'}, 'rssi': -97, 'snr': 7.5},
+                            {'gateway_ids': {'gateway_id': 'gw-2'}, 'rssi': -80, 'snr': 9.25}],
+        },
+    }).encode()
+
+
+def test_every_history_field_survives_parsing():
+    decoded = {'battery': 90, 'co2': 400, 'humidity': 40, 'light_level': 4, 'pir': 'idle', 'pm10': 66,
+               'pm2_5': 53, 'pressure': 946.8, 'temperature': 25.1, 'tvoc': 120}
+    record = parse_uplink(ttn_uplink(decoded))
+
+    assert list(record) == UPLINK_FIELDS
+    assert record['device_id'] == 'am3-1'
+    assert record['pressure'] == 946.8 and record['battery'] == 90.0 and record['light_level'] == 4.0
+    assert all(record[field] == float(decoded[field]) for field in HISTORY_FIELDS)
+    assert 'pir' not in record
+    assert (record['rssi'], record['snr']) == (-80.0, 9.25)
+
+
+def test_missing_and_invalid_readings_become_none():
+    record = parse_uplink(ttn_uplink({'pm2_5': 'n/a', 'co2': None, 'battery': True}))
+    assert record['pm2_5'] is None and record['co2'] is None and record['battery'] is None
+    assert record['pressure'] is None
+
+
+def test_timestamp_falls_back_to_received_at_as_naive_utc():
+    record = parse_uplink(ttn_uplink({}, received_at='2024-05-01T14:00:00.5+02:00'))
+    assert record['timestamp'] == '2024-05-01T12:00:00.500000'
+
+    record = parse_uplink(ttn_uplink({}, received_at=None))
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    assert abs(to_epoch(record['timestamp']) - to_epoch(now)) < 60
+
+
+def test_flat_records_keep_their_own_timestamp():
+    record = parse_uplink(b'{"device_id": "flat", "timestamp": "2024-05-01T12:00:00", "pressure": "1001.5"}')
+    assert record['timestamp'] == '2024-05-01T12:00:00'
+    assert record['device_id'] == 'flat' and record['pressure'] == 1001.5
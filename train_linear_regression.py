@@ -1,353 +1,644 @@
-
-
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
-import seaborn as sns
 from sklearn.preprocessing import StandardScaler
 from sklearn.metrics import mean_squared_error, mean_absolute_error, r2_score
-from sklearn.model_selection import TimeSeriesSplit
 from sklearn.linear_model import LinearRegression
-import joblib
 import warnings
-import os
+import argparse
+from history import HISTORY_FIELDS
+from cross_validation import BlockMoments, fold_bounds, residuals, walk_forward
+from inference import sklearn_params
+from model_artifact import write_artifact
+from online import RunningMoments
+from training_data import iter_training_data, load_training_data, merge_by_time
+from train_model import fitted_model, fitted_scaler
 warnings.filterwarnings('ignore')
 
 # Set random seed for reproducibility
 np.random.seed(42)
 
-print("="*80)
-print("MULTI-TARGET AIR QUALITY PREDICTION SYSTEM - LINEAR REGRESSION")
-print("="*80)
+# Parquet copies of the workbooks are used once converted:
+#   python training_data.py convert data/Sensor1+24_mar_11_20.xlsx data/sesnor2_24_mar_11_20.xlsx
+DATA_SOURCES = ['data/Sensor1+24_mar_11_20.xlsx', 'data/sesnor2_24_mar_11_20.xlsx']
+TIME_COLUMN = 'received_at'
+N_LAGS = 2
+ROLLING_WINDOW = 5
+ROLLING_KEYWORDS = ['pm10', 'pm2', 'co2', 'humidity', 'temperature', 'temp', 'hum', 'tvoc', 'pressure']
+CV_FOLDS = 5
+# Not models_lr/models.npz: these targets and features are not the ones mqtt_pipeline.py serves
+ARTIFACT = 'models_lr/multi_target_lr.npz'
+
+# Define target pollutants to predict
+target_mapping = {
+    'pm2_5': 'PM2.5',
+    'pm10': 'PM10',
+    'co2': 'CO2',
+    'tvoc': 'TVOC',
+    'temperature': 'Temperature',
+    'humidity': 'Humidity',
+    'pressure': 'Pressure'
+}
+
 
 # ============================================================================
 # STEP 1: LOAD DATA
 # ============================================================================
-print("\n[STEP 1] Loading data from Excel files...")
-
-try:
-    df1 = pd.read_excel('data/Sensor1+24_mar_11_20.xlsx')
-    df2 = pd.read_excel('data/sesnor2_24_mar_11_20.xlsx')
-    
-    print(f"  - Sensor1 data shape: {df1.shape}")
-    print(f"  - Sensor2 data shape: {df2.shape}")
-    
-    df = pd.concat([df1, df2], axis=0, ignore_index=True)
-    print(f"  - Combined data shape: {df.shape}")
-    
-except Exception as e:
-    print(f"ERROR loading data: {e}")
-    raise
+def load_data(sources=DATA_SOURCES):
+    print("\n[STEP 1] Loading data...")
+    try:
+        # Only the timestamp and the numeric sensor fields are read. For workbooks in the
+        # pipeline's layout these are all of their numeric columns; other numeric columns
+        # (e.g. f_cnt / f_port of flattened TTN exports) are not used as features
+        frames = []
+        for i, source in enumerate(sources, 1):
+            frames.append(load_training_data(source, columns=HISTORY_FIELDS, time_column=TIME_COLUMN))
+            print(f"  - Sensor{i} data shape: {frames[-1].shape}")
+
+        df = pd.concat(frames, axis=0, ignore_index=True)
+        print(f"  - Combined data shape: {df.shape}")
+
+    except Exception as e:
+        print(f"ERROR loading data: {e}")
+        raise
+    return df
+
 
 # ============================================================================
 # STEP 2: PREPROCESS DATA
 # ============================================================================
-print("\n[STEP 2] Preprocessing data...")
-
-# Parse datetime and set as index
-if 'received_at' in df.columns:
-    df['received_at'] = pd.to_datetime(df['received_at'], errors='coerce')
-    df = df.sort_values('received_at')
-    df.set_index('received_at', inplace=True)
-    print(f"  - Set datetime index from 'received_at'")
-
-# Drop irrelevant columns
-cols_to_drop = ['correlation_ids', 'frm_payload', 'rx_metadata', 'beep']
-cols_to_drop = [col for col in cols_to_drop if col in df.columns]
-if cols_to_drop:
-    df.drop(columns=cols_to_drop, inplace=True)
-
-# Keep only numeric columns
-numeric_cols = df.select_dtypes(include=[np.number]).columns.tolist()
-df = df[numeric_cols]
-print(f"  - Kept {len(numeric_cols)} numeric columns")
+def preprocess(df):
+    print("\n[STEP 2] Preprocessing data...")
+
+    # Parse datetime and set as index
+    if TIME_COLUMN in df.columns:
+        df[TIME_COLUMN] = pd.to_datetime(df[TIME_COLUMN], errors='coerce')
+        df = df.sort_values(TIME_COLUMN)
+        df.set_index(TIME_COLUMN, inplace=True)
+        print(f"  - Set datetime index from '{TIME_COLUMN}'")
+
+    # Drop irrelevant columns
+    cols_to_drop = ['correlation_ids', 'frm_payload', 'rx_metadata', 'beep']
+    cols_to_drop = [col for col in cols_to_drop if col in df.columns]
+    if cols_to_drop:
+        df.drop(columns=cols_to_drop, inplace=True)
+
+    # Keep only numeric columns
+    numeric_cols = df.select_dtypes(include=[np.number]).columns.tolist()
+    df = df[numeric_cols]
+    print(f"  - Kept {len(numeric_cols)} numeric columns")
+    return df
+
 
 # ============================================================================
 # STEP 3: IDENTIFY TARGET VARIABLES
 # ============================================================================
-print("\n[STEP 3] Identifying target variables...")
+def identify_targets(columns):
+    print("\n[STEP 3] Identifying target variables...")
 
-# Define target pollutants to predict
-target_mapping = {
-    'pm2_5': 'PM2.5',
-    'pm10': 'PM10',
-    'co2': 'CO2',
-    'tvoc': 'TVOC',
-    'temperature': 'Temperature',
-    'humidity': 'Humidity',
-    'pressure': 'Pressure'
-}
+    # Find actual column names for each target
+    target_columns = {}
+    for key, name in target_mapping.items():
+        matching_cols = [col for col in columns if key in col.lower()]
+        if matching_cols:
+            target_columns[name] = matching_cols[0]
+            print(f"  - {name}: '{matching_cols[0]}'")
 
-# Find actual column names for each target
-target_columns = {}
-for key, name in target_mapping.items():
-    matching_cols = [col for col in df.columns if key in col.lower()]
-    if matching_cols:
-        target_columns[name] = matching_cols[0]
-        print(f"  - {name}: '{matching_cols[0]}'")
+    print(f"\n  Total targets identified: {len(target_columns)}")
+    return target_columns
 
-print(f"\n  Total targets identified: {len(target_columns)}")
 
 # ============================================================================
 # STEP 4: PREPARE DATA FOR EACH TARGET
 # ============================================================================
-print("\n[STEP 4] Preparing data for multi-target prediction...")
-
-# Drop columns with too many missing values (>50% missing)
-missing_pct = df.isnull().sum() / len(df)
-cols_to_drop = missing_pct[missing_pct > 0.5].index.tolist()
-if cols_to_drop:
-    df = df.drop(columns=cols_to_drop)
-    print(f"  - Dropped {len(cols_to_drop)} columns with >50% missing values")
-
-# Fill missing values
-print(f"  - Missing values before filling: {df.isnull().sum().sum()}")
-df = df.ffill().bfill()
-df = df.interpolate(method='linear', limit_direction='both')
-print(f"  - Missing values after filling: {df.isnull().sum().sum()}")
-
-# Remove any remaining NaN rows
-rows_before = len(df)
-df = df.dropna()
-print(f"  - Removed {rows_before - len(df)} rows with remaining NaN values")
-print(f"  - Final data shape: {df.shape}")
+def mostly_missing(missing_pct):
+    """Columns with more than 50% missing values."""
+    return missing_pct[missing_pct > 0.5].index.tolist()
+
+
+def clean(df):
+    print("\n[STEP 4] Preparing data for multi-target prediction...")
+
+    # Drop columns with too many missing values (>50% missing)
+    cols_to_drop = mostly_missing(df.isnull().sum() / len(df))
+    if cols_to_drop:
+        df = df.drop(columns=cols_to_drop)
+        print(f"  - Dropped {len(cols_to_drop)} columns with >50% missing values")
+
+    # Fill missing values
+    print(f"  - Missing values before filling: {df.isnull().sum().sum()}")
+    df = df.ffill().bfill()
+    df = df.interpolate(method='linear', limit_direction='both')
+    print(f"  - Missing values after filling: {df.isnull().sum().sum()}")
+
+    # Remove any remaining NaN rows
+    rows_before = len(df)
+    df = df.dropna()
+    print(f"  - Removed {rows_before - len(df)} rows with remaining NaN values")
+    print(f"  - Final data shape: {df.shape}")
+    return df
+
+
+def rolled(col):
+    """Whether a column gets a rolling mean feature (when it is not the target)."""
+    return any(keyword in col.lower() for keyword in ROLLING_KEYWORDS)
+
+
+def target_features(columns, target_col):
+    """Feature names for one target, in the column order of the in-memory frame."""
+    feature_cols = [col for col in columns if col != target_col]
+    lags = [f'{target_col}_lag{k}' for k in range(1, N_LAGS + 1)]
+    rolling = [f'{col}_rolling_mean_{ROLLING_WINDOW}' for col in feature_cols if rolled(col)]
+    return feature_cols + lags + rolling
+
+
+def timed_report(report, starts, ends):
+    """The walk-forward report with the time range of each fold's validation rows."""
+    report.insert(3, 'val_start', starts)
+    report.insert(4, 'val_end', ends)
+    print(f"  - Walk-forward ({len(report)} folds): RMSE {report['rmse'].iloc[0]:.4f} (fold 1) -> "
+          f"{report['rmse'].iloc[-1]:.4f} (fold {len(report)}), worst {report['rmse'].max():.4f}")
+    return report
+
+
+def evaluation(y_train, y_train_pred, y_test, y_test_pred, cv_rmse_scores):
+    return {
+        'train_rmse': np.sqrt(mean_squared_error(y_train, y_train_pred)),
+        'test_rmse': np.sqrt(mean_squared_error(y_test, y_test_pred)),
+        'train_mae': mean_absolute_error(y_train, y_train_pred),
+        'test_mae': mean_absolute_error(y_test, y_test_pred),
+        'train_r2': r2_score(y_train, y_train_pred),
+        'test_r2': r2_score(y_test, y_test_pred),
+        'cv_rmse_mean': np.mean(cv_rmse_scores),
+        'cv_rmse_std': np.std(cv_rmse_scores),
+    }
 
-# ============================================================================
-# STEP 5: TRAIN LINEAR REGRESSION MODELS FOR EACH TARGET
-# ============================================================================
-print("\n[STEP 5] Training Linear Regression models for each target...")
 
-# Create directory for models
-os.makedirs('models_lr', exist_ok=True)
+def print_results(results):
+    print(f"\n  RESULTS:")
+    print(f"    Train - RMSE: {results['train_rmse']:.4f}, MAE: {results['train_mae']:.4f}, R2: {results['train_r2']:.4f}")
+    print(f"    Test  - RMSE: {results['test_rmse']:.4f}, MAE: {results['test_mae']:.4f}, R2: {results['test_r2']:.4f}")
 
-# Store results for all models
-all_results = {}
-all_models = {}
-all_scalers = {}
 
-for target_name, target_col in target_columns.items():
-    print(f"\n{'='*80}")
-    print(f"TRAINING LINEAR REGRESSION MODEL FOR: {target_name}")
-    print(f"{'='*80}")
-    
+# ============================================================================
+# STEP 5: TRAIN LINEAR REGRESSION MODELS FOR EACH TARGET
+# ============================================================================
+def fit_target(df, target_col, cv_folds=CV_FOLDS):
+    """Fits one target on the in-memory frame. Returns (model, scaler, results)."""
     # Prepare features (all columns except current target)
     feature_cols = [col for col in df.columns if col != target_col]
-    
+
     # Create lag features for this target
     df_temp = df.copy()
-    df_temp[f'{target_col}_lag1'] = df_temp[target_col].shift(1)
-    df_temp[f'{target_col}_lag2'] = df_temp[target_col].shift(2)
-    
+    for k in range(1, N_LAGS + 1):
+        df_temp[f'{target_col}_lag{k}'] = df_temp[target_col].shift(k)
+
     # Create rolling mean features for other pollutants
-    rolling_window = 5
     for col in feature_cols:
-        if any(keyword in col.lower() for keyword in ['pm10', 'pm2', 'co2', 'humidity', 'temperature', 'temp', 'hum', 'tvoc', 'pressure']):
-            if col != target_col:  # Don't create rolling mean for target itself
-                rolling_col = f'{col}_rolling_mean_{rolling_window}'
-                df_temp[rolling_col] = df_temp[col].rolling(window=rolling_window, min_periods=1).mean()
-    
+        if rolled(col):
+            rolling_col = f'{col}_rolling_mean_{ROLLING_WINDOW}'
+            df_temp[rolling_col] = df_temp[col].rolling(window=ROLLING_WINDOW, min_periods=1).mean()
+
     # Drop NaN rows created by lag features
     df_temp = df_temp.dropna()
-    
+
     # Prepare X and y
     all_features = [col for col in df_temp.columns if col != target_col]
     X = df_temp[all_features]
     y = df_temp[target_col]
-    
+
     print(f"  - Feature matrix shape: {X.shape}")
     print(f"  - Target shape: {y.shape}")
     print(f"  - Target mean: {y.mean():.2f}, std: {y.std():.2f}")
-    
+
     # Chronological split (80/20)
     split_idx = int(len(df_temp) * 0.8)
     X_train, X_test = X.iloc[:split_idx], X.iloc[split_idx:]
     y_train, y_test = y.iloc[:split_idx], y.iloc[split_idx:]
-    
+
     print(f"  - Train set: {X_train.shape[0]} samples")
     print(f"  - Test set: {X_test.shape[0]} samples")
-    
+
     # Normalize features
     scaler = StandardScaler()
     X_train_scaled = scaler.fit_transform(X_train)
     X_test_scaled = scaler.transform(X_test)
-    
+
     # Train Linear Regression model
     print(f"  - Training Linear Regression model...")
     model = LinearRegression(
         fit_intercept=True,
         n_jobs=-1  # Use all CPU cores
     )
-    
+
     model.fit(X_train_scaled, y_train)
     print(f"  - Model trained successfully")
-    
-    # Cross-validation
-    tscv = TimeSeriesSplit(n_splits=5)
-    cv_rmse_scores = []
-    
-    for fold, (train_idx, val_idx) in enumerate(tscv.split(X_train_scaled)):
-        X_cv_train, X_cv_val = X_train_scaled[train_idx], X_train_scaled[val_idx]
-        y_cv_train, y_cv_val = y_train.iloc[train_idx], y_train.iloc[val_idx]
-        
-        cv_model = LinearRegression(fit_intercept=True, n_jobs=-1)
-        cv_model.fit(X_cv_train, y_cv_train)
-        y_cv_pred = cv_model.predict(X_cv_val)
-        cv_rmse = np.sqrt(mean_squared_error(y_cv_val, y_cv_pred))
-        cv_rmse_scores.append(cv_rmse)
-    
+
+    # Cross-validation: TimeSeriesSplit folds, all solved from per-block statistics
+    bounds = fold_bounds(len(X_train), cv_folds)
+    blocks = BlockMoments.of(np.column_stack([X_train.to_numpy(dtype=float), y_train.to_numpy(dtype=float)]), bounds)
+    report = walk_forward(blocks, list(range(X_train.shape[1])), X_train.shape[1])
+    cv_rmse_scores = report['rmse'].to_numpy()
+
     print(f"  - Mean CV RMSE: {np.mean(cv_rmse_scores):.4f} +/- {np.std(cv_rmse_scores):.4f}")
-    
+    report = timed_report(report, X_train.index[bounds[1:-1]], X_train.index[bounds[2:] - 1])
+
     # Evaluate on test set
     y_train_pred = model.predict(X_train_scaled)
     y_test_pred = model.predict(X_test_scaled)
-    
-    train_rmse = np.sqrt(mean_squared_error(y_train, y_train_pred))
-    test_rmse = np.sqrt(mean_squared_error(y_test, y_test_pred))
-    train_mae = mean_absolute_error(y_train, y_train_pred)
-    test_mae = mean_absolute_error(y_test, y_test_pred)
-    train_r2 = r2_score(y_train, y_train_pred)
-    test_r2 = r2_score(y_test, y_test_pred)
-    
-    print(f"\n  RESULTS:")
-    print(f"    Train - RMSE: {train_rmse:.4f}, MAE: {train_mae:.4f}, R2: {train_r2:.4f}")
-    print(f"    Test  - RMSE: {test_rmse:.4f}, MAE: {test_mae:.4f}, R2: {test_r2:.4f}")
-    
-    # Store results
-    all_results[target_name] = {
-        'train_rmse': train_rmse,
-        'test_rmse': test_rmse,
-        'train_mae': train_mae,
-        'test_mae': test_mae,
-        'train_r2': train_r2,
-        'test_r2': test_r2,
-        'cv_rmse_mean': np.mean(cv_rmse_scores),
-        'cv_rmse_std': np.std(cv_rmse_scores),
+
+    results = evaluation(y_train, y_train_pred, y_test, y_test_pred, cv_rmse_scores)
+    print_results(results)
+    results.update({
         'y_test': y_test,
         'y_test_pred': y_test_pred,
+        'walk_forward': report,
         'coefficients': pd.DataFrame({
             'feature': X.columns,
             'coefficient': model.coef_
         }).sort_values('coefficient', key=abs, ascending=False)
-    }
-    
-    # Save model and scaler
-    model_filename = f'models_lr/{target_name.lower().replace(".", "")}_model.pkl'
-    scaler_filename = f'models_lr/{target_name.lower().replace(".", "")}_scaler.pkl'
-    joblib.dump(model, model_filename)
-    joblib.dump(scaler, scaler_filename)
-    
-    all_models[target_name] = model
-    all_scalers[target_name] = scaler
-    
-    print(f"  - Saved: {model_filename}")
-    print(f"  - Saved: {scaler_filename}")
+    })
+    return model, scaler, results
+
+
+def train_in_memory(sources, cv_folds=CV_FOLDS):
+    df = preprocess(load_data(sources))
+    target_columns = identify_targets(df.columns)
+    df = clean(df)
+
+    print("\n[STEP 5] Training Linear Regression models for each target...")
+    fitted = {}
+    for target_name, target_col in target_columns.items():
+        print(f"\n{'='*80}")
+        print(f"TRAINING LINEAR REGRESSION MODEL FOR: {target_name}")
+        print(f"{'='*80}")
+        fitted[target_name] = fit_target(df, target_col, cv_folds)
+    return fitted
+
 
 # ============================================================================
-# STEP 6: SUMMARY TABLE
+# STEP 1-5, OUT OF CORE: STREAM CHUNKS, ACCUMULATE SUFFICIENT STATISTICS
 # ============================================================================
-print("\n" + "="*80)
-print("LINEAR REGRESSION MODEL PERFORMANCE SUMMARY")
-print("="*80)
-
-summary_df = pd.DataFrame({
-    'Target': list(all_results.keys()),
-    'Train RMSE': [all_results[t]['train_rmse'] for t in all_results],
-    'Test RMSE': [all_results[t]['test_rmse'] for t in all_results],
-    'Test MAE': [all_results[t]['test_mae'] for t in all_results],
-    'Test R2': [all_results[t]['test_r2'] for t in all_results],
-    'CV RMSE': [all_results[t]['cv_rmse_mean'] for t in all_results]
-})
-
-print("\n" + summary_df.to_string(index=False))
-print("\n" + "="*80)
-
-# Save summary to CSV
-summary_df.to_csv('models_lr/model_performance_summary_lr.csv', index=False)
-print("\nSaved performance summary to: models_lr/model_performance_summary_lr.csv")
+class ChunkedFeatures:
+    """
+    Turns a stream of cleaned chunks into rows of the in-memory path's
+    features, carrying fill, lag and rolling state across chunk boundaries.
+
+    Each row is one base vector holding every column, its lags and its
+    rolling mean, so all targets share it: [columns | lag1 | lag2 | rolling
+    means of the `rolled` columns]. The first N_LAGS rows of the stream,
+    which the in-memory path drops for their missing lags, are skipped.
+    """
+
+    def __init__(self, columns, first_valid):
+        self.columns = list(columns)
+        self.first_valid = np.asarray(first_valid, dtype=float)
+        self.rolling_idx = [i for i, col in enumerate(self.columns) if rolled(col)]
+        self.names = list(self.columns)
+        for k in range(1, N_LAGS + 1):
+            self.names += [f'{col}_lag{k}' for col in self.columns]
+        self.names += [f'{self.columns[i]}_rolling_mean_{ROLLING_WINDOW}' for i in self.rolling_idx]
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.seen = 0
+        self._last = np.full(len(self.columns), np.nan)
+        self._tail = np.empty((0, len(self.columns)))
+
+    def rows(self, chunk):
+        """Base vectors for a chunk, and the in-memory row number of the first one."""
+        values = chunk.reindex(columns=self.columns).to_numpy(dtype=float)
+        # ffill continues from the previous chunk; leading gaps take the first value (bfill)
+        filled = pd.DataFrame(np.vstack([self._last, values])).ffill().to_numpy()[1:]
+        filled = np.where(np.isnan(filled), self.first_valid, filled)
+        self._last = filled[-1]
+
+        history = max(N_LAGS, ROLLING_WINDOW - 1)
+        ext = np.vstack([self._tail, filled])
+        offset = len(self._tail)
+        rolling = pd.DataFrame(ext[:, self.rolling_idx]).rolling(window=ROLLING_WINDOW, min_periods=1).mean().to_numpy()
+        blocks = [filled]
+        for k in range(1, N_LAGS + 1):
+            lagged = np.full_like(filled, np.nan)
+            start = max(0, k - offset)
+            lagged[start:] = ext[offset + start - k:len(ext) - k]
+            blocks.append(lagged)
+        blocks.append(rolling[offset:])
+        base = np.hstack(blocks)
+        self._tail = ext[-history:]
+
+        first_row = self.seen - N_LAGS
+        self.seen += len(filled)
+        skip = max(0, -first_row)
+        return base[skip:], first_row + skip
+
+
+def stream(sources, chunk_rows):
+    """Merged chunks of every source in time order; records without a time are dropped."""
+    def timed(source):
+        for chunk in iter_training_data(source, HISTORY_FIELDS, TIME_COLUMN, chunk_rows=chunk_rows):
+            chunk = chunk[chunk[TIME_COLUMN].notna().to_numpy()]
+            if len(chunk):
+                yield chunk
+    return merge_by_time([timed(source) for source in sources], TIME_COLUMN)
+
+
+def scan(sources, chunk_rows):
+    """Pass 1: row count, numeric columns, missing values and first valid value per column."""
+    n, columns, missing, first_valid, numeric = 0, [], {}, {}, {}
+    for chunk in stream(sources, chunk_rows):
+        n += len(chunk)
+        for col in chunk.columns:
+            if col == TIME_COLUMN:
+                continue
+            if col not in missing:
+                columns.append(col)
+                # Rows of chunks without this column count as missing
+                missing[col], numeric[col] = n - len(chunk), True
+            series = chunk[col]
+            if series.notna().any() and not pd.api.types.is_numeric_dtype(series):
+                numeric[col] = False
+            missing[col] += int(series.isna().sum())
+            if col not in first_valid and series.notna().any():
+                first_valid[col] = float(series[series.notna()].iloc[0])
+        for col in columns:
+            if col not in chunk.columns:
+                missing[col] += len(chunk)
+    columns = [col for col in columns if numeric[col]]
+    return n, columns, pd.Series({col: missing[col] for col in columns}, dtype=float), first_valid
+
+
+def solve(moments, idx, j):
+    """Least squares on standardized inputs from moments, as fit_target's model. Returns (coef, intercept, gram, var, scale)."""
+    var = np.diag(moments.comoment)[idx] / moments.count
+    scale = np.where(var > 10 * np.finfo(float).eps, np.sqrt(var), 1.0)
+    gram = moments.comoment[np.ix_(idx, idx)] / np.outer(scale, scale)
+    coef = np.linalg.lstsq(gram, moments.comoment[idx, j] / scale, rcond=None)[0]
+    return coef, moments.mean[j], gram, var, scale
+
+
+def train_chunked(sources, chunk_rows, cv_folds=CV_FOLDS):
+    print(f"\n[STEP 1] Streaming data in chunks of {chunk_rows:,} rows...")
+    n, columns, missing, first_valid = scan(sources, chunk_rows)
+    print(f"  - Combined data shape: {(n, len(columns))}")
+
+    print("\n[STEP 2] Preprocessing data...")
+    print(f"  - Kept {len(columns)} numeric columns")
+    target_columns = identify_targets(columns)
+
+    print("\n[STEP 4] Preparing data for multi-target prediction...")
+    cols_to_drop = mostly_missing(missing / n)
+    if cols_to_drop:
+        columns = [col for col in columns if col not in cols_to_drop]
+        print(f"  - Dropped {len(cols_to_drop)} columns with >50% missing values")
+    print(f"  - Missing values before filling: {int(missing[columns].sum())}")
+    print(f"  - Final data shape: {(n, len(columns))}")
+
+    print("\n[STEP 5] Accumulating sufficient statistics for each target...")
+    n_rows = n - N_LAGS
+    split_idx = int(n_rows * 0.8)
+    # The CV folds' blocks of the train rows, then the test rows
+    bounds = np.append(fold_bounds(split_idx, cv_folds), n_rows)
+    first = [first_valid[col] for col in columns]
+    features = ChunkedFeatures(columns, first)
+    blocks = [RunningMoments(len(features.names)) for _ in range(len(bounds) - 1)]
+    starts, ends = [None] * len(blocks), [None] * len(blocks)
+    for chunk in stream(sources, chunk_rows):
+        base, row = features.rows(chunk)
+        times = chunk[TIME_COLUMN].to_numpy()[len(chunk) - len(base):]
+        cuts = np.clip(bounds - row, 0, len(base))
+        for b, moments in enumerate(blocks):
+            if cuts[b + 1] > cuts[b]:
+                moments.update(base[cuts[b]:cuts[b + 1]])
+                starts[b] = times[cuts[b]] if starts[b] is None else starts[b]
+                ends[b] = times[cuts[b + 1] - 1]
+
+    cv_blocks = BlockMoments.stack(blocks[:-1])
+    train = cv_blocks.prefixes()[-1:]
+    everything = BlockMoments.stack(blocks).prefixes()[-1]
+
+    # Fit every target from the train statistics; CV folds from prefix statistics
+    fitted, solved = {}, {}
+    for target_name, target_col in target_columns.items():
+        names = target_features(columns, target_col)
+        idx = [features.index[name] for name in names]
+        j = features.index[target_col]
+        coef, intercept, gram, var, scale = solve(train[0], idx, j)
+        weights = coef / scale
+        bias = intercept - weights @ train.mean[0, idx]
+
+        report = walk_forward(cv_blocks, idx, j)
+        scaler = fitted_scaler(train.mean[0, idx], var, split_idx, names)
+        model = fitted_model(coef, intercept, gram, split_idx)
+        target_std = np.sqrt(everything.comoment[j, j] / (everything.count - 1))
+        solved[target_name] = (idx, j, weights, bias, report, target_std)
+        fitted[target_name] = (model, scaler, names)
+
+    # Pass 3: residuals for the train metrics and test predictions
+    sums = {name: {'sae': 0.0, 'y_test': [], 'y_test_pred': []} for name in target_columns}
+    features = ChunkedFeatures(columns, first)
+    for chunk in stream(sources, chunk_rows):
+        base, row = features.rows(chunk)
+        cut = int(np.clip(split_idx - row, 0, len(base)))
+        for target_name, (idx, j, weights, bias, _, _) in solved.items():
+            pred = base[:, idx] @ weights + bias
+            sums[target_name]['sae'] += float(np.abs(base[:cut, j] - pred[:cut]).sum())
+            sums[target_name]['y_test'].append(base[cut:, j])
+            sums[target_name]['y_test_pred'].append(pred[cut:])
+
+    results = {}
+    for target_name, target_col in target_columns.items():
+        idx, j, weights, bias, report, target_std = solved[target_name]
+        cv_rmse_scores = report['rmse'].to_numpy()
+        model, scaler, names = fitted[target_name]
+        print(f"\n{'='*80}")
+        print(f"TRAINING LINEAR REGRESSION MODEL FOR: {target_name}")
+        print(f"{'='*80}")
+        print(f"  - Feature matrix shape: {(n_rows, len(names))}")
+        print(f"  - Target mean: {everything.mean[j]:.2f}, std: {target_std:.2f}")
+        print(f"  - Train set: {split_idx} samples")
+        print(f"  - Test set: {n_rows - split_idx} samples")
+        print(f"  - Mean CV RMSE: {np.mean(cv_rmse_scores):.4f} +/- {np.std(cv_rmse_scores):.4f}")
+        report = timed_report(report, starts[1:-1], ends[1:-1])
+
+        y_test = pd.Series(np.concatenate(sums[target_name]['y_test']))
+        y_test_pred = np.concatenate(sums[target_name]['y_test_pred'])
+        train_sse = residuals(train, idx, j, weights[None], np.array([bias]))[0][0]
+        result = {
+            'train_rmse': np.sqrt(train_sse / split_idx),
+            'test_rmse': np.sqrt(mean_squared_error(y_test, y_test_pred)),
+            'train_mae': sums[target_name]['sae'] / split_idx,
+            'test_mae': mean_absolute_error(y_test, y_test_pred),
+            'train_r2': 1.0 - train_sse / train.comoment[0, j, j],
+            'test_r2': r2_score(y_test, y_test_pred),
+            'cv_rmse_mean': np.mean(cv_rmse_scores),
+            'cv_rmse_std': np.std(cv_rmse_scores),
+        }
+        print_results(result)
+        result.update({
+            'y_test': y_test,
+            'y_test_pred': y_test_pred,
+            'walk_forward': report,
+            'coefficients': pd.DataFrame({
+                'feature': names,
+                'coefficient': model.coef_
+            }).sort_values('coefficient', key=abs, ascending=False)
+        })
+        results[target_name] = (model, scaler, result)
+    return results
+
+
+def save_models(fitted, **info):
+    # One artifact for every target's model, scaler and feature order
+    params = {target_name: sklearn_params(model, scaler, scaler.feature_names_in_)
+              for target_name, (model, scaler, _) in fitted.items()}
+    metrics = {target_name: {key: value for key, value in results.items() if np.isscalar(value)}
+               for target_name, (_, _, results) in fitted.items()}
+    manifest = write_artifact(ARTIFACT, params, metrics=metrics, **info)
+    print(f"  - Saved: {ARTIFACT} (version {manifest['version']})")
+
 
 # ============================================================================
-# STEP 7: VISUALIZATIONS
+# STEP 6: SUMMARY TABLE
 # ============================================================================
-print("\n[STEP 7] Creating comprehensive visualizations...")
-
-# Create a large figure with subplots for each target
-n_targets = len(all_results)
-fig, axes = plt.subplots(n_targets, 3, figsize=(18, 5*n_targets))
-
-if n_targets == 1:
-    axes = axes.reshape(1, -1)
-
-for idx, (target_name, results) in enumerate(all_results.items()):
-    y_test = results['y_test']
-    y_test_pred = results['y_test_pred']
-    
-    # Plot 1: Actual vs Predicted
-    axes[idx, 0].scatter(y_test, y_test_pred, alpha=0.5, s=10)
-    axes[idx, 0].plot([y_test.min(), y_test.max()], [y_test.min(), y_test.max()], 'r--', lw=2)
-    axes[idx, 0].set_xlabel(f'Actual {target_name}', fontsize=10)
-    axes[idx, 0].set_ylabel(f'Predicted {target_name}', fontsize=10)
-    axes[idx, 0].set_title(f'{target_name}: Actual vs Predicted (Linear Regression)\nRMSE: {results["test_rmse"]:.4f}, R2: {results["test_r2"]:.4f}', 
-                           fontsize=11, fontweight='bold')
-    axes[idx, 0].grid(True, alpha=0.3)
-    
-    # Plot 2: Time Series (last 200 samples)
-    n_samples = min(200, len(y_test))
-    axes[idx, 1].plot(y_test.iloc[-n_samples:].values, label='Actual', linewidth=1.5, alpha=0.7)
-    axes[idx, 1].plot(y_test_pred[-n_samples:], label='Predicted', linewidth=1.5, alpha=0.7)
-    axes[idx, 1].set_xlabel('Time Index', fontsize=10)
-    axes[idx, 1].set_ylabel(target_name, fontsize=10)
-    axes[idx, 1].set_title(f'{target_name}: Time Series Prediction', fontsize=11, fontweight='bold')
-    axes[idx, 1].legend(fontsize=9)
-    axes[idx, 1].grid(True, alpha=0.3)
-    
-    # Plot 3: Top Coefficients (Top 10)
-    top_coefs = results['coefficients'].head(10)
-    axes[idx, 2].barh(range(len(top_coefs)), top_coefs['coefficient'].values)
-    axes[idx, 2].set_yticks(range(len(top_coefs)))
-    axes[idx, 2].set_yticklabels([f[:30] for f in top_coefs['feature'].values], fontsize=8)
-    axes[idx, 2].set_xlabel('Coefficient Value', fontsize=10)
-    axes[idx, 2].set_title(f'{target_name}: Top 10 Coefficients', fontsize=11, fontweight='bold')
-    axes[idx, 2].invert_yaxis()
-    axes[idx, 2].grid(True, alpha=0.3, axis='x')
-
-plt.tight_layout()
-plt.savefig('graphs/model_evaluations/multi_target_evaluation_lr.png', dpi=300, bbox_inches='tight')
-print("  - Saved: graphs/model_evaluations/multi_target_evaluation_lr.png")
-
-# Create comparison bar chart
-fig2, ax = plt.subplots(1, 1, figsize=(12, 6))
-x = np.arange(len(summary_df))
-width = 0.25
-
-ax.bar(x - width, summary_df['Train RMSE'], width, label='Train RMSE', alpha=0.8)
-ax.bar(x, summary_df['Test RMSE'], width, label='Test RMSE', alpha=0.8)
-ax.bar(x + width, summary_df['CV RMSE'], width, label='CV RMSE', alpha=0.8)
-
-ax.set_xlabel('Target Variable', fontsize=12, fontweight='bold')
-ax.set_ylabel('RMSE', fontsize=12, fontweight='bold')
-ax.set_title('Linear Regression Model Performance Comparison', fontsize=14, fontweight='bold')
-ax.set_xticks(x)
-ax.set_xticklabels(summary_df['Target'], rotation=45, ha='right')
-ax.legend()
-ax.grid(True, alpha=0.3, axis='y')
-
-plt.tight_layout()
-plt.savefig('graphs/model_evaluations/model_comparison_lr.png', dpi=300, bbox_inches='tight')
-print("  - Saved: graphs/model_evaluations/model_comparison_lr.png")
+def save_summary(all_results):
+    print("\n" + "="*80)
+    print("LINEAR REGRESSION MODEL PERFORMANCE SUMMARY")
+    print("="*80)
+
+    summary_df = pd.DataFrame({
+        'Target': list(all_results.keys()),
+        'Train RMSE': [all_results[t]['train_rmse'] for t in all_results],
+        'Test RMSE': [all_results[t]['test_rmse'] for t in all_results],
+        'Test MAE': [all_results[t]['test_mae'] for t in all_results],
+        'Test R2': [all_results[t]['test_r2'] for t in all_results],
+        'CV RMSE': [all_results[t]['cv_rmse_mean'] for t in all_results]
+    })
+
+    print("\n" + summary_df.to_string(index=False))
+    print("\n" + "="*80)
+
+    # Save summary to CSV
+    summary_df.to_csv('models_lr/model_performance_summary_lr.csv', index=False)
+    print("\nSaved performance summary to: models_lr/model_performance_summary_lr.csv")
+
+    # Per-fold walk-forward evaluation
+    walk_forward_df = pd.concat([all_results[t]['walk_forward'].assign(target=t) for t in all_results], ignore_index=True)
+    walk_forward_df = walk_forward_df[['target'] + [col for col in walk_forward_df.columns if col != 'target']]
+    walk_forward_df.to_csv('models_lr/walk_forward_lr.csv', index=False)
+    print("Saved walk-forward evaluation to: models_lr/walk_forward_lr.csv")
+    return summary_df
+
 
 # ============================================================================
-# FINAL SUMMARY
+# STEP 7: VISUALIZATIONS
 # ============================================================================
-print("\n" + "="*80)
-print("TRAINING COMPLETE!")
-print("="*80)
-print(f"\nTrained {len(all_results)} Linear Regression models for:")
-for target in all_results.keys():
-    print(f"  - {target}")
-
-print(f"\nFiles saved:")
-print(f"  - models_lr/ directory with {len(all_results)*2} model and scaler files")
-print(f"  - models_lr/model_performance_summary_lr.csv")
-print(f"  - graphs/model_evaluations/multi_target_evaluation_lr.png")
-print(f"  - graphs/model_evaluations/model_comparison_lr.png")
-print("="*80)
+def plot_results(all_results, summary_df):
+    print("\n[STEP 7] Creating comprehensive visualizations...")
+
+    # Create a large figure with subplots for each target
+    n_targets = len(all_results)
+    fig, axes = plt.subplots(n_targets, 3, figsize=(18, 5*n_targets))
+
+    if n_targets == 1:
+        axes = axes.reshape(1, -1)
+
+    for idx, (target_name, results) in enumerate(all_results.items()):
+        y_test = results['y_test']
+        y_test_pred = results['y_test_pred']
+
+        # Plot 1: Actual vs Predicted
+        axes[idx, 0].scatter(y_test, y_test_pred, alpha=0.5, s=10)
+        axes[idx, 0].plot([y_test.min(), y_test.max()], [y_test.min(), y_test.max()], 'r--', lw=2)
+        axes[idx, 0].set_xlabel(f'Actual {target_name}', fontsize=10)
+        axes[idx, 0].set_ylabel(f'Predicted {target_name}', fontsize=10)
+        axes[idx, 0].set_title(f'{target_name}: Actual vs Predicted (Linear Regression)\nRMSE: {results["test_rmse"]:.4f}, R2: {results["test_r2"]:.4f}',
+                               fontsize=11, fontweight='bold')
+        axes[idx, 0].grid(True, alpha=0.3)
+
+        # Plot 2: Time Series (last 200 samples)
+        n_samples = min(200, len(y_test))
+        axes[idx, 1].plot(y_test.iloc[-n_samples:].values, label='Actual', linewidth=1.5, alpha=0.7)
+        axes[idx, 1].plot(y_test_pred[-n_samples:], label='Predicted', linewidth=1.5, alpha=0.7)
+        axes[idx, 1].set_xlabel('Time Index', fontsize=10)
+        axes[idx, 1].set_ylabel(target_name, fontsize=10)
+        axes[idx, 1].set_title(f'{target_name}: Time Series Prediction', fontsize=11, fontweight='bold')
+        axes[idx, 1].legend(fontsize=9)
+        axes[idx, 1].grid(True, alpha=0.3)
+
+        # Plot 3: Top Coefficients (Top 10)
+        top_coefs = results['coefficients'].head(10)
+        axes[idx, 2].barh(range(len(top_coefs)), top_coefs['coefficient'].values)
+        axes[idx, 2].set_yticks(range(len(top_coefs)))
+        axes[idx, 2].set_yticklabels([f[:30] for f in top_coefs['feature'].values], fontsize=8)
+        axes[idx, 2].set_xlabel('Coefficient Value', fontsize=10)
+        axes[idx, 2].set_title(f'{target_name}: Top 10 Coefficients', fontsize=11, fontweight='bold')
+        axes[idx, 2].invert_yaxis()
+        axes[idx, 2].grid(True, alpha=0.3, axis='x')
+
+    plt.tight_layout()
+    plt.savefig('graphs/model_evaluations/multi_target_evaluation_lr.png', dpi=300, bbox_inches='tight')
+    print("  - Saved: graphs/model_evaluations/multi_target_evaluation_lr.png")
+
+    # Create comparison bar chart
+    fig2, ax = plt.subplots(1, 1, figsize=(12, 6))
+    x = np.arange(len(summary_df))
+    width = 0.25
+
+    ax.bar(x - width, summary_df['Train RMSE'], width, label='Train RMSE', alpha=0.8)
+    ax.bar(x, summary_df['Test RMSE'], width, label='Test RMSE', alpha=0.8)
+    ax.bar(x + width, summary_df['CV RMSE'], width, label='CV RMSE', alpha=0.8)
+
+    ax.set_xlabel('Target Variable', fontsize=12, fontweight='bold')
+    ax.set_ylabel('RMSE', fontsize=12, fontweight='bold')
+    ax.set_title('Linear Regression Model Performance Comparison', fontsize=14, fontweight='bold')
+    ax.set_xticks(x)
+    ax.set_xticklabels(summary_df['Target'], rotation=45, ha='right')
+    ax.legend()
+    ax.grid(True, alpha=0.3, axis='y')
+
+    plt.tight_layout()
+    plt.savefig('graphs/model_evaluations/model_comparison_lr.png', dpi=300, bbox_inches='tight')
+    print("  - Saved: graphs/model_evaluations/model_comparison_lr.png")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-target linear regression training")
+    parser.add_argument('--data', nargs='+', default=DATA_SOURCES, help='one source per sensor (files or directories)')
+    parser.add_argument('--chunk-rows', type=int, default=0,
+                        help='stream the data in chunks of this many rows instead of loading it (0 = in memory)')
+    parser.add_argument('--cv-folds', type=int, default=CV_FOLDS, help='walk-forward (TimeSeriesSplit) folds')
+    args = parser.parse_args()
+
+    print("="*80)
+    print("MULTI-TARGET AIR QUALITY PREDICTION SYSTEM - LINEAR REGRESSION")
+    print("="*80)
+
+    if args.chunk_rows > 0:
+        fitted = train_chunked(args.data, args.chunk_rows, args.cv_folds)
+    else:
+        fitted = train_in_memory(args.data, args.cv_folds)
+    save_models(fitted, data={'sources': args.data}, cv_folds=args.cv_folds)
+    all_results = {target: results for target, (_, _, results) in fitted.items()}
+    summary_df = save_summary(all_results)
+    plot_results(all_results, summary_df)
+
+    # ========================================================================
+    # FINAL SUMMARY
+    # ========================================================================
+    print("\n" + "="*80)
+    print("TRAINING COMPLETE!")
+    print("="*80)
+    print(f"\nTrained {len(all_results)} Linear Regression models for:")
+    for target in all_results.keys():
+        print(f"  - {target}")
+
+    print(f"\nFiles saved:")
+    print(f"  - {ARTIFACT} ({len(all_results)} models: coefficients, scalers, feature order)")
+    print(f"  - models_lr/model_performance_summary_lr.csv")
+    print(f"  - models_lr/walk_forward_lr.csv")
+    print(f"  - graphs/model_evaluations/multi_target_evaluation_lr.png")
+    print(f"  - graphs/model_evaluations/model_comparison_lr.png")
+    print("="*80)
+
+
+if __name__ == '__main__':
+    main()
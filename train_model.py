@@ -2,197 +2,283 @@ import pandas as pd
 import numpy as np
 from sklearn.preprocessing import StandardScaler
 from sklearn.metrics import mean_squared_error, mean_absolute_error, r2_score
-from sklearn.model_selection import TimeSeriesSplit
 from sklearn.linear_model import LinearRegression
-import joblib
 import warnings
+import argparse
 import os
+from devices import device_ids_of_frame
+from features import target_feature_names
+from inference import sklearn_params
+from model_artifact import artifact_path, write_artifact
+from training_data import load_training_data
 warnings.filterwarnings('ignore')
 
 # Set random seed for reproducibility
 np.random.seed(42)
 
-print("="*80)
-print("AIR QUALITY PREDICTION SYSTEM - LINEAR REGRESSION")
-print("Training on sensor_data.xlsx")
-print("="*80)
+# The pipeline's segment store once it exists (it imports sensor_data.xlsx on first run)
+STORE_DIR = os.getenv('STORAGE_DIR', 'sensor_store')
+DATA_FILE = os.getenv('TRAINING_DATA') or (STORE_DIR if os.path.isdir(STORE_DIR) else 'sensor_data.xlsx')
+MODELS_DIR = 'models_lr'
+SENSOR_COLS = ['pm2_5', 'pm10', 'co2', 'tvoc', 'temperature', 'humidity']
+# Read alongside the sensor columns so lags never cross from one device to another
+DEVICE_COLS = ['end_device_ids', 'device_id']
+N_LAGS = 2
+ROLLING_WINDOW = 3  # Smaller window due to limited data
+
 
 # ============================================================================
 # STEP 1: LOAD DATA
 # ============================================================================
-print("\n[STEP 1] Loading data from sensor_data.xlsx...")
+def load_data(path=DATA_FILE, start=None, end=None):
+    print(f"\n[STEP 1] Loading data from {path}...")
+    try:
+        # Only the sensor columns, memory-mapped from Parquet where available
+        df = load_training_data(path, columns=SENSOR_COLS + DEVICE_COLS, start=start, end=end)
+        print(f"  - Data shape: {df.shape}")
+        print(f"  - Columns: {df.columns.tolist()}")
+    except Exception as e:
+        print(f"ERROR loading data: {e}")
+        raise
+    return df
 
-try:
-    df = pd.read_excel('sensor_data.xlsx')
-    print(f"  - Data shape: {df.shape}")
-    print(f"  - Columns: {df.columns.tolist()}")
-    
-except Exception as e:
-    print(f"ERROR loading data: {e}")
-    raise
 
 # ============================================================================
-# STEP 2: PREPROCESS DATA
+# STEP 2-3: PREPROCESS AND CLEAN DATA
 # ============================================================================
-print("\n[STEP 2] Preprocessing data...")
+def preprocess(df):
+    """
+    Sorted, gap-filled sensor columns plus `device_id`; gaps are only filled
+    from the same device's readings. Returns (df, available_cols).
+    """
+    print("\n[STEP 2] Preprocessing data...")
 
-# Parse datetime and set as index
-if 'timestamp' in df.columns:
-    df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
-    df = df.sort_values('timestamp')
-    df.set_index('timestamp', inplace=True)
-    print(f"  - Set datetime index from 'timestamp'")
+    df['device_id'] = device_ids_of_frame(df)
+    print(f"  - Devices: {df['device_id'].nunique()}")
 
-# Keep only sensor columns
-sensor_cols = ['pm2_5', 'pm10', 'co2', 'tvoc', 'temperature', 'humidity']
-available_cols = [col for col in sensor_cols if col in df.columns]
-df = df[available_cols]
-print(f"  - Kept {len(available_cols)} sensor columns: {available_cols}")
+    # Parse datetime and set as index
+    if 'timestamp' in df.columns:
+        df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
+        df = df.sort_values('timestamp', kind='stable')
+        df.set_index('timestamp', inplace=True)
+        print(f"  - Set datetime index from 'timestamp'")
 
-# ============================================================================
-# STEP 3: CLEAN DATA
-# ============================================================================
-print("\n[STEP 3] Cleaning data...")
+    # Keep only sensor columns
+    available_cols = [col for col in SENSOR_COLS if col in df.columns]
+    df = df[['device_id'] + available_cols]
+    print(f"  - Kept {len(available_cols)} sensor columns: {available_cols}")
 
-# Drop rows where ALL sensor values are NaN
-rows_before = len(df)
-df = df.dropna(how='all', subset=available_cols)
-print(f"  - Removed {rows_before - len(df)} completely empty rows")
+    print("\n[STEP 3] Cleaning data...")
 
-# Fill remaining missing values
-print(f"  - Missing values before filling: {df.isnull().sum().sum()}")
-df = df.ffill().bfill()
-df = df.interpolate(method='linear', limit_direction='both')
-print(f"  - Missing values after filling: {df.isnull().sum().sum()}")
+    # Drop rows where ALL sensor values are NaN
+    rows_before = len(df)
+    df = df.dropna(how='all', subset=available_cols)
+    print(f"  - Removed {rows_before - len(df)} completely empty rows")
 
-# Remove any remaining NaN rows
-rows_before = len(df)
-df = df.dropna()
-print(f"  - Removed {rows_before - len(df)} rows with remaining NaN values")
-print(f"  - Final data shape: {df.shape}")
+    # Fill remaining missing values within each device
+    print(f"  - Missing values before filling: {df[available_cols].isnull().sum().sum()}")
+    by_device = df.groupby('device_id', sort=False)[available_cols]
+    df[available_cols] = by_device.ffill()
+    df[available_cols] = df.groupby('device_id', sort=False)[available_cols].bfill()
+    print(f"  - Missing values after filling: {df[available_cols].isnull().sum().sum()}")
+
+    # Remove any remaining NaN rows
+    rows_before = len(df)
+    df = df.dropna()
+    print(f"  - Removed {rows_before - len(df)} rows with remaining NaN values")
+    print(f"  - Final data shape: {df.shape}")
+
+    if len(df) < 10:
+        print("\n⚠️  WARNING: Very few data points available. Model accuracy may be limited.")
+        print("   Recommendation: Collect more data for better predictions.")
+    return df, available_cols
 
-if len(df) < 10:
-    print("\n⚠️  WARNING: Very few data points available. Model accuracy may be limited.")
-    print("   Recommendation: Collect more data for better predictions.")
 
 # ============================================================================
-# STEP 4: TRAIN LINEAR REGRESSION MODELS FOR EACH TARGET
+# STEP 4: FEATURES AND MODELS
 # ============================================================================
-print("\n[STEP 4] Training Linear Regression models for each target...")
-
-# Create directory for models
-os.makedirs('models_lr', exist_ok=True)
-
-# Store results for all models
-all_results = {}
-all_models = {}
-all_scalers = {}
-all_feature_names = {}
-
-for target_col in available_cols:
-    print(f"\n{'='*80}")
-    print(f"TRAINING MODEL FOR: {target_col.upper()}")
-    print(f"{'='*80}")
-    
-    # Prepare features (all columns except current target)
-    feature_cols = [col for col in available_cols if col != target_col]
-    
-    # Create lag features for this target
-    df_temp = df.copy()
-    df_temp[f'{target_col}_lag1'] = df_temp[target_col].shift(1)
-    df_temp[f'{target_col}_lag2'] = df_temp[target_col].shift(2)
-    
-    # Create rolling mean features for other pollutants
-    rolling_window = 3  # Smaller window due to limited data
-    for col in feature_cols:
-        rolling_col = f'{col}_rolling_mean_{rolling_window}'
-        df_temp[rolling_col] = df_temp[col].rolling(window=rolling_window, min_periods=1).mean()
-    
-    # Drop NaN rows created by lag features
-    df_temp = df_temp.dropna()
-    
-    if len(df_temp) < 5:
-        print(f"  ⚠️  Skipping {target_col}: Not enough data after feature engineering")
-        continue
-    
-    # Prepare X and y
-    all_features = [col for col in df_temp.columns if col != target_col]
-    X = df_temp[all_features]
-    y = df_temp[target_col]
-    
-    print(f"  - Feature matrix shape: {X.shape}")
-    print(f"  - Target shape: {y.shape}")
-    print(f"  - Target mean: {y.mean():.2f}, std: {y.std():.2f}")
-    
+def build_feature_matrix(df, cols):
+    """
+    Every feature any target uses, computed once for all targets.
+
+    Columns are the raw values, each lag and each rolling mean of every
+    sensor column (the layout of features.FeatureState.base_vector). With a
+    `device_id` column they are taken over each device's own rows, as the
+    pipeline keeps one FeatureState per device. The first N_LAGS rows of
+    every device, which have no lags yet, are dropped; the others keep
+    their order in `df`. Returns (matrix, column names).
+    """
+    names = list(cols)
+    for k in range(1, N_LAGS + 1):
+        names += [f'{col}_lag{k}' for col in cols]
+    names += [f'{col}_rolling_mean_{ROLLING_WINDOW}' for col in cols]
+
+    if 'device_id' in df.columns:
+        groups = list(df.groupby('device_id', sort=False).indices.values())
+    else:
+        groups = [np.arange(len(df))]
+    parts, rows = [], []
+    for idx in groups:
+        if len(idx) > N_LAGS:
+            parts.append(_lagged_features(df[cols].iloc[idx]))
+            rows.append(idx[N_LAGS:])
+    if not parts:
+        return np.empty((0, len(names))), names
+    if len(parts) == 1:
+        return parts[0], names
+    return np.vstack(parts)[np.argsort(np.concatenate(rows), kind='stable')], names
+
+
+def _lagged_features(frame):
+    """build_feature_matrix for the rows of one device."""
+    values = frame.to_numpy(dtype=float)
+    rolling = frame.rolling(window=ROLLING_WINDOW, min_periods=1).mean().to_numpy()
+    blocks = [values[N_LAGS:]]
+    for k in range(1, N_LAGS + 1):
+        blocks.append(values[N_LAGS - k:len(values) - k])
+    blocks.append(rolling[N_LAGS:])
+    return np.hstack(blocks)
+
+
+def target_features(target_col, cols):
+    """Model inputs for one target (the layout mqtt_pipeline.py serves)."""
+    return target_feature_names(target_col, cols, ROLLING_WINDOW, N_LAGS)
+
+
+def split_index(n):
     # Chronological split (80/20)
-    split_idx = max(int(len(df_temp) * 0.8), len(df_temp) - 2)  # At least 2 test samples
-    X_train, X_test = X.iloc[:split_idx], X.iloc[split_idx:]
-    y_train, y_test = y.iloc[:split_idx], y.iloc[split_idx:]
-    
-    print(f"  - Train set: {X_train.shape[0]} samples")
-    print(f"  - Test set: {X_test.shape[0]} samples")
-    
-    # Normalize features
+    return max(int(n * 0.8), n - 2)  # At least 2 test samples
+
+
+def fitted_scaler(mean, var, n_samples, feature_names):
+    """A StandardScaler in the state fit() would leave it in, from precomputed moments."""
     scaler = StandardScaler()
-    X_train_scaled = scaler.fit_transform(X_train)
-    X_test_scaled = scaler.transform(X_test)
-    
-    # Train Linear Regression model
-    print(f"  - Training Linear Regression model...")
+    scaler.n_features_in_ = len(feature_names)
+    scaler.feature_names_in_ = np.asarray(feature_names, dtype=object)
+    scaler.n_samples_seen_ = np.int64(n_samples)
+    scaler.mean_ = mean.copy()
+    scaler.var_ = var.copy()
+    scaler.scale_ = np.where(var > 10 * np.finfo(float).eps, np.sqrt(var), 1.0)
+    return scaler
+
+
+def fitted_model(coef, intercept, gram, n_samples):
+    """A LinearRegression in the state fit() would leave it in."""
     model = LinearRegression(fit_intercept=True, n_jobs=-1)
-    model.fit(X_train_scaled, y_train)
-    print(f"  - Model trained successfully")
-    
-    # Evaluate on test set
-    y_train_pred = model.predict(X_train_scaled)
-    y_test_pred = model.predict(X_test_scaled)
-    
-    train_rmse = np.sqrt(mean_squared_error(y_train, y_train_pred))
-    test_rmse = np.sqrt(mean_squared_error(y_test, y_test_pred))
-    train_mae = mean_absolute_error(y_train, y_train_pred)
-    test_mae = mean_absolute_error(y_test, y_test_pred)
-    train_r2 = r2_score(y_train, y_train_pred)
-    test_r2 = r2_score(y_test, y_test_pred)
-    
-    print(f"\n  RESULTS:")
-    print(f"    Train - RMSE: {train_rmse:.4f}, MAE: {train_mae:.4f}, R2: {train_r2:.4f}")
-    print(f"    Test  - RMSE: {test_rmse:.4f}, MAE: {test_mae:.4f}, R2: {test_r2:.4f}")
-    
-    # Store results
-    all_results[target_col] = {
-        'train_rmse': train_rmse,
-        'test_rmse': test_rmse,
-        'train_mae': train_mae,
-        'test_mae': test_mae,
-        'train_r2': train_r2,
-        'test_r2': test_r2,
-    }
-    
-    # Save model, scaler, and feature names
-    model_filename = f'models_lr/{target_col}_model.pkl'
-    scaler_filename = f'models_lr/{target_col}_scaler.pkl'
-    features_filename = f'models_lr/{target_col}_features.pkl'
-    
-    joblib.dump(model, model_filename)
-    joblib.dump(scaler, scaler_filename)
-    joblib.dump(all_features, features_filename)
-    
-    all_models[target_col] = model
-    all_scalers[target_col] = scaler
-    all_feature_names[target_col] = all_features
-    
-    print(f"  - Saved: {model_filename}")
-    print(f"  - Saved: {scaler_filename}")
-    print(f"  - Saved: {features_filename}")
+    model.n_features_in_ = len(coef)
+    model.coef_ = coef
+    model.intercept_ = np.float64(intercept)
+    # Singular values of the centered design matrix, from its Gram matrix
+    eigenvalues = np.clip(np.linalg.eigvalsh(gram)[::-1], 0.0, None)
+    model.singular_ = np.sqrt(eigenvalues[:min(n_samples, len(coef))])
+    model.rank_ = int(np.linalg.matrix_rank(gram, hermitian=True))
+    return model
+
+
+def fit_targets(matrix, names, cols):
+    """
+    Fits every target from one shared feature matrix.
+
+    The training rows are standardized once and reduced to one Gram matrix
+    Z'Z. Each target's inputs and its own (raw) column are all columns of
+    that matrix, so its normal equations are a sub-block: the fit is a
+    small solve per target instead of a pass over the data. The solution
+    is the minimum-norm least-squares fit, as LinearRegression computes.
+
+    Returns {target: (model, scaler, feature names, results)}.
+    """
+    n = len(matrix)
+    split_idx = split_index(n)
+    train, test = matrix[:split_idx], matrix[split_idx:]
+
+    mean = train.mean(axis=0)
+    var = train.var(axis=0)
+    scale = np.where(var > 10 * np.finfo(float).eps, np.sqrt(var), 1.0)
+    z_train = (train - mean) / scale
+    z_test = (test - mean) / scale
+    gram = z_train.T @ z_train
+
+    lookup = {name: i for i, name in enumerate(names)}
+    fitted = {}
+    for target_col in cols:
+        all_features = target_features(target_col, cols)
+        idx = [lookup[name] for name in all_features]
+        j = lookup[target_col]
+        sub_gram = gram[np.ix_(idx, idx)]
+
+        # Standardized inputs have zero training mean, so the intercept is the target's mean
+        coef = np.linalg.lstsq(sub_gram, gram[idx, j] * scale[j], rcond=None)[0]
+        intercept = mean[j]
+
+        y_train, y_test = train[:, j], test[:, j]
+        y_train_pred = z_train[:, idx] @ coef + intercept
+        y_test_pred = z_test[:, idx] @ coef + intercept
+        results = {
+            'train_rmse': np.sqrt(mean_squared_error(y_train, y_train_pred)),
+            'test_rmse': np.sqrt(mean_squared_error(y_test, y_test_pred)),
+            'train_mae': mean_absolute_error(y_train, y_train_pred),
+            'test_mae': mean_absolute_error(y_test, y_test_pred),
+            'train_r2': r2_score(y_train, y_train_pred),
+            'test_r2': r2_score(y_test, y_test_pred),
+            'n_train': len(y_train),
+            'n_test': len(y_test),
+            'target_mean': float(np.mean(matrix[:, j])),
+            'target_std': float(np.std(matrix[:, j], ddof=1)) if n > 1 else float('nan'),
+        }
+        scaler = fitted_scaler(mean[idx], var[idx], split_idx, all_features)
+        model = fitted_model(coef, intercept, sub_gram, split_idx)
+        fitted[target_col] = (model, scaler, all_features, results)
+    return fitted
+
+
+def train_all(df, cols):
+    print("\n[STEP 4] Training Linear Regression models for each target...")
+    matrix, names = build_feature_matrix(df, cols)
+    if len(matrix) < 5:
+        print(f"  ⚠️  Skipping all targets: Not enough data after feature engineering")
+        return {}
+    print(f"  - Shared feature matrix shape: {matrix.shape}")
+
+    fitted = fit_targets(matrix, names, cols)
+    for target_col, (model, scaler, all_features, results) in fitted.items():
+        print(f"\n{'='*80}")
+        print(f"MODEL FOR: {target_col.upper()}")
+        print(f"{'='*80}")
+        print(f"  - Feature matrix shape: {(len(matrix), len(all_features))}")
+        print(f"  - Target mean: {results['target_mean']:.2f}, std: {results['target_std']:.2f}")
+        print(f"  - Train set: {results['n_train']} samples")
+        print(f"  - Test set: {results['n_test']} samples")
+        print(f"\n  RESULTS:")
+        print(f"    Train - RMSE: {results['train_rmse']:.4f}, MAE: {results['train_mae']:.4f}, R2: {results['train_r2']:.4f}")
+        print(f"    Test  - RMSE: {results['test_rmse']:.4f}, MAE: {results['test_mae']:.4f}, R2: {results['test_r2']:.4f}")
+    return fitted
+
+
+def save_models(fitted, directory=MODELS_DIR, **info):
+    """Writes every target's model, scaler and feature order as one artifact (see model_artifact.py)."""
+    if not fitted:
+        return None
+    print()
+    params = {target_col: sklearn_params(model, scaler, all_features)
+              for target_col, (model, scaler, all_features, _) in fitted.items()}
+    metrics = {target_col: results for target_col, (_, _, _, results) in fitted.items()}
+    path = artifact_path(directory)
+    manifest = write_artifact(path, params, metrics=metrics, **info)
+    print(f"  - Saved: {path} (version {manifest['version']}, {len(params)} models)")
+    return manifest
+
 
 # ============================================================================
 # STEP 5: SUMMARY TABLE
 # ============================================================================
-print("\n" + "="*80)
-print("MODEL PERFORMANCE SUMMARY")
-print("="*80)
+def save_summary(fitted, directory=MODELS_DIR):
+    print("\n" + "="*80)
+    print("MODEL PERFORMANCE SUMMARY")
+    print("="*80)
 
-if all_results:
+    if not fitted:
+        return
+    all_results = {target: results for target, (_, _, _, results) in fitted.items()}
     summary_df = pd.DataFrame({
         'Target': list(all_results.keys()),
         'Train RMSE': [all_results[t]['train_rmse'] for t in all_results],
@@ -200,29 +286,52 @@ if all_results:
         'Test MAE': [all_results[t]['test_mae'] for t in all_results],
         'Test R2': [all_results[t]['test_r2'] for t in all_results],
     })
-    
+
     print("\n" + summary_df.to_string(index=False))
     print("\n" + "="*80)
-    
+
     # Save summary to CSV
-    summary_df.to_csv('models_lr/model_performance_summary.csv', index=False)
-    print("\nSaved performance summary to: models_lr/model_performance_summary.csv")
+    summary_df.to_csv(f'{directory}/model_performance_summary.csv', index=False)
+    print(f"\nSaved performance summary to: {directory}/model_performance_summary.csv")
 
-# ============================================================================
-# FINAL SUMMARY
-# ============================================================================
-print("\n" + "="*80)
-print("TRAINING COMPLETE!")
-print("="*80)
-print(f"\nTrained {len(all_results)} Linear Regression models for:")
-for target in all_results.keys():
-    print(f"  - {target}")
-
-print(f"\nFiles saved:")
-print(f"  - models_lr/ directory with {len(all_results)*3} files (model + scaler + features)")
-print(f"  - models_lr/model_performance_summary.csv")
-print("="*80)
-print("\nNext steps:")
-print("  1. Restart mqtt_pipeline.py to load these models")
-print("  2. Models will be available for predictions via API")
-print("="*80)
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the linear regression models served by mqtt_pipeline.py")
+    parser.add_argument('--data', default=DATA_FILE, help='segment store, Parquet/Feather file or directory, or workbook')
+    parser.add_argument('--from', dest='start', help='only train on records at or after this time')
+    parser.add_argument('--to', dest='end', help='only train on records before this time')
+    args = parser.parse_args()
+
+    print("="*80)
+    print("AIR QUALITY PREDICTION SYSTEM - LINEAR REGRESSION")
+    print(f"Training on {args.data}")
+    print("="*80)
+
+    df, available_cols = preprocess(load_data(args.data, args.start, args.end))
+    fitted = train_all(df, available_cols)
+    save_models(fitted, data={'source': args.data, 'from': args.start, 'to': args.end})
+    save_summary(fitted)
+
+    # ========================================================================
+    # FINAL SUMMARY
+    # ========================================================================
+    print("\n" + "="*80)
+    print("TRAINING COMPLETE!")
+    print("="*80)
+    print(f"\nTrained {len(fitted)} Linear Regression models for:")
+    for target in fitted.keys():
+        print(f"  - {target}")
+
+    print(f"\nFiles saved:")
+    print(f"  - {artifact_path(MODELS_DIR)} ({len(fitted)} models: coefficients, scalers, feature order)")
+    print(f"  - {MODELS_DIR}/model_performance_summary.csv")
+    print("="*80)
+    print("\nNext steps:")
+    print("  1. A running mqtt_pipeline.py picks these models up within MODEL_WATCH_INTERVAL seconds")
+    print("     (or at once via POST /api/models/reload); no restart needed")
+    print("  2. Models will be available for predictions via API")
+    print("="*80)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,268 @@
+"""
+Training data from columnar files.
+
+Reads Parquet / Feather files memory-mapped, only the requested columns,
+and only the row groups whose time range overlaps the requested one.
+Sources can be single files, directories of files (e.g. the pipeline's
+segment store, open JSON lines segment included) or Excel workbooks,
+which are read from a converted Parquet copy next to them when one is
+up to date.
+
+Convert a workbook once with:
+    python training_data.py convert sensor_data.xlsx [more.xlsx ...] [--chunk-rows 100000]
+"""
+import os
+import glob
+import logging
+import argparse
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyarrow.feather as feather
+from datetime import datetime
+from history import epochs_from_series
+from storage import SegmentStorage
+
+logger = logging.getLogger(__name__)
+
+# Columns stored as timestamps when converting, so row groups carry time statistics
+TIME_COLUMNS = ['timestamp', 'received_at']
+COLUMNAR_SUFFIXES = ('.parquet', '.feather', '.arrow')
+CHUNK_ROWS = 100_000
+
+
+def to_datetimes(series):
+    """Naive datetimes (UTC for zone-aware input), as history.to_epoch reads them."""
+    return pd.to_datetime(epochs_from_series(series), unit='s')
+
+
+def _naive_utc(value):
+    ts = pd.Timestamp(value)
+    return ts.tz_convert('UTC').tz_localize(None) if ts.tz is not None else ts
+
+
+def _bound(value):
+    return None if value is None else _naive_utc(value)
+
+
+def converted_path(path):
+    return os.path.splitext(path)[0] + '.parquet'
+
+
+def convert_excel(path, out=None, chunk_rows=CHUNK_ROWS):
+    """Writes a workbook as Parquet with `chunk_rows`-row row groups; returns the output path."""
+    out = out or converted_path(path)
+    df = pd.read_excel(path)
+    for col in TIME_COLUMNS:
+        if col in df.columns:
+            df[col] = to_datetimes(df[col])
+    # Mixed-type text columns (e.g. TTN envelopes) are kept as strings
+    for col in df.columns[df.dtypes == object]:
+        df[col] = df[col].map(lambda v: None if v is None or v != v else str(v))
+    tmp = out + '.tmp'
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), tmp, row_group_size=chunk_rows)
+    os.replace(tmp, out)
+    return out
+
+
+def resolve_files(source):
+    """The data files behind one source, oldest first."""
+    if os.path.isdir(source):
+        files = sorted(f for f in glob.glob(os.path.join(source, '*'))
+                       if f.endswith(COLUMNAR_SUFFIXES) or f.endswith('.jsonl'))
+        if not files:
+            raise FileNotFoundError(f"no Parquet, Feather or JSON lines files in {source}")
+        return files
+    if source.endswith(('.xlsx', '.xls')):
+        parquet = converted_path(source)
+        if os.path.exists(parquet) and (not os.path.exists(source) or os.path.getmtime(parquet) >= os.path.getmtime(source)):
+            return [parquet]
+    if not os.path.exists(source):
+        raise FileNotFoundError(source)
+    return [source]
+
+
+def _overlapping_row_groups(pf, time_column, start, end):
+    """Row groups whose time statistics may fall in [start, end); all of them without statistics."""
+    names = pf.schema_arrow.names
+    if time_column not in names:
+        return list(range(pf.num_row_groups))
+    j = names.index(time_column)
+    keep = []
+    for i in range(pf.num_row_groups):
+        stats = pf.metadata.row_group(i).column(j).statistics
+        if stats is None or not stats.has_min_max or not isinstance(stats.min, datetime):
+            # Text timestamps have no usable ordering; filtered after reading
+            keep.append(i)
+            continue
+        low, high = _naive_utc(stats.min), _naive_utc(stats.max)
+        if (end is None or low < end) and (start is None or high >= start):
+            keep.append(i)
+    return keep
+
+
+def read_file(path, columns=None, time_column=None, start=None, end=None):
+    """One file's `columns` (those it has) as a DataFrame, skipping row groups outside [start, end)."""
+    if path.endswith('.parquet'):
+        pf = pq.ParquetFile(path, memory_map=True)
+        wanted = [c for c in columns if c in pf.schema_arrow.names] if columns else None
+        if start is None and end is None:
+            return pf.read(columns=wanted).to_pandas()
+        groups = _overlapping_row_groups(pf, time_column, start, end)
+        if not groups:
+            return pd.DataFrame(columns=wanted)
+        return pf.read_row_groups(groups, columns=wanted).to_pandas()
+    if path.endswith(('.feather', '.arrow')):
+        wanted = None
+        if columns:
+            names = pa.ipc.open_file(pa.memory_map(path)).schema.names
+            wanted = [c for c in columns if c in names]
+        return feather.read_table(path, columns=wanted, memory_map=True).to_pandas()
+    if path.endswith('.jsonl'):
+        df = pd.DataFrame(SegmentStorage._read_jsonl(path))
+    else:
+        logger.warning(f"⚠️  {path} has no Parquet copy; reading the workbook "
+                       f"(run `python training_data.py convert {path}`)")
+        df = pd.read_excel(path)
+    return df[[c for c in columns if c in df.columns]] if columns else df
+
+
+def load_training_data(sources, columns=None, time_column='timestamp', start=None, end=None):
+    """
+    Training records from one or more sources as a single DataFrame.
+
+    Only `columns` plus `time_column` are read (all columns if None). With
+    `start` / `end` (anything pandas parses as a time) only records in
+    [start, end) are returned. `time_column` comes back as naive datetimes
+    (UTC for zone-aware input), the same way the pipeline reads timestamps.
+    """
+    if isinstance(sources, str):
+        sources = [sources]
+    start, end = _bound(start), _bound(end)
+    wanted = None
+    if columns is not None:
+        wanted = list(dict.fromkeys(([time_column] if time_column else []) + list(columns)))
+
+    frames = []
+    for source in sources:
+        for path in resolve_files(source):
+            frame = read_file(path, wanted, time_column, start, end)
+            if len(frame):
+                frames.append(frame)
+    if not frames:
+        return pd.DataFrame(columns=wanted)
+    df = pd.concat(frames, ignore_index=True)
+
+    if time_column in df.columns:
+        df[time_column] = to_datetimes(df[time_column])
+        if start is not None or end is not None:
+            keep = np.ones(len(df), dtype=bool)
+            if start is not None:
+                keep &= (df[time_column] >= start).to_numpy()
+            if end is not None:
+                keep &= (df[time_column] < end).to_numpy()
+            df = df[keep].reset_index(drop=True)
+    return df
+
+
+def iter_file(path, columns=None, chunk_rows=CHUNK_ROWS):
+    """One file's `columns` (those it has) as DataFrames of at most `chunk_rows` rows."""
+    if path.endswith('.parquet'):
+        pf = pq.ParquetFile(path, memory_map=True)
+        wanted = [c for c in columns if c in pf.schema_arrow.names] if columns else None
+        for batch in pf.iter_batches(batch_size=chunk_rows, columns=wanted):
+            yield batch.to_pandas()
+        return
+    if path.endswith(('.feather', '.arrow')):
+        reader = pa.ipc.open_file(pa.memory_map(path))
+        wanted = [c for c in columns if c in reader.schema.names] if columns else None
+        for i in range(reader.num_record_batches):
+            table = pa.Table.from_batches([reader.get_batch(i)])
+            table = table.select(wanted) if wanted is not None else table
+            for batch in table.to_batches(max_chunksize=chunk_rows):
+                yield batch.to_pandas()
+        return
+    df = read_file(path, columns)
+    for offset in range(0, len(df), chunk_rows):
+        yield df.iloc[offset:offset + chunk_rows].reset_index(drop=True)
+
+
+def iter_training_data(sources, columns=None, time_column='timestamp', start=None, end=None, chunk_rows=CHUNK_ROWS):
+    """
+    load_training_data one chunk at a time, for data that does not fit in
+    memory: DataFrames of at most `chunk_rows` rows (fewer after the time
+    filter), in file order.
+    """
+    if isinstance(sources, str):
+        sources = [sources]
+    start, end = _bound(start), _bound(end)
+    wanted = None
+    if columns is not None:
+        wanted = list(dict.fromkeys(([time_column] if time_column else []) + list(columns)))
+    for source in sources:
+        for path in resolve_files(source):
+            for chunk in iter_file(path, wanted, chunk_rows):
+                if time_column in chunk.columns:
+                    chunk[time_column] = to_datetimes(chunk[time_column])
+                    if start is not None:
+                        chunk = chunk[(chunk[time_column] >= start).to_numpy()]
+                    if end is not None:
+                        chunk = chunk[(chunk[time_column] < end).to_numpy()]
+                if len(chunk):
+                    yield chunk.reset_index(drop=True)
+
+
+def merge_by_time(streams, time_column):
+    """
+    Merges chunk streams, each already in `time_column` order, into one
+    stream in time order (ties keep stream order). Raises ValueError if a
+    stream goes back in time.
+    """
+    iters = [iter(stream) for stream in streams]
+    buffers = [next(it, None) for it in iters]
+    last_seen = [None] * len(iters)
+
+    def checked(i, chunk):
+        if chunk is not None and len(chunk):
+            times = chunk[time_column]
+            if not times.is_monotonic_increasing or (last_seen[i] is not None and times.iloc[0] < last_seen[i]):
+                raise ValueError(f"source {i + 1} is not in {time_column} order")
+            last_seen[i] = times.iloc[-1]
+        return chunk
+
+    buffers = [checked(i, b) for i, b in enumerate(buffers)]
+    while True:
+        live = [i for i, b in enumerate(buffers) if b is not None]
+        if not live:
+            return
+        # Nothing still unread can be earlier than the earliest buffered chunk end
+        horizon = min(buffers[i][time_column].iloc[-1] for i in live)
+        parts = []
+        for i in live:
+            chunk = buffers[i]
+            n = int(chunk[time_column].searchsorted(horizon, side='right'))
+            parts.append(chunk.iloc[:n])
+            rest = chunk.iloc[n:]
+            buffers[i] = rest if len(rest) else checked(i, next(iters[i], None))
+        merged = pd.concat(parts, ignore_index=True)
+        if len(live) > 1:
+            merged = merged.sort_values(time_column, kind='mergesort', ignore_index=True)
+        yield merged
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert Excel training data to Parquet")
+    sub = parser.add_subparsers(dest='command', required=True)
+    convert = sub.add_parser('convert', help='write <workbook>.parquet next to each workbook')
+    convert.add_argument('workbooks', nargs='+')
+    convert.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS, help='rows per Parquet row group')
+    args = parser.parse_args()
+
+    for path in args.workbooks:
+        out = convert_excel(path, chunk_rows=args.chunk_rows)
+        print(f"Converted {path} -> {out} ({pq.ParquetFile(out).metadata.num_rows} rows)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,14 @@
+"""
+WSGI entry point for serving the API with a multi-worker server, e.g.
+
+    PIPELINE_ROLE=ingest python mqtt_pipeline.py
+    gunicorn -w 4 -k gthread --threads 8 -b 0.0.0.0:5000 wsgi:app
+
+Each worker reads device state published by the ingest process; none of
+them connect to MQTT or write to storage.
+"""
+import os
+
+os.environ.setdefault("PIPELINE_ROLE", "api")
+
+from mqtt_pipeline import app  # noqa: E402,F401